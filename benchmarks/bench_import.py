@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""Measure how long importing each kale module takes in a fresh interpreter.
+
+Every module is imported --repeat times in a new python process with -X importtime, the best cumulative import
+time is reported together with the heavy third party packages the import pulled in.  --budget module=ms makes
+the script exit with an error if a module takes longer, to keep the task process import path fast."""
+
+# stdlib
+import argparse
+import re
+import subprocess
+import sys
+
+MODULES = [
+    "kale",
+    "kale.services.transport",
+    "kale.services.task",
+    "kale.services.aio",
+    "kale.services.manager",
+    "kale.services.worker",
+    "kale.workflows",
+    "kale.widgets",
+    "kale.fireworks"
+]
+
+HEAVY = ["sanic", "requests", "psutil", "numpy", "networkx", "bqplot", "ipywidgets", "plotly", "fireworks"]
+
+# import time: self [us] | cumulative | imported package
+_IMPORTTIME = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$")
+
+
+def measure(module):
+    """Return the cumulative import time of module in microseconds and the HEAVY packages it imported."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import {}".format(module)],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0:
+        raise ImportError(result.stderr.strip().splitlines()[-1])
+
+    cumulative = None
+    imported = set()
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME.match(line)
+        if match is None:
+            continue
+        name = match.group(4)
+        if name.split(".")[0] in HEAVY:
+            imported.add(name.split(".")[0])
+        if name == module:
+            cumulative = int(match.group(2))
+    return cumulative, sorted(imported)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("modules", nargs="*", default=MODULES, help="modules to import, default = all of kale")
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per module, best time is reported")
+    parser.add_argument("--budget", action="append", default=[],
+                        help="module=milliseconds, fail if the module takes longer to import")
+    args = parser.parse_args()
+
+    budgets = {k: float(v) for k, v in (b.split("=") for b in args.budget)}
+    over = []
+
+    print("{:<28} {:>10}  {}".format("module", "best ms", "heavy imports"))
+    for module in args.modules:
+        try:
+            timings = [measure(module) for _ in range(args.repeat)]
+        except ImportError as e:
+            print("{:<28} {:>10}  {}".format(module, "failed", e))
+            continue
+        best = min(t[0] for t in timings) / 1000.0
+        print("{:<28} {:>10.1f}  {}".format(module, best, ", ".join(timings[0][1]) or "-"))
+        if module in budgets and best > budgets[module]:
+            over.append("{} took {:.1f} ms, budget {:.1f} ms".format(module, best, budgets[module]))
+
+    if over:
+        sys.exit("Import time budget exceeded:\n" + "\n".join(over))
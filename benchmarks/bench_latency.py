@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""Measure status request latency of a Kale worker while other clients poll task resources.
+
+A worker runs one long sleeping task.  Status requests are sent back to back for --seconds, first with nobody
+else talking to the worker, then while --pollers threads request the resources of the task continuously.
+Resource collection runs off the event loop, so the p99 latency of status requests should stay about the same.
+
+A Kale manager must be running at --mhost:--mport."""
+
+# stdlib
+import argparse
+import statistics
+import threading
+import time
+
+# local
+try:
+    from kale.services import worker
+except ImportError as e:
+    raise ImportError("An installation of kale was not found!  Import of kale.services failed.", e)
+
+
+def measure(client, task_id, seconds):
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        client.get_task_status(task_id)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def poll_resources(host, port, task_id, stop, counts):
+    client = worker.KaleWorkerClient(host, port)
+    while not stop.is_set():
+        client.get_task_resources(task_id)
+        counts.append(1)
+    client.close()
+
+
+def report(name, latencies, polls=0):
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print("{:>10} {:>8} {:>10.2f} {:>10.2f} {:>10.2f} {:>8}".format(
+        name, len(latencies), statistics.median(latencies) * 1000, p99 * 1000, latencies[-1] * 1000, polls))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--whost", default="127.0.0.1", help="address the worker binds to")
+    parser.add_argument("--mhost", default="127.0.0.1", help="Kale manager host")
+    parser.add_argument("--mport", type=int, default=8099, help="Kale manager port")
+    parser.add_argument("--seconds", type=float, default=10, help="duration of each measurement")
+    parser.add_argument("--pollers", type=int, default=4, help="threads polling task resources")
+    args = parser.parse_args()
+
+    process, client = worker.start_worker(whost=args.whost, mhost=args.mhost, mport=args.mport)
+    try:
+        task_id = client.register_function_task(time.sleep, args=(args.seconds * 3 + 30,))
+        client.start_task(task_id)
+
+        print("{:>10} {:>8} {:>10} {:>10} {:>10} {:>8}".format(
+            "polling", "requests", "p50 ms", "p99 ms", "max ms", "polls"))
+        report("idle", measure(client, task_id, args.seconds))
+
+        stop = threading.Event()
+        counts = []
+        pollers = [threading.Thread(target=poll_resources, args=(client.host, client.port, task_id, stop, counts))
+                   for _ in range(args.pollers)]
+        for t in pollers:
+            t.start()
+        try:
+            report("resources", measure(client, task_id, args.seconds), len(counts))
+        finally:
+            stop.set()
+            for t in pollers:
+                t.join()
+
+        client.remove_task(task_id)
+    finally:
+        client.shutdown()
+        client.close()
+        process.join()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""Measure the CPU cost of one resources poll of a task with many memory mappings.
+
+A child process maps --mappings separate pages, then its resources are polled --polls times in two ways:
+
+    full      every field collected on every poll, the way get_task_resources worked before static fields were
+              snapshotted once per run
+    cached    TaskResources.collect, static fields from the snapshot and memory maps refreshed every
+              --maps-interval seconds
+
+CPU time is the user and system time of this process, reading /proc is system time."""
+
+# stdlib
+import argparse
+import mmap
+import multiprocessing
+import statistics
+import time
+
+# local
+try:
+    from kale.services import resources
+except ImportError as e:
+    raise ImportError("An installation of kale was not found!  Import of kale.services failed.", e)
+
+
+def _hold_mappings(count, ready, done):
+    # alternating protections keep the kernel from merging neighbouring mappings into one
+    maps = []
+    for i in range(count):
+        prot = mmap.PROT_READ if i % 2 else mmap.PROT_READ | mmap.PROT_WRITE
+        maps.append(mmap.mmap(-1, mmap.PAGESIZE, prot=prot))
+    ready.set()
+    done.wait()
+
+
+def full(process):
+    usage = resources.task_static_info(process)
+    usage.update(resources.task_usage(process))
+    return usage
+
+
+def poll(collect, polls):
+    cpu = []
+    wall = []
+    for _ in range(polls):
+        start_cpu = time.process_time()
+        start_wall = time.perf_counter()
+        collect()
+        cpu.append(time.process_time() - start_cpu)
+        wall.append(time.perf_counter() - start_wall)
+    return cpu, wall
+
+
+def report(name, timings):
+    cpu, wall = timings
+    print("{:>8} {:>12.2f} {:>12.2f} {:>12.2f}".format(
+        name, statistics.median(cpu) * 1000, max(cpu) * 1000, statistics.median(wall) * 1000))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mappings", type=int, default=5000, help="memory mappings held by the task")
+    parser.add_argument("--polls", type=int, default=20, help="resources polls per method")
+    parser.add_argument("--maps-interval", type=float, default=10, help="seconds between memory map refreshes")
+    args = parser.parse_args()
+
+    ready = multiprocessing.Event()
+    done = multiprocessing.Event()
+    task = multiprocessing.Process(target=_hold_mappings, args=(args.mappings, ready, done))
+    task.start()
+    ready.wait()
+
+    try:
+        task_resources = resources.TaskResources(task.pid, args.maps_interval)
+        task_resources.snapshot()
+        print("task {} holds {} memory mappings".format(
+            task.pid, len(task_resources.process.memory_maps(grouped=False))))
+        print("{:>8} {:>12} {:>12} {:>12}".format("method", "median cpu ms", "max cpu ms", "median wall ms"))
+        report("full", poll(lambda: full(task_resources.process), args.polls))
+        report("cached", poll(task_resources.collect, args.polls))
+    finally:
+        done.set()
+        task.join()
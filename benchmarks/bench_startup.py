@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""Measure time-to-first-task of a Kale worker.
+
+Three ways of getting a worker to run a trivial task are compared, each repeated --repeat times:
+
+    polling    spawn_worker, then poll the manager until the worker registered and the worker until it answers,
+               the way run_function started workers before the readiness handshake
+    handshake  start_worker, the worker reports its address through a pipe once it is listening
+    pool       lease a worker from a KaleWorkerPool that already holds a warm worker
+
+A Kale manager must be running at --mhost:--mport."""
+
+# stdlib
+import argparse
+import statistics
+import time
+
+# 3rd party
+import requests
+
+# local
+try:
+    from kale.services import worker
+    from kale.services.manager import KaleManagerClient
+    from kale.services.pool import KaleWorkerPool
+except ImportError as e:
+    raise ImportError("An installation of kale was not found!  Import of kale.services failed.", e)
+
+
+def _noop():
+    return None
+
+
+def run_task(client):
+    task_id = client.register_function_task(_noop)
+    client.start_task(task_id)
+    client.wait_task(task_id)
+    client.get_task_output(task_id)
+    client.remove_task(task_id)
+
+
+def stop(process, client):
+    client.shutdown()
+    client.close()
+    process.join()
+
+
+def polling(args):
+    mgr = KaleManagerClient(args.mhost, args.mport)
+    kale_id = worker.get_kale_id()
+    start = time.perf_counter()
+    process = worker.spawn_worker(kale_id, args.whost, args.mhost, args.mport)
+    while 1:
+        try:
+            info = mgr.get_worker(kale_id)
+            break
+        except requests.HTTPError:
+            time.sleep(0.1)
+    client = worker.KaleWorkerClient(info["host"], info["port"])
+    while 1:
+        try:
+            client.get_service_status()
+            break
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    run_task(client)
+    elapsed = time.perf_counter() - start
+    mgr.close()
+    stop(process, client)
+    return elapsed
+
+
+def handshake(args):
+    start = time.perf_counter()
+    process, client = worker.start_worker(whost=args.whost, mhost=args.mhost, mport=args.mport)
+    run_task(client)
+    elapsed = time.perf_counter() - start
+    stop(process, client)
+    return elapsed
+
+
+def pooled(pool):
+    start = time.perf_counter()
+    with pool.worker() as client:
+        run_task(client)
+    return time.perf_counter() - start
+
+
+def report(name, timings):
+    print("{:>10} {:>10.4f} {:>10.4f} {:>10.4f}".format(
+        name, min(timings), statistics.median(timings), max(timings)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--whost", default="127.0.0.1", help="address workers bind to")
+    parser.add_argument("--mhost", default="127.0.0.1", help="Kale manager host")
+    parser.add_argument("--mport", type=int, default=8099, help="Kale manager port")
+    parser.add_argument("--repeat", type=int, default=5, help="workers started per method")
+    args = parser.parse_args()
+
+    print("{:>10} {:>10} {:>10} {:>10}".format("method", "min s", "median s", "max s"))
+    report("polling", [polling(args) for _ in range(args.repeat)])
+    report("handshake", [handshake(args) for _ in range(args.repeat)])
+
+    pool = KaleWorkerPool(size=1, min_size=1, whost=args.whost, mhost=args.mhost, mport=args.mport)
+    pool.warm()
+    report("pool", [pooled(pool) for _ in range(args.repeat)])
+    pool.close()
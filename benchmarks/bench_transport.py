@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""Compare the legacy JSON integer list encoding of task payloads with the binary frame encoding.
+
+Measures encoded size and encode + decode time for payloads from 1 KB up to --max-size.  If --worker is given,
+the round trip latency of registering a task with the payload as its argument is measured against a live worker."""
+
+# stdlib
+import argparse
+import json
+import os
+import pickle
+import time
+
+# local
+try:
+    from kale.services import transport
+except ImportError as e:
+    raise ImportError("An installation of kale was not found!  Import of kale.services.transport failed.", e)
+
+
+def _identity(x):
+    return x
+
+
+def legacy_roundtrip(payload):
+    body = json.dumps({"args": list(pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL))})
+    size = len(body)
+    pickle.loads(bytes(json.loads(body)["args"]))
+    return size
+
+
+def frames_roundtrip(payload):
+    body = transport.pack({}, {"args": transport.dumps(payload)})
+    size = len(body)
+    header, payloads = transport.unpack(body)
+    transport.loads(payloads["args"])
+    return size
+
+
+def timed(f, payload, repeat):
+    best = None
+    size = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size = f(payload)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return size, best
+
+
+def human(n):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if n < 1024:
+            return "{:.0f} {}".format(n, unit)
+        n /= 1024.0
+    return "{:.0f} TB".format(n)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--max-size", type=int, default=2**30, help="largest payload in bytes, default = 1 GB")
+    parser.add_argument("--legacy-max-size", type=int, default=2**26,
+                        help="largest payload to run through the legacy encoding, default = 64 MB")
+    parser.add_argument("--repeat", type=int, default=3, help="repetitions per size, best time is reported")
+    parser.add_argument("--worker", help="host:port of a running Kale worker for round trip measurements")
+    args = parser.parse_args()
+
+    client = None
+    if args.worker:
+        from kale.services.worker import KaleWorkerClient
+        host, port = args.worker.split(":")
+        client = KaleWorkerClient(host, int(port))
+
+    print("{:>8} {:>14} {:>14} {:>12} {:>12} {:>8}".format(
+        "payload", "legacy size", "frames size", "legacy s", "frames s", "speedup"))
+
+    size = 1024
+    while size <= args.max_size:
+        payload = os.urandom(size)
+
+        frames_size, frames_time = timed(frames_roundtrip, payload, args.repeat)
+        if size <= args.legacy_max_size:
+            legacy_size, legacy_time = timed(legacy_roundtrip, payload, args.repeat)
+            print("{:>8} {:>14} {:>14} {:>12.6f} {:>12.6f} {:>7.1f}x".format(
+                human(size), human(legacy_size), human(frames_size), legacy_time, frames_time,
+                legacy_time / frames_time))
+        else:
+            print("{:>8} {:>14} {:>14} {:>12} {:>12.6f} {:>8}".format(
+                human(size), "skipped", human(frames_size), "-", frames_time, "-"))
+
+        if client is not None:
+            timings = {False: None, True: None}
+            for binary in [False, True]:
+                if not binary and size > args.legacy_max_size:
+                    continue
+                client._binary = binary
+                start = time.perf_counter()
+                client.register_function_task(_identity, args=(payload,))
+                timings[binary] = time.perf_counter() - start
+            print("{:>8} register round trip: legacy {} s, frames {:.6f} s".format(
+                "", "-" if timings[False] is None else "{:.6f}".format(timings[False]), timings[True]))
+
+        del payload
+        size *= 4
@@ -4,14 +4,10 @@
 import argparse
 import logging
 import logging.handlers
-import time
-
-# 3rd party
-import requests
 
 # local
 try:
-    from kale.services.worker import get_kale_id, spawn_worker, KaleWorkerClient
+    from kale.services.worker import get_kale_id, start_worker
     from kale.services.manager import KaleManagerClient
 except ImportError as e:
     raise ImportError("Unable to import kale.services!  Check your kale installation.", e)
@@ -22,6 +18,36 @@ if __name__ == "__main__":
     parser.add_argument("--whost", help="DNS name or IP Address to bind a socket for this worker", default="127.0.0.1")
     parser.add_argument("--mhost", help="Kale Manager host name or IP for registration", default="127.0.0.1")
     parser.add_argument("--mport", help="Kale Manager port for registration", type=int, default=8099)
+    parser.add_argument("--task-start-method", help="multiprocessing start method of task processes, "
+                                                    "forkserver where available and spawn otherwise by "
+                                                    "default, fork is not safe with the worker threads",
+                        choices=["fork", "spawn", "forkserver"], default=None)
+    parser.add_argument("--preload", help="Module the forkserver imports once for every task, may be repeated",
+                        action="append", default=None)
+    parser.add_argument("--task-runners", help="Long-lived processes that run tasks one after another, "
+                                               "0 starts a new process per task", type=int, default=0)
+    parser.add_argument("--slots", help="Tasks running at once, more are queued, default = physical cores",
+                        type=int, default=None)
+    parser.add_argument("--result-cache", help="Answer tasks that ran before with the same target and arguments "
+                                               "from a cache of their results", action="store_true")
+    parser.add_argument("--result-cache-bytes", help="Results kept in memory by the result cache",
+                        type=int, default=268435456)
+    parser.add_argument("--result-cache-age", help="Seconds a cached result stays valid, default = forever",
+                        type=float, default=None)
+    parser.add_argument("--result-cache-spill", help="Directory cached results are written to instead of being "
+                                                     "dropped from memory", default=None)
+    parser.add_argument("--result-retention-bytes", help="Task results kept in memory, the least recently used "
+                                                         "above this are spilled to disk", type=int, default=1073741824)
+    parser.add_argument("--task-retention-bytes", help="Pickled tasks kept in memory, the least recently used "
+                                                       "above this are spilled to disk", type=int, default=268435456)
+    parser.add_argument("--spill-dir", help="Directory results and tasks are spilled to, default = temporary "
+                                            "directory", default=None)
+    parser.add_argument("--sample-interval", help="Seconds between resource samples of the host and of running "
+                                                  "tasks", type=float, default=1.0)
+    parser.add_argument("--history-length", help="Resource samples kept per task and for the host",
+                        type=int, default=3600)
+    parser.add_argument("--host-metrics-ttl", help="Seconds host metrics are reused for every task before they "
+                                                   "are collected again", type=float, default=1.0)
     args = parser.parse_args()
 
     _worker_host = "127.0.0.1"
@@ -52,23 +78,15 @@ if __name__ == "__main__":
 
     kale_id = get_kale_id()
     print("Spawning Kale Worker {} at {}, registering to Kale Manager at {}".format(kale_id, _worker_host, mgr.url))
-    w = spawn_worker(kale_id, _worker_host, _manager_host, _manager_port)
-
-    while 1:
-        print("Waiting for worker connection info after registration...")
-        try:
-            info = mgr.get_worker(kale_id)
-            print(info)
-            break
-        except requests.HTTPError:
-            time.sleep(0.1)
-
-    kale_worker = KaleWorkerClient(info["host"], info["port"])
-
-    while 1:
-        print("Waiting for worker to start listening...")
-        try:
-            kale_worker.get_service_status()
-            break
-        except requests.ConnectionError:
-            time.sleep(0.1)
+    # returns as soon as the worker reports that it is listening, registration completes in the background
+    w, kale_worker = start_worker(kale_id, _worker_host, _manager_host, _manager_port,
+                                  task_start_method=args.task_start_method, task_preload=args.preload,
+                                  task_runners=args.task_runners, slots=args.slots,
+                                  result_cache=args.result_cache, result_cache_bytes=args.result_cache_bytes,
+                                  result_cache_age=args.result_cache_age,
+                                  result_cache_spill=args.result_cache_spill,
+                                  result_retention_bytes=args.result_retention_bytes,
+                                  task_retention_bytes=args.task_retention_bytes, spill_dir=args.spill_dir,
+                                  sample_interval=args.sample_interval, history_length=args.history_length,
+                                  host_metrics_ttl=args.host_metrics_ttl)
+    print("Kale Worker {} listening at {}".format(kale_id, kale_worker.url))
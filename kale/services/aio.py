@@ -0,0 +1,470 @@
+# stdlib
+import asyncio
+import codecs
+import json
+import logging
+import os
+import pickle
+import urllib.parse
+
+# local
+from . import objects
+from . import transport
+
+
+class HTTPError(IOError):
+    def __init__(self, response):
+        super().__init__("{} {} for {}: {}".format(
+            response.status, response.reason, response.url, bytes(response.body[:1024]).decode("utf-8", "replace")))
+        self.response = response
+
+
+class Response(object):
+    def __init__(self, url, status, reason, headers, body):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+    @property
+    def ok(self):
+        return 200 <= self.status < 400
+
+    def json(self):
+        return json.loads(bytes(self.body).decode("utf-8"))
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise HTTPError(self)
+
+
+class AsyncHTTPConnectionPool(object):
+    """Minimal HTTP/1.1 client on asyncio streams, keeping up to pool_maxsize connections to one host alive.
+
+    Only what the Kale worker and manager routes use: no chunked transfer encoding, redirects or TLS."""
+    def __init__(self, host, port, timeout=30, pool_maxsize=10):
+        self.host = host
+        self.port = port
+        self._timeout = timeout
+        self._pool_maxsize = pool_maxsize
+        self._idle = []
+        self._semaphore = None
+
+    async def request(self, method, path, body=b"", headers=None, params=None, timeout=None):
+        if self._semaphore is None:
+            # created on first use so it belongs to the running loop
+            self._semaphore = asyncio.Semaphore(self._pool_maxsize)
+        if params:
+            path = "{}?{}".format(path, urllib.parse.urlencode(params))
+        if timeout is None:
+            timeout = self._timeout
+
+        async with self._semaphore:
+            reused = len(self._idle) > 0
+            connection = self._idle.pop() if reused else await self._connect(timeout)
+            try:
+                response, keep_alive = await asyncio.wait_for(
+                    self._exchange(connection, method, path, body, headers), timeout)
+            except (ConnectionError, asyncio.IncompleteReadError) as e:
+                connection[1].close()
+                if not reused:
+                    raise
+                # the server closed an idle keep-alive connection, retry once on a new one
+                connection = await self._connect(timeout)
+                response, keep_alive = await asyncio.wait_for(
+                    self._exchange(connection, method, path, body, headers), timeout)
+            except BaseException:
+                connection[1].close()
+                raise
+
+            if keep_alive:
+                self._idle.append(connection)
+            else:
+                connection[1].close()
+            return response
+
+    async def _connect(self, timeout):
+        return await asyncio.wait_for(asyncio.open_connection(self.host, self.port), timeout)
+
+    async def _exchange(self, connection, method, path, body, headers):
+        reader, writer = connection
+        lines = ["{} {} HTTP/1.1".format(method, path),
+                 "Host: {}:{}".format(self.host, self.port),
+                 "Connection: keep-alive",
+                 "Content-Length: {}".format(memoryview(body).nbytes)]
+        for k, v in (headers or {}).items():
+            lines.append("{}: {}".format(k, v))
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        if memoryview(body).nbytes > 0:
+            writer.write(body)
+        await writer.drain()
+
+        status_line = await reader.readuntil(b"\r\n")
+        version, status, reason = status_line.decode("latin-1").rstrip("\r\n").split(" ", 2)
+        response_headers = {}
+        while True:
+            line = (await reader.readuntil(b"\r\n")).decode("latin-1").rstrip("\r\n")
+            if line == "":
+                break
+            k, v = line.split(":", 1)
+            # header names are case insensitive, keep the conventional capitalization for lookups
+            response_headers["-".join(x.capitalize() for x in k.strip().split("-"))] = v.strip()
+
+        keep_alive = version == "HTTP/1.1" and response_headers.get("Connection", "").lower() != "close"
+        if "Content-Length" in response_headers:
+            # read into one writable buffer, out-of-band frames unpacked from it are used without a copy
+            data = bytearray(int(response_headers["Content-Length"]))
+            view = memoryview(data)
+            offset = 0
+            while offset < len(data):
+                chunk = await reader.read(len(data) - offset)
+                if not chunk:
+                    raise asyncio.IncompleteReadError(bytes(data[:offset]), len(data))
+                view[offset:offset + len(chunk)] = chunk
+                offset += len(chunk)
+        else:
+            # the routes used here answer with a Content-Length, anything else is read until the server closes
+            data = bytearray(await reader.read())
+            keep_alive = False
+
+        url = "http://{}:{}{}".format(self.host, self.port, path)
+        return Response(url, int(status), reason, response_headers, data), keep_alive
+
+    async def close(self):
+        while self._idle:
+            reader, writer = self._idle.pop()
+            writer.close()
+
+
+class AsyncKaleManagerClient(object):
+    def __init__(self, host="127.0.0.1", port=8099, timeout=3, pool_maxsize=10):
+        self.url = "http://{}:{}".format(host, port)
+        self.logger = logging.getLogger("AsyncKaleManagerClient")
+        self._http = AsyncHTTPConnectionPool(host, port, timeout, pool_maxsize)
+
+    async def _json(self, method, route, **kwargs):
+        response = await self._http.request(method, route, **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    async def add_worker(self, kale_id, protocol, host, port):
+        self.logger.debug("add_worker")
+        body = json.dumps({"id": kale_id, "protocol": protocol, "host": host, "port": port}).encode("utf-8")
+        return await self._json("POST", "/worker", body=body, headers={"Content-Type": "application/json"})
+
+    async def remove_worker(self, kale_id):
+        self.logger.debug("remove_worker")
+        return await self._json("DELETE", "/worker/{}".format(kale_id))
+
+    async def get_worker(self, kale_id):
+        self.logger.debug("get_worker")
+        return await self._json("GET", "/worker/{}".format(kale_id))
+
+    async def wait_for_worker(self, kale_id, interval=0.1):
+        """Return the worker connection info once the worker registered itself."""
+        while True:
+            try:
+                return await self.get_worker(kale_id)
+            except (HTTPError, ConnectionError):
+                await asyncio.sleep(interval)
+
+    async def list_workers(self):
+        self.logger.debug("list_workers")
+        return await self._json("GET", "/worker")
+
+    async def shutdown(self):
+        self.logger.debug("shutdown")
+        return (await self._json("POST", "/shutdown")).get("status")
+
+    async def get_status(self):
+        self.logger.debug("status")
+        return (await self._json("GET", "/status")).get("status")
+
+    async def close(self):
+        await self._http.close()
+
+
+class AsyncKaleWorkerClient(object):
+    """asyncio counterpart of kale.services.worker.KaleWorkerClient, every call yields to the event loop."""
+    def __init__(self, host, port, timeout=30, handoff=None, handoff_threshold=1048576, compression="zlib",
+                 compression_level=6, compression_threshold=4096, pool_maxsize=10):
+        self.url = "http://{}:{}".format(host, port)
+        self.logger = logging.getLogger("AsyncKaleWorkerClient {}".format(self.url))
+        self._timeout = timeout
+        self._http = AsyncHTTPConnectionPool(host, port, timeout, pool_maxsize)
+        if handoff is None:
+            # imported here, kale.services.worker brings in the whole web service
+            from .worker import is_local_address
+            handoff = is_local_address(host)
+        self._handoff = handoff
+        self._handoff_threshold = handoff_threshold
+        self._compression = compression
+        self._compression_level = compression_level
+        self._compression_threshold = compression_threshold
+        self._worker_compression = []
+
+    async def _json(self, method, route, **kwargs):
+        response = await self._http.request(method, route, **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    async def _run(self, f, *args):
+        # pickling and compression are CPU bound, keep them off the event loop
+        return await asyncio.get_event_loop().run_in_executor(None, f, *args)
+
+    async def is_alive(self, retries=3, interval=0.5):
+        while True:
+            try:
+                info = await self._json("GET", "/")
+                self._worker_compression = info.get("compression", [])
+                return True
+            except (ConnectionError, OSError, asyncio.TimeoutError):
+                retries -= 1
+                if retries < 0:
+                    raise ConnectionError("Unable to connect to worker {}".format(self.url))
+                await asyncio.sleep(interval)
+
+    async def get_service_status(self):
+        return (await self._json("GET", "/"))["status"]
+
+    def _encode(self, header, payloads):
+        """Encode a frames body, large payloads go to handoff files when the worker is on this host.
+
+        Returns the body and the handoff entries, see transport.write_handoffs."""
+        sent, handoff = payloads, {}
+        if self._handoff:
+            sent, handoff = transport.write_handoffs(payloads, self._handoff_threshold)
+        compression = self._compression if self._compression in self._worker_compression else None
+        body, metrics = transport.encode(dict(header, handoff=handoff), sent, compression,
+                                         self._compression_level, self._compression_threshold)
+        return body, handoff
+
+    async def _post_frames(self, route, header, payloads):
+        """See KaleWorkerClient._post_frames."""
+        body, handoff = await self._run(self._encode, header, payloads)
+        try:
+            response = await self._http.request("POST", route, body=body,
+                                                headers={"Content-Type": transport.FRAMES_CONTENT_TYPE})
+        finally:
+            # the worker removes the files it consumed, anything left was not used
+            for entry in handoff.values():
+                if os.path.exists(entry["path"]):
+                    os.remove(entry["path"])
+
+        if response.status == 422 and len(handoff) > 0:
+            # the worker only looked local, e.g. it runs in a different container
+            self.logger.debug("worker {} can not read handoff files, disabling handoff".format(self.url))
+            self._handoff = False
+            return await self._post_frames(route, header, payloads)
+
+        response.raise_for_status()
+        return response.json()
+
+    async def _get_frames(self, route, name):
+        params = {"handoff": 1} if self._handoff else {}
+        response = await self._http.request("GET", route, params=params, headers={
+            "Accept": transport.FRAMES_CONTENT_TYPE,
+            "X-Kale-Accept-Compression": ", ".join(sorted(transport.COMPRESSORS))
+        })
+        response.raise_for_status()
+
+        if response.headers.get("Content-Type", "").startswith(transport.FRAMES_CONTENT_TYPE):
+            return await self._run(_decode_payload, response.body, name)
+
+        data = response.json()
+        if "handle" in data:
+            handle = transport.Handle(**data["handle"])
+            if not os.path.exists(handle.path) or os.path.getsize(handle.path) != handle.size:
+                # the worker only looked local, e.g. it runs in a different container
+                self._handoff = False
+                return await self._get_frames(route, name)
+            return await self._run(_load_payload, handle.path, name)
+        return pickle.loads(bytes(data[name]))
+
+    async def register_function_task(self, f, args=(), kwargs=None, task_name=""):
+        from .task import KaleFunctionWrapper
+        return await self._register_task(KaleFunctionWrapper(f), f.__name__, args, kwargs, task_name)
+
+    async def register_method_task(self, obj, method, args=(), kwargs=None):
+        assert callable(getattr(obj, method))
+        return await self._register_task(obj, method, args, kwargs, "")
+
+    async def _register_task(self, target, call, args, kwargs, task_name):
+        payloads = await self._run(lambda: {
+            "target": transport.dumps(target),
+            "args": transport.dumps(args),
+            "kwargs": transport.dumps(kwargs if kwargs is not None else {})
+        })
+        data = await self._post_frames("/task", {"call": call, "task_name": task_name}, payloads)
+        return data["id"]
+
+    async def put_object(self, obj):
+        payloads = await self._run(lambda: {"object": transport.dumps(obj)})
+        data = await self._post_frames("/object", {}, payloads)
+        return objects.KaleObjectRef(data["id"])
+
+    async def get_object(self, ref):
+        return await self._get_frames("/object/{}".format(ref.object_id), "object")
+
+    async def get_task_output(self, task_id):
+        return await self._get_frames("/task/{}/results".format(task_id), "results")
+
+    async def start_task(self, task_id, priority=0):
+        return await self._json("POST", "/task/{}/start".format(task_id), params={"priority": priority})
+
+    async def stop_task(self, task_id):
+        return await self._json("POST", "/task/{}/stop".format(task_id))
+
+    async def suspend_task(self, task_id):
+        return await self._json("POST", "/task/{}/suspend".format(task_id))
+
+    async def resume_task(self, task_id):
+        return await self._json("POST", "/task/{}/resume".format(task_id))
+
+    async def remove_task(self, task_id):
+        return await self._json("DELETE", "/task/{}".format(task_id))
+
+    async def get_tasks(self):
+        return (await self._json("GET", "/task"))["tasks"]
+
+    async def get_task_status(self, task_id):
+        return (await self._json("GET", "/task/{}/status".format(task_id)))["status"]
+
+    async def wait_task(self, task_id, timeout=None, poll_timeout=30):
+        """Wait without blocking the event loop until the worker reports the task finished.
+
+        See KaleWorkerClient.wait_task."""
+        loop = asyncio.get_event_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            wait = poll_timeout if deadline is None else max(0.0, min(poll_timeout, deadline - loop.time()))
+            info = await self._json("GET", "/task/{}/wait".format(task_id), params={"timeout": wait},
+                                    timeout=self._timeout + wait)
+            if info["finished"] or (deadline is not None and loop.time() >= deadline):
+                return info
+
+    async def read_task_output(self, task_id, stream="stdout", offset=0, follow=False, timeout=30,
+                               max_bytes=1048576):
+        """See KaleWorkerClient.read_task_output."""
+        response = await self._http.request("GET", "/task/{}/{}".format(task_id, stream),
+                                            params={"offset": offset, "follow": int(follow), "timeout": timeout,
+                                                    "max_bytes": max_bytes},
+                                            timeout=self._timeout + (timeout if follow else 0))
+        response.raise_for_status()
+        return bytes(response.body), int(response.headers["X-Kale-Offset"]), \
+            response.headers["X-Kale-Finished"] == "1"
+
+    async def tail_task_output(self, task_id, stream="stdout", offset=0, poll_timeout=30):
+        """Asynchronous generator of the output of a task as text, see KaleWorkerClient.tail_task_output."""
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        while True:
+            data, offset, finished = await self.read_task_output(task_id, stream, offset, follow=True,
+                                                                 timeout=poll_timeout)
+            text = decoder.decode(data, final=finished)
+            if text:
+                yield text
+            if finished:
+                return
+
+    async def query_tasks(self, task_ids, resources=False, fields=None):
+        body = json.dumps({"ids": list(task_ids), "resources": resources, "fields": fields}).encode("utf-8")
+        return (await self._json("POST", "/tasks/query", body=body,
+                                 headers={"Content-Type": "application/json"}))["tasks"]
+
+    async def get_task_resources(self, task_id, fields=None):
+        """See KaleWorkerClient.get_task_resources."""
+        params = {"fields": ",".join(fields)} if fields is not None else None
+        return await self._json("GET", "/task/{}/resources".format(task_id), params=params)
+
+    async def get_task_process_resources(self, task_id, fields=None):
+        params = {"fields": ",".join(fields)} if fields is not None else None
+        return await self._json("GET", "/task/{}/resources/process".format(task_id), params=params)
+
+    async def get_host_resources(self, fields=None):
+        params = {"fields": ",".join(fields)} if fields is not None else None
+        return await self._json("GET", "/host/resources", params=params)
+
+    async def get_task_resources_history(self, task_id, since=0):
+        return await self._json("GET", "/task/{}/resources/history".format(task_id), params={"since": since})
+
+    async def get_host_resources_history(self, since=0):
+        return await self._json("GET", "/host/resources/history", params={"since": since})
+
+    async def shutdown(self):
+        return await self._json("POST", "/shutdown")
+
+    async def close(self):
+        await self._http.close()
+
+
+def _decode_payload(body, name):
+    header, payloads, metrics = transport.decode(body)
+    return transport.loads(payloads[name])
+
+
+def _load_payload(path, name):
+    header, payloads = transport.load(path)
+    return transport.loads(payloads[name])
+
+
+async def run_async_function(f=None, args=(), kwargs=None, whost="127.0.0.1", mhost="127.0.0.1", mport=8099,
+                             pool=None):
+    """Run f(*args, **kwargs) on a worker leased from pool, yielding to the event loop while it runs.
+
+    By default the worker comes from the shared pool for whost and the manager, see KaleWorkerPool."""
+    # imported here, kale.services.worker brings in the whole web service
+    from .pool import get_default_pool
+
+    loop = asyncio.get_event_loop()
+    if pool is None:
+        pool = get_default_pool(whost, mhost, mport)
+
+    # leasing may have to start a worker or wait for one, keep it off the event loop and off the default
+    # executor that the calls holding a worker use
+    leased = await loop.run_in_executor(pool.lease_executor(), pool.lease)
+    kale_worker = AsyncKaleWorkerClient(leased.client.host, leased.client.port)
+    retire = False
+
+    try:
+        # learn the compression the worker accepts, as KaleWorkerClient does when it is created
+        await kale_worker.is_alive()
+        kale_task = await kale_worker.register_function_task(f, args, kwargs)
+        await kale_worker.start_task(kale_task)
+        await kale_worker.wait_task(kale_task)
+        results = await kale_worker.get_task_output(kale_task)
+        error = None
+    except Exception as e:
+        results = None
+        error = e
+        retire = isinstance(e, (ConnectionError, asyncio.TimeoutError))
+    finally:
+        await kale_worker.close()
+        await loop.run_in_executor(None, lambda: pool.release(leased, retire=retire))
+
+    if error is None:
+        return results
+    else:
+        raise Exception(error)
+
+
+def as_completed(f, args_list, kwargs_list=None, timeout=None, **options):
+    """Run f once per entry of args_list concurrently, return an iterator of awaitables in completion order.
+
+    options are passed on to run_async_function, e.g.
+
+        for next_result in as_completed(simulate, [(x,) for x in range(100)]):
+            print(await next_result)"""
+    if kwargs_list is None:
+        kwargs_list = [None] * len(args_list)
+    return asyncio.as_completed([run_async_function(f, args, kwargs, **options)
+                                 for args, kwargs in zip(args_list, kwargs_list)], timeout=timeout)
+
+
+async def gather(f, args_list, kwargs_list=None, return_exceptions=False, **options):
+    """Run f once per entry of args_list concurrently, return the results in the order of args_list."""
+    if kwargs_list is None:
+        kwargs_list = [None] * len(args_list)
+    return await asyncio.gather(*[run_async_function(f, args, kwargs, **options)
+                                  for args, kwargs in zip(args_list, kwargs_list)],
+                                return_exceptions=return_exceptions)
@@ -0,0 +1,171 @@
+# stdlib
+import collections
+import hashlib
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+
+# local
+from . import transport
+
+
+class CachedRun(object):
+    """Stands in for the process of a task answered from a ResultCache, it finished before it started."""
+    pid = -1
+    exitcode = 0
+    sentinel = None
+
+    def is_alive(self):
+        return False
+
+    def terminate(self):
+        pass
+
+    def join(self, timeout=None):
+        pass
+
+
+class ResultCache(object):
+    """Results of finished tasks keyed by a digest of their pickled target, call, args and kwargs.
+
+    At most max_bytes of results are kept in memory, least recently used first out.  With a spill directory,
+    results pushed out of memory are written there instead of being dropped, up to max_spill_bytes.  Results
+    older than max_age seconds are never returned.  spill may be a directory or True for a temporary one."""
+    def __init__(self, max_bytes=268435456, max_age=None, spill=None, max_spill_bytes=1073741824):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.max_spill_bytes = max_spill_bytes
+        self._spill = spill
+        self._spill_dir = None
+        # key: {"frames": frames in memory or None once spilled, "nbytes", "time"}
+        self._entries = collections.OrderedDict()
+        self._nbytes = 0
+        self._spill_nbytes = 0
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "spills": 0, "expirations": 0}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(target, call, args, kwargs):
+        """Digest of a task as stored in TaskStore, lengths are included so fields can not run into each other."""
+        digest = hashlib.sha256()
+        for field in [target, call.encode("utf-8"), args, kwargs]:
+            digest.update(struct.pack("!Q", len(field)))
+            digest.update(field)
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Return the result frames stored for key, None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.max_age is not None and time.time() - entry["time"] > self.max_age:
+                self._delete(key)
+                self._counters["expirations"] += 1
+                entry = None
+
+            if entry is None:
+                self._counters["misses"] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            if entry["frames"] is not None:
+                return entry["frames"]
+            path = self._spill_path(key)
+
+        try:
+            header, payloads = transport.load(path)
+        except OSError:
+            # removed behind our back
+            with self._lock:
+                if key in self._entries:
+                    self._delete(key)
+                self._counters["hits"] -= 1
+                self._counters["misses"] += 1
+            return None
+        return payloads["results"]
+
+    def put(self, key, frames):
+        """Store the result frames of a task without copying them, they must not be changed afterwards.
+
+        The cache keeps read-only views of the frames, results rebuilt from a hit get buffers of their own."""
+        frames = [memoryview(f).toreadonly() for f in frames]
+        nbytes = transport.nbytes(frames)
+        with self._lock:
+            if key in self._entries:
+                self._delete(key)
+            self._entries[key] = {"frames": frames, "nbytes": nbytes, "time": time.time()}
+            self._nbytes += nbytes
+            self._evict()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters,
+                        count=len(self._entries),
+                        nbytes=self._nbytes,
+                        max_bytes=self.max_bytes,
+                        spill_nbytes=self._spill_nbytes,
+                        max_spill_bytes=self.max_spill_bytes if self._spill else 0,
+                        max_age=self.max_age)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._delete(key)
+            if self._spill is True and self._spill_dir is not None:
+                shutil.rmtree(self._spill_dir, ignore_errors=True)
+                self._spill_dir = None
+
+    def _spill_path(self, key):
+        if self._spill_dir is None:
+            if self._spill is True:
+                self._spill_dir = tempfile.mkdtemp(prefix="kale_cache_")
+            else:
+                os.makedirs(self._spill, exist_ok=True)
+                self._spill_dir = self._spill
+        return os.path.join(self._spill_dir, "{}.results".format(key))
+
+    def _delete(self, key):
+        entry = self._entries.pop(key)
+        if entry["frames"] is not None:
+            self._nbytes -= entry["nbytes"]
+        else:
+            self._spill_nbytes -= entry["nbytes"]
+            try:
+                os.remove(self._spill_path(key))
+            except OSError:
+                pass
+
+    def _evict(self):
+        if self.max_age is not None:
+            now = time.time()
+            for key in [k for k, v in self._entries.items() if now - v["time"] > self.max_age]:
+                self._delete(key)
+                self._counters["expirations"] += 1
+
+        # least recently used first
+        for key in list(self._entries):
+            if self._nbytes <= self.max_bytes:
+                break
+            entry = self._entries[key]
+            if entry["frames"] is None:
+                continue
+            if self._spill and entry["nbytes"] <= self.max_spill_bytes:
+                with open(self._spill_path(key), "wb") as f:
+                    transport.dump(f, {}, {"results": entry["frames"]})
+                entry["frames"] = None
+                self._nbytes -= entry["nbytes"]
+                self._spill_nbytes += entry["nbytes"]
+                self._counters["spills"] += 1
+            else:
+                self._delete(key)
+                self._counters["evictions"] += 1
+
+        for key in list(self._entries):
+            if self._spill_nbytes <= self.max_spill_bytes:
+                break
+            if self._entries[key]["frames"] is None:
+                self._delete(key)
+                self._counters["evictions"] += 1
@@ -1,6 +1,12 @@
 #!/usr/bin/env python
 
+import collections
+import os
+import shutil
 import sqlite3
+import tempfile
+
+from . import transport
 
 
 class DataStore(object):
@@ -146,7 +152,12 @@ class WorkerStore(DataStore):
 
 
 class TaskStore(DataStore):
-    def __init__(self):
+    """Registered tasks, with their target, args and kwargs pickled into BLOBs.
+
+    Above max_bytes of BLOBs, those of the least recently used tasks are moved to files in a directory under
+    spill_dir, the temporary directory by default, and read back when the task is looked up again.  A max_bytes
+    of None keeps every BLOB in the database."""
+    def __init__(self, max_bytes=None, spill_dir=None):
         super().__init__()
         try:
             self._cursor.execute("CREATE TABLE tasks (id INTEGER PRIMARY KEY," +
@@ -154,6 +165,14 @@ class TaskStore(DataStore):
             self._conn.commit()
         except sqlite3.ProgrammingError as e:
             raise
+        self.max_bytes = max_bytes
+        self._spill = spill_dir
+        self._spill_dir = None
+        # task id: BLOB bytes, of tasks held in the database least recently used first, and of spilled tasks
+        self._blobs = collections.OrderedDict()
+        self._spilled = {}
+        self._nbytes = 0
+        self._counters = {"spills": 0, "reloads": 0}
 
     def list(self):
         try:
@@ -168,20 +187,56 @@ class TaskStore(DataStore):
             assert task_id is not None
             self._cursor.execute("SELECT * FROM tasks WHERE id=?", (task_id, ))
             row = self._cursor.fetchone()
+            if row is not None:
+                if row[0] in self._spilled:
+                    self._reload(row[0])
+                    self._cursor.execute("SELECT * FROM tasks WHERE id=?", (task_id, ))
+                    row = self._cursor.fetchone()
+                elif row[0] in self._blobs:
+                    self._blobs.move_to_end(row[0])
             return row
         except sqlite3.ProgrammingError as e:
             raise
 
+    def find_pid(self, task_id):
+        """pid column of the task, None if it does not exist.  BLOBs are not read, spilled ones stay on disk."""
+        try:
+            self._cursor.execute("SELECT pid FROM tasks WHERE id=?", (task_id, ))
+            row = self._cursor.fetchone()
+            return row[0] if row is not None else None
+        except sqlite3.ProgrammingError as e:
+            raise
+
     def add(self, target=None, call=None, args=None, kwargs=None, name=""):
         try:
             self._cursor.execute("INSERT INTO tasks VALUES (NULL,?,?,?,?,?,-1)",
                                  (target, call, args, kwargs, name))
             self._conn.commit()
             self._cursor.execute("SELECT last_insert_rowid()")
-            return self._cursor.fetchone()[0]
+            task_id = self._cursor.fetchone()[0]
+            self._retain(task_id, len(target) + len(args) + len(kwargs))
+            self._evict(keep=task_id)
+            return task_id
         except sqlite3.ProgrammingError as e:
             raise
 
+    def add_many(self, tasks):
+        """Insert (target, call, args, kwargs, name) rows in one transaction, returns their ids in order."""
+        try:
+            ids = []
+            for target, call, args, kwargs, name in tasks:
+                self._cursor.execute("INSERT INTO tasks VALUES (NULL,?,?,?,?,?,-1)",
+                                     (target, call, args, kwargs, name))
+                ids.append(self._cursor.lastrowid)
+            self._conn.commit()
+            for task_id, (target, call, args, kwargs, name) in zip(ids, tasks):
+                self._retain(task_id, len(target) + len(args) + len(kwargs))
+            self._evict()
+            return ids
+        except sqlite3.Error as e:
+            self._conn.rollback()
+            raise
+
     def update_pid(self, task_id, pid):
         try:
             self._cursor.execute("UPDATE tasks SET pid=? WHERE id=?", (pid, task_id))
@@ -193,9 +248,68 @@ class TaskStore(DataStore):
         try:
             self._cursor.execute("DELETE FROM tasks WHERE id=?", (task_id, ))
             self._conn.commit()
+            task_id = int(task_id)
+            if task_id in self._blobs:
+                self._nbytes -= self._blobs.pop(task_id)
+            if self._spilled.pop(task_id, None) is not None:
+                try:
+                    os.remove(self._spill_path(task_id))
+                except OSError:
+                    pass
         except sqlite3.ProgrammingError as e:
             raise
 
+    def stats(self):
+        return dict(self._counters,
+                    count=len(self._blobs),
+                    nbytes=self._nbytes,
+                    max_bytes=self.max_bytes,
+                    spilled=len(self._spilled),
+                    spilled_nbytes=sum(self._spilled.values()))
+
+    def clear_spill(self):
+        """Remove the spill directory, spilled BLOBs are lost."""
+        if self._spill_dir is not None:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+        self._spill_dir = None
+        self._spilled.clear()
+
+    def _retain(self, task_id, nbytes):
+        self._blobs[task_id] = nbytes
+        self._nbytes += nbytes
+
+    def _spill_path(self, task_id):
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.mkdtemp(prefix="kale_tasks_", dir=self._spill)
+        return os.path.join(self._spill_dir, "{}.task".format(task_id))
+
+    def _evict(self, keep=None):
+        if self.max_bytes is None:
+            return
+        while self._nbytes > self.max_bytes:
+            oldest = next(iter(self._blobs))
+            if oldest == keep:
+                break
+            self._cursor.execute("SELECT target, args, kwargs FROM tasks WHERE id=?", (oldest, ))
+            target, args, kwargs = self._cursor.fetchone()
+            transport.write_file(self._spill_path(oldest), {},
+                                 {"target": [target], "args": [args], "kwargs": [kwargs]})
+            self._cursor.execute("UPDATE tasks SET target=NULL, args=NULL, kwargs=NULL WHERE id=?", (oldest, ))
+            self._conn.commit()
+            self._spilled[oldest] = self._blobs.pop(oldest)
+            self._nbytes -= self._spilled[oldest]
+            self._counters["spills"] += 1
+
+    def _reload(self, task_id):
+        header, payloads = transport.load(self._spill_path(task_id))
+        blobs = [bytes(payloads[name][0]) for name in ["target", "args", "kwargs"]]
+        self._cursor.execute("UPDATE tasks SET target=?, args=?, kwargs=? WHERE id=?", blobs + [task_id])
+        self._conn.commit()
+        os.remove(self._spill_path(task_id))
+        self._retain(task_id, self._spilled.pop(task_id))
+        self._counters["reloads"] += 1
+        self._evict(keep=task_id)
+
 
 if __name__ == "__main__":
     js = JobStore()
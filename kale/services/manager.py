@@ -11,6 +11,7 @@ import sanic.response
 
 # local
 from . import db
+from . import sessions
 
 app = sanic.Sanic()
 ws = db.WorkerStore()
@@ -96,10 +97,12 @@ def get_status(request):
 
 
 class KaleManagerClient(object):
-    def __init__(self, host="127.0.0.1", port=8099, timeout=3):
+    def __init__(self, host="127.0.0.1", port=8099, timeout=3, pool_connections=1, pool_maxsize=10):
         self.url = "http://{}:{}".format(host, port)
         self.logger = logging.getLogger("KaleManagerClient")
         self._timeout = timeout
+        # keep-alive connections reused by every call
+        self._session = sessions.make_session(pool_connections, pool_maxsize)
 
         while 1:
             try:
@@ -115,9 +118,9 @@ class KaleManagerClient(object):
 
     def add_worker(self, kale_id, protocol, host, port):
         self.logger.debug("add_worker")
-        response = requests.post("{}/worker".format(self.url),
+        response = self._session.post("{}/worker".format(self.url),
             timeout=self._timeout,
-            body={
+            json={
             "id": kale_id,
             "protocol": protocol,
             "host": host,
@@ -130,7 +133,7 @@ class KaleManagerClient(object):
 
     def remove_worker(self, kale_id):
         self.logger.debug("remove_worker")
-        response = requests.delete("{}/worker/{}".format(self.url, kale_id), timeout=self._timeout)
+        response = self._session.delete("{}/worker/{}".format(self.url, kale_id), timeout=self._timeout)
         if response.ok:
             return response.json()
         else:
@@ -138,7 +141,7 @@ class KaleManagerClient(object):
 
     def get_worker(self, kale_id):
         self.logger.debug("get_worker")
-        response = requests.get("{}/worker/{}".format(self.url, kale_id), timeout=self._timeout)
+        response = self._session.get("{}/worker/{}".format(self.url, kale_id), timeout=self._timeout)
         if response.ok:
             return response.json()
         else:
@@ -146,7 +149,7 @@ class KaleManagerClient(object):
 
     def list_workers(self):
         self.logger.debug("list_workers")
-        response = requests.get("{}/worker".format(self.url), timeout=self._timeout)
+        response = self._session.get("{}/worker".format(self.url), timeout=self._timeout)
         if response.ok:
             self.logger.debug(response.json())
             return response.json()
@@ -156,7 +159,7 @@ class KaleManagerClient(object):
 
     def shutdown(self):
         self.logger.debug("shutdown")
-        response = requests.post("{}/shutdown".format(self.url), timeout=self._timeout)
+        response = self._session.post("{}/shutdown".format(self.url), timeout=self._timeout)
         if response.ok:
             msg = response.json()
             if "status" in msg:
@@ -168,7 +171,7 @@ class KaleManagerClient(object):
 
     def get_status(self):
         self.logger.debug("status")
-        response = requests.get("{}/status".format(self.url), timeout=self._timeout)
+        response = self._session.get("{}/status".format(self.url), timeout=self._timeout)
         if response.ok:
             msg = response.json()
             if "status" in msg:
@@ -178,6 +181,9 @@ class KaleManagerClient(object):
         else:
             response.raise_for_status()
 
+    def close(self):
+        self._session.close()
+
 
 if __name__ == "__main__":
     app.run(host="127.0.0.1", port=8099)
@@ -0,0 +1,183 @@
+# stdlib
+import collections
+import copy
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+
+# local
+from . import transport
+
+_CONTAINERS = (tuple, list, set, frozenset)
+
+
+class KaleObjectRef(object):
+    """Reference to an object held in the object store of a Kale worker.
+
+    Pass it in the args or kwargs of a task on the same worker in place of the object itself."""
+    def __init__(self, object_id):
+        self.object_id = object_id
+
+    def __repr__(self):
+        return "KaleObjectRef({!r})".format(self.object_id)
+
+    def __eq__(self, other):
+        return isinstance(other, KaleObjectRef) and other.object_id == self.object_id
+
+    def __hash__(self):
+        return hash(self.object_id)
+
+
+class ObjectStore(object):
+    """Pickled objects kept in files on shared memory, evicted least recently used first above max_bytes."""
+    def __init__(self, max_bytes=1073741824):
+        self.max_bytes = max_bytes
+        self._objects = collections.OrderedDict()
+        self._nbytes = 0
+        self._evictions = 0
+        self._directory = None
+        self._lock = threading.Lock()
+
+    def put(self, frames, object_id=None):
+        if object_id is None:
+            object_id = str(uuid.uuid4())
+
+        with self._lock:
+            if self._directory is None:
+                self._directory = tempfile.mkdtemp(prefix="kale_objects_", dir=transport.handoff_root())
+            directory = self._directory
+
+        # written outside the lock
+        size = transport.write_file(os.path.join(directory, object_id), {}, {"object": frames})
+
+        with self._lock:
+            if object_id in self._objects:
+                self._nbytes -= self._objects.pop(object_id)
+            self._objects[object_id] = size
+            self._nbytes += size
+            self._evict(keep=object_id)
+        return object_id
+
+    def path(self, object_id):
+        """Return the file holding the object, and mark it as recently used."""
+        with self._lock:
+            if object_id not in self._objects:
+                raise KeyError("object: {} does not exist".format(object_id))
+            self._objects.move_to_end(object_id)
+            return os.path.join(self._directory, object_id)
+
+    @property
+    def directory(self):
+        """Directory of the object files, None until the first object is stored."""
+        with self._lock:
+            return self._directory
+
+    def get(self, object_id):
+        return load_object(self.path(object_id))
+
+    def remove(self, object_id):
+        with self._lock:
+            if object_id not in self._objects:
+                raise KeyError("object: {} does not exist".format(object_id))
+            self._delete(object_id)
+
+    def list(self):
+        with self._lock:
+            return list(self._objects.items())
+
+    def stats(self):
+        with self._lock:
+            return {
+                "count": len(self._objects),
+                "nbytes": self._nbytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self._evictions
+            }
+
+    def clear(self):
+        with self._lock:
+            if self._directory is not None:
+                shutil.rmtree(self._directory, ignore_errors=True)
+            self._objects.clear()
+            self._nbytes = 0
+            self._directory = None
+
+    def _delete(self, object_id):
+        self._nbytes -= self._objects.pop(object_id)
+        try:
+            # processes that already mapped the file keep their view of it
+            os.remove(os.path.join(self._directory, object_id))
+        except OSError:
+            pass
+
+    def _evict(self, keep=None):
+        while self._nbytes > self.max_bytes:
+            oldest = next(iter(self._objects))
+            if oldest == keep:
+                # a single object larger than the budget stays until something else is stored
+                break
+            self._delete(oldest)
+            self._evictions += 1
+
+
+def load_object(path):
+    header, payloads = transport.load(path)
+    return transport.loads(payloads["object"])
+
+
+def load_refs(value, directory):
+    """Return value with every KaleObjectRef replaced by the object stored in directory, see ObjectStore.directory.
+
+    Each object is mapped from its file once, however often it is referenced."""
+    stored = {}
+    for ref in find_refs(value):
+        path = os.path.join(directory, ref.object_id) if directory is not None else None
+        if path is None or not os.path.exists(path):
+            raise KeyError("object: {} does not exist".format(ref.object_id))
+        stored[ref.object_id] = load_object(path)
+    if len(stored) == 0:
+        return value
+    return resolve_refs(value, stored)
+
+
+def find_refs(value):
+    """Collect every KaleObjectRef in value, searching nested tuples, lists, sets and dict values, subclasses
+    such as namedtuples included."""
+    refs = set()
+    stack = [value]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, KaleObjectRef):
+            refs.add(item)
+        elif isinstance(item, _CONTAINERS):
+            stack.extend(item)
+        elif isinstance(item, dict):
+            stack.extend(item.values())
+    return refs
+
+
+def resolve_refs(value, objects):
+    """Return a copy of value with every KaleObjectRef replaced by objects[ref.object_id].
+
+    Containers are rebuilt as their own type, only if they hold a reference."""
+    if isinstance(value, KaleObjectRef):
+        return objects[value.object_id]
+    elif isinstance(value, _CONTAINERS):
+        items = [resolve_refs(x, objects) for x in value]
+        if all(x is y for x, y in zip(items, value)):
+            return value
+        elif isinstance(value, tuple) and hasattr(value, "_fields"):
+            # a namedtuple takes its fields as separate arguments
+            return type(value)(*items)
+        return type(value)(items)
+    elif isinstance(value, dict):
+        items = {k: resolve_refs(v, objects) for k, v in value.items()}
+        if all(items[k] is v for k, v in value.items()):
+            return value
+        # a copy keeps what the constructor of a subclass may need, e.g. the default factory of a defaultdict
+        resolved = copy.copy(value)
+        resolved.update(items)
+        return resolved
+    return value
@@ -0,0 +1,267 @@
+# stdlib
+import atexit
+import concurrent.futures
+import contextlib
+import logging
+import os
+import threading
+import time
+
+# 3rd party
+import requests
+
+# local
+from . import worker
+
+
+class PooledWorker(object):
+    """A running Kale worker owned by a KaleWorkerPool, client is a KaleWorkerClient connected to it."""
+    def __init__(self, kale_id, process, client):
+        self.kale_id = kale_id
+        self.process = process
+        self.client = client
+        self.leases = 0
+        self.idle_since = None
+
+    def __repr__(self):
+        return "PooledWorker({!r}, {})".format(self.kale_id, self.client.url)
+
+
+class KaleWorkerPool(object):
+    """Keeps up to size registered Kale workers running and leases them out one caller at a time.
+
+    Workers that died are replaced on the next lease, workers idle for longer than idle_timeout seconds are shut
+    down until min_size remain.  Tasks left on a worker are removed when it is released.  worker_options are
+    passed on to KaleWorker, e.g. task_start_method="forkserver"."""
+    def __init__(self, size=None, min_size=0, idle_timeout=60, whost="127.0.0.1", mhost="127.0.0.1", mport=8099,
+                 worker_options=None):
+        if size is None:
+            size = os.cpu_count() or 1
+        assert 0 <= min_size <= size, "min_size must be between 0 and size!"
+
+        self.size = size
+        self.min_size = min_size
+        self.idle_timeout = idle_timeout
+        self._whost = whost
+        self._mhost = mhost
+        self._mport = mport
+        self._worker_options = worker_options if worker_options is not None else {}
+        self.logger = logging.getLogger("KaleWorkerPool")
+
+        self._idle = []
+        self._leased = set()
+        self._starting = 0
+        self._retired = []
+        self._closed = False
+        self._cond = threading.Condition()
+        self._reaper = None
+        self._lease_executor = None
+        self._counters = {"started": 0, "replaced": 0, "retired": 0, "leases": 0}
+
+    def lease(self, timeout=None):
+        """Return an idle PooledWorker, starting one if fewer than size are running.
+
+        Blocks while all workers are leased, raises TimeoutError if none is free after timeout seconds."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("KaleWorkerPool is closed!")
+
+                while self._idle:
+                    # most recently released first, its pages and connections are the warmest
+                    w = self._idle.pop()
+                    if w.process.is_alive():
+                        return self._checkout(w)
+                    self.logger.debug("worker {} died while idle, replacing it".format(w.kale_id))
+                    self._counters["replaced"] += 1
+                    self._retire(w)
+
+                if len(self._leased) + self._starting < self.size:
+                    self._starting += 1
+                    break
+
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError("No Kale worker became free within {} seconds!".format(timeout))
+                self._cond.wait(remaining)
+
+        try:
+            w = self._start()
+        finally:
+            with self._cond:
+                self._starting -= 1
+                self._cond.notify()
+
+        with self._cond:
+            return self._checkout(w)
+
+    def release(self, w, retire=False):
+        """Return a leased worker to the pool, removing the tasks left on it.
+
+        A worker that cannot be cleaned up, or any worker if retire is set, is shut down instead."""
+        if not retire:
+            try:
+                # keyed by task id
+                for task_id in w.client.get_tasks():
+                    w.client.remove_task(task_id)
+            except (requests.RequestException, ConnectionError) as e:
+                self.logger.debug("worker {} failed to clean up, retiring it: {}".format(w.kale_id, e))
+                retire = True
+
+        with self._cond:
+            self._leased.discard(w)
+            retire = retire or self._closed or not w.process.is_alive()
+            if not retire:
+                w.idle_since = time.monotonic()
+                self._idle.append(w)
+                self._start_reaper()
+            self._cond.notify()
+
+        if retire:
+            self._retire(w)
+
+    @contextlib.contextmanager
+    def worker(self, timeout=None):
+        """Lease a worker for the duration of a with block, yielding its KaleWorkerClient."""
+        w = self.lease(timeout)
+        retire = False
+        try:
+            yield w.client
+        except (requests.ConnectionError, ConnectionError):
+            retire = True
+            raise
+        finally:
+            self.release(w, retire=retire)
+
+    def warm(self, count=None):
+        """Start workers until count, by default min_size, are idle."""
+        if count is None:
+            count = self.min_size
+        leased = []
+        try:
+            while len(leased) < count:
+                with self._cond:
+                    if len(self._idle) + len(leased) >= count:
+                        break
+                leased.append(self.lease())
+        finally:
+            for w in leased:
+                self.release(w)
+
+    def shrink(self):
+        """Shut down workers idle for longer than idle_timeout, keeping min_size running."""
+        now = time.monotonic()
+        expired = []
+        with self._cond:
+            # oldest idle first
+            for w in list(self._idle):
+                if len(self._idle) + len(self._leased) <= self.min_size:
+                    break
+                if now - w.idle_since >= self.idle_timeout:
+                    self._idle.remove(w)
+                    expired.append(w)
+            self._retired = [p for p in self._retired if p.is_alive()]
+
+        for w in expired:
+            self.logger.debug("worker {} idle for {} seconds, shutting it down".format(w.kale_id, self.idle_timeout))
+            self._retire(w)
+
+    def lease_executor(self):
+        """Threads for calls to lease from asyncio code, see run_async_function.
+
+        lease blocks while every worker is leased, on the default executor of the event loop it would hold the
+        threads that the callers holding a worker need to finish and release it."""
+        with self._cond:
+            if self._lease_executor is None:
+                self._lease_executor = concurrent.futures.ThreadPoolExecutor(
+                    self.size, thread_name_prefix="KaleWorkerPool lease")
+            return self._lease_executor
+
+    def stats(self):
+        with self._cond:
+            return dict(self._counters, size=self.size, min_size=self.min_size, idle=len(self._idle),
+                        leased=len(self._leased), starting=self._starting)
+
+    def close(self, timeout=10):
+        """Shut down every idle worker, leased workers are shut down when they are released."""
+        with self._cond:
+            self._closed = True
+            idle = self._idle
+            self._idle = []
+            self._cond.notify_all()
+            if self._lease_executor is not None:
+                # waiting leases were woken up to fail
+                self._lease_executor.shutdown(wait=False)
+
+        for w in idle:
+            self._retire(w)
+
+        with self._cond:
+            retired = list(self._retired)
+        for p in retired:
+            p.join(timeout)
+
+    def _checkout(self, w):
+        w.leases += 1
+        w.idle_since = None
+        self._leased.add(w)
+        self._counters["leases"] += 1
+        return w
+
+    def _start(self):
+        kale_id = worker.get_kale_id()
+        process, client = worker.start_worker(kale_id, whost=self._whost, mhost=self._mhost, mport=self._mport,
+                                              **self._worker_options)
+        self.logger.debug("started worker {} at {}".format(kale_id, client.url))
+        with self._cond:
+            self._counters["started"] += 1
+        return PooledWorker(kale_id, process, client)
+
+    def _retire(self, w):
+        with self._cond:
+            self._counters["retired"] += 1
+            # the worker stops itself after a grace period, it is joined by shrink or close
+            self._retired.append(w.process)
+
+        if w.process.is_alive():
+            try:
+                w.client.shutdown()
+            except (requests.RequestException, ConnectionError):
+                w.process.terminate()
+        w.client.close()
+
+    def _start_reaper(self):
+        if self._reaper is not None or self.idle_timeout is None:
+            return
+        self._reaper = threading.Thread(target=self._reap, name="KaleWorkerPool reaper", daemon=True)
+        self._reaper.start()
+
+    def _reap(self):
+        while True:
+            with self._cond:
+                if self._closed:
+                    return
+                self._cond.wait(max(self.idle_timeout / 2.0, 0.1))
+            self.shrink()
+
+
+_default_pools = {}
+_default_pools_lock = threading.Lock()
+
+
+def get_default_pool(whost="127.0.0.1", mhost="127.0.0.1", mport=8099):
+    """The process wide pool used by run_function and Fireworks tasks, one per worker host and manager."""
+    key = (whost, mhost, mport)
+    with _default_pools_lock:
+        if key not in _default_pools or _default_pools[key]._closed:
+            _default_pools[key] = KaleWorkerPool(whost=whost, mhost=mhost, mport=mport)
+        return _default_pools[key]
+
+
+@atexit.register
+def _close_default_pools():
+    with _default_pools_lock:
+        for p in _default_pools.values():
+            p.close()
+        _default_pools.clear()
@@ -0,0 +1,473 @@
+# stdlib
+import collections
+import logging
+import socket
+import threading
+import time
+
+# 3rd party
+import numpy as np
+import psutil
+
+_RLIMIT_CONSTANTS = {k: v for k, v in psutil.__dict__.items() if k.startswith("RLIMIT")}
+
+# columns recorded by ResourceSampler, each a number per sample
+TASK_HISTORY_COLUMNS = ["time", "cpu_percent", "cpu_user", "cpu_system", "memory_rss", "memory_vms", "num_threads",
+                        "num_fds", "read_bytes", "write_bytes", "voluntary_ctx_switches",
+                        "involuntary_ctx_switches"]
+
+HOST_HISTORY_COLUMNS = ["time", "cpu_percent", "memory_percent", "swap_percent", "disk_read_bytes",
+                        "disk_write_bytes", "net_bytes_sent", "net_bytes_recv"]
+
+
+def _percent_remaining(mem):
+    if mem[1] < 1E-6:
+        return 100.0
+    return mem[1]/mem[0] * 100.0
+
+
+def _memory_percent(p, usage):
+    """Percent of physical memory per field of memory_full_info, or of memory_info if memory_full_info was not
+    requested.  Process.memory_percent would read /proc/<pid>/smaps again for every uss, pss and swap field."""
+    memory = usage.get("memory_full_info") or p.memory_info()._asdict()
+    total = psutil.virtual_memory().total
+    return {k: v / total * 100.0 for k, v in memory.items()}
+
+
+def _disk_usage(usage):
+    mounts = [x["mountpoint"] for x in usage["disk_partitions"]] if "disk_partitions" in usage else \
+        [x.mountpoint for x in psutil.disk_partitions(all=True)]
+    disk_usage = {}
+    for mount in mounts:
+        try:
+            disk_usage[mount] = psutil.disk_usage(mount)._asdict()
+        except PermissionError as e:
+            continue
+    return disk_usage
+
+
+def _net_if_addrs():
+    net_if_addrs = psutil.net_if_addrs()
+    return {k: [x._asdict() for x in net_if_addrs[k]] for k in net_if_addrs}
+
+
+# Collectors of the fields of get_task_resources by name, in the order they are collected.  Task collectors are
+# called as f(process, usage), host collectors as f(usage), usage holds the fields collected before them.  Only
+# the fields a client asks for are collected, see parse_fields.
+
+# fields of a task process that do not change while it runs, collected once per run
+TASK_STATIC_COLLECTORS = collections.OrderedDict([
+    ("pid", lambda p, usage: p.pid),
+    ("ppid", lambda p, usage: p.ppid()),
+    ("name", lambda p, usage: p.name()),
+    ("executable", lambda p, usage: p.exe()),
+    ("cmdline", lambda p, usage: p.cmdline()),
+    ("environ", lambda p, usage: p.environ()),
+    ("create_time", lambda p, usage: p.create_time()),
+    ("username", lambda p, usage: p.username()),
+    ("uids", lambda p, usage: p.uids()),
+    ("gids", lambda p, usage: p.gids()),
+    ("terminal", lambda p, usage: p.terminal()),
+    # one system call per limit
+    ("rlimits", lambda p, usage: {k: p.rlimit(v) for k, v in _RLIMIT_CONSTANTS.items()}),
+    ("cpu_affinity", lambda p, usage: p.cpu_affinity())
+])
+
+TASK_COLLECTORS = collections.OrderedDict([
+    ("status", lambda p, usage: p.status()),
+    ("cwd", lambda p, usage: p.cwd()),
+    ("nice", lambda p, usage: p.nice()),
+    ("ionice", lambda p, usage: p.ionice()._asdict()),
+    ("io_counters", lambda p, usage: p.io_counters()._asdict()),
+    ("num_ctx_switches", lambda p, usage: p.num_ctx_switches()),
+    ("num_fds", lambda p, usage: p.num_fds()),
+    ("num_threads", lambda p, usage: p.num_threads()),
+    ("threads", lambda p, usage: [x._asdict() for x in p.threads()]),
+    # since the previous call on the process, never sleeps
+    ("cpu_percent", lambda p, usage: p.cpu_percent(interval=None)),
+    ("cpu_times", lambda p, usage: p.cpu_times()._asdict()),
+    ("cpu_num", lambda p, usage: p.cpu_num()),
+    ("memory_full_info", lambda p, usage: p.memory_full_info()._asdict()),
+    ("memory_percent", lambda p, usage: _memory_percent(p, usage)),
+    # reads /proc/<pid>/smaps, which takes long for processes with many mappings
+    ("memory_maps", lambda p, usage: [x._asdict() for x in p.memory_maps()]),
+    ("open_files", lambda p, usage: [x._asdict() for x in p.open_files()]),
+    ("connections", lambda p, usage: [x._asdict() for x in p.connections()])
+])
+
+HOST_COLLECTORS = collections.OrderedDict([
+    ("hostname", lambda usage: host_names()[0]),
+    ("fqdn", lambda usage: host_names()[1]),
+    ("cpu_percent", lambda usage: psutil.cpu_percent(percpu=True)),
+    ("cpu_times", lambda usage: [x._asdict() for x in psutil.cpu_times(percpu=True)]),
+    ("cpu_times_percent", lambda usage: [x._asdict() for x in psutil.cpu_times_percent(percpu=True)]),
+    ("cpu_stats", lambda usage: psutil.cpu_stats()._asdict()),
+    ("cpu_freq", lambda usage: [x._asdict() for x in psutil.cpu_freq(percpu=True)]),
+    ("cpu_count", lambda usage: {"physical": psutil.cpu_count(logical=False), "logical": psutil.cpu_count()}),
+    ("percent_swap_memory_remaining", lambda usage: _percent_remaining(psutil.swap_memory())),
+    ("percent_available_memory_remaining", lambda usage: _percent_remaining(psutil.virtual_memory())),
+    ("swap_memory", lambda usage: psutil.swap_memory()._asdict()),
+    ("virtual_memory", lambda usage: psutil.virtual_memory()._asdict()),
+    ("disk_partitions", lambda usage: [x._asdict() for x in psutil.disk_partitions(all=True)]),
+    ("disk_usage", _disk_usage),
+    ("disk_io_counters", lambda usage: {k: v._asdict() for k,v in psutil.disk_io_counters(perdisk=True).items()}),
+    ("net_io_counters", lambda usage: {k: v._asdict() for k,v in psutil.net_io_counters(pernic=True).items()}),
+    ("net_if_addrs", lambda usage: _net_if_addrs()),
+    ("net_if_stats", lambda usage: {k: v._asdict() for k,v in psutil.net_if_stats().items()})
+])
+
+SECTIONS = {
+    "host": HOST_COLLECTORS,
+    "task": collections.OrderedDict(list(TASK_STATIC_COLLECTORS.items()) + list(TASK_COLLECTORS.items()))
+}
+
+
+def register_task_collector(name, f, static=False):
+    """Add a field to the task section, f(process, usage) returns its value."""
+    (TASK_STATIC_COLLECTORS if static else TASK_COLLECTORS)[name] = f
+    SECTIONS["task"][name] = f
+
+
+def register_host_collector(name, f):
+    """Add a field to the host section, f(usage) returns its value."""
+    HOST_COLLECTORS[name] = f
+
+
+def parse_fields(spec, section=None):
+    """Parse a fields parameter such as "host.cpu_percent,task.threads,task" into the fields to collect.
+
+    Returns {section: list of field names, or None for every field}, sections that are not mentioned are left
+    out.  A spec of None selects every field of every section.  Names without a section belong to section if
+    given, otherwise a bare name selects a whole section.  Raises ValueError for unknown fields."""
+    if spec is None:
+        return {name: None for name in ([section] if section is not None else SECTIONS)}
+
+    fields = {}
+    for item in [x.strip() for x in spec.split(",") if x.strip()]:
+        if "." in item:
+            name, field = item.split(".", 1)
+        elif section is not None:
+            name, field = section, item
+        else:
+            name, field = item, None
+
+        if name not in SECTIONS or (section is not None and name != section):
+            raise ValueError("unknown resources section: {}".format(name))
+        if field is None:
+            fields[name] = None
+        elif field not in SECTIONS[name]:
+            raise ValueError("unknown {} resources field: {}".format(name, field))
+        elif fields.get(name, []) is not None:
+            fields.setdefault(name, []).append(field)
+    return fields
+
+
+def _collect(collectors, fields, args):
+    usage = {}
+    for name, f in collectors.items():
+        if fields is None or name in fields:
+            usage[name] = f(*(args + (usage,)))
+    return usage
+
+
+def task_static_info(process, fields=None):
+    """Fields of a task process that do not change while it runs, collected once per run."""
+    with process.oneshot():
+        return _collect(TASK_STATIC_COLLECTORS, fields, (process,))
+
+
+def task_usage(process, memory_maps=None, fields=None):
+    """Counters of a task process that change while it runs, only those in fields if it is not None.
+
+    Pass memory_maps collected earlier to reuse them."""
+    if memory_maps is not None:
+        fields = [x for x in (fields if fields is not None else TASK_COLLECTORS) if x != "memory_maps"]
+    with process.oneshot():
+        usage = _collect(TASK_COLLECTORS, fields, (process,))
+    if memory_maps is not None:
+        usage["memory_maps"] = memory_maps
+    return usage
+
+
+def host_names(ttl=300):
+    """Host name and fully qualified domain name of this host, looked up again after ttl seconds.
+
+    Resolving the FQDN can mean a DNS round trip."""
+    now = time.monotonic()
+    with _host_names_lock:
+        if _host_names["time"] is None or now - _host_names["time"] >= ttl:
+            hostname = socket.gethostname()
+            _host_names["names"] = (hostname, socket.getfqdn(hostname))
+            _host_names["time"] = now
+        return _host_names["names"]
+
+
+_host_names = {"names": None, "time": None}
+_host_names_lock = threading.Lock()
+
+
+def host_usage(fields=None):
+    """Metrics of the host, only those in fields if it is not None."""
+    return _collect(HOST_COLLECTORS, fields, ())
+
+
+class HostMetrics(object):
+    """host_usage shared by every task of a worker, each field collected again once it is older than ttl seconds.
+
+    Concurrent callers that find fields expired wait for one collection instead of each collecting them."""
+    def __init__(self, ttl=1.0):
+        self.ttl = ttl
+        # field: (time collected, value)
+        self._values = {}
+        self._lock = threading.Lock()
+        self._counters = {"collections": 0, "hits": 0}
+
+    def get(self, fields=None):
+        """The host fields, all of them if fields is None."""
+        if fields is None:
+            fields = list(HOST_COLLECTORS)
+        with self._lock:
+            now = time.monotonic()
+            expired = [x for x in fields if x not in self._values or self.ttl is None or
+                       now - self._values[x][0] >= self.ttl]
+            if expired:
+                collected = host_usage(expired)
+                now = time.monotonic()
+                for name, value in collected.items():
+                    self._values[name] = (now, value)
+                self._counters["collections"] += 1
+            else:
+                self._counters["hits"] += 1
+            return {x: self._values[x][1] for x in HOST_COLLECTORS if x in fields}
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, ttl=self.ttl)
+
+
+class TaskResources(object):
+    """Resource usage of one run of a task process.
+
+    The static fields are collected once, on the first collect or when snapshot is called at start, memory maps
+    at most every memory_maps_interval seconds, everything else on every collect."""
+    def __init__(self, pid, memory_maps_interval=10):
+        self.process = psutil.Process(pid)
+        # the first cpu_percent only starts the measurement
+        self.process.cpu_percent(interval=None)
+        self.memory_maps_interval = memory_maps_interval
+        self.static = None
+        self._memory_maps = None
+        self._memory_maps_time = None
+        # collections may run in several executor threads, oneshot caches on the process object
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        with self._lock:
+            if self.static is None:
+                self.static = task_static_info(self.process)
+            return self.static
+
+    def memory_maps(self):
+        now = time.monotonic()
+        if self._memory_maps is None or self.memory_maps_interval is None or \
+                now - self._memory_maps_time >= self.memory_maps_interval:
+            self._memory_maps = [x._asdict() for x in self.process.memory_maps()]
+            self._memory_maps_time = now
+        return self._memory_maps
+
+    def collect(self, fields=None):
+        """Static fields and current counters of the task process, in the layout of get_task_resources.
+
+        Only the fields named in fields are collected if it is not None."""
+        static = self.snapshot()
+        usage = {k: v for k, v in static.items() if fields is None or k in fields}
+        volatile = None if fields is None else [x for x in fields if x not in static]
+        with self._lock:
+            memory_maps = self.memory_maps() if volatile is None or "memory_maps" in volatile else None
+            usage.update(task_usage(self.process, memory_maps, volatile))
+        return usage
+
+
+class RingBuffer(object):
+    """The last capacity samples of a fixed set of numeric columns, numbered by a sequence that never restarts.
+
+    The columns grow as samples arrive, up to capacity, a short history holds little memory."""
+    def __init__(self, columns, capacity=3600, initial_size=64):
+        self.capacity = capacity
+        self._columns = {name: np.zeros(min(initial_size, capacity), dtype=np.float64) for name in columns}
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def append(self, sample):
+        with self._lock:
+            i = self._seq % self.capacity
+            if i >= self._size():
+                # only before the buffer wrapped around, the samples are still in order from position 0
+                size = min(self.capacity, max(1, 2 * self._size()))
+                self._columns = {name: np.concatenate([column, np.zeros(size - len(column))])
+                                 for name, column in self._columns.items()}
+            for name, column in self._columns.items():
+                column[i] = sample.get(name, np.nan)
+            self._seq += 1
+
+    def trim(self):
+        """Release the room held for samples that did not arrive, once no more are appended."""
+        with self._lock:
+            if self._seq < self._size():
+                self._columns = {name: column[:self._seq].copy() for name, column in self._columns.items()}
+
+    def _size(self):
+        return len(next(iter(self._columns.values()))) if self._columns else self.capacity
+
+    def since(self, seq=0):
+        """Samples numbered seq and later that are still held, oldest first.
+
+        Returns the number of the first sample returned, the number to ask for next, and a list per column.  A
+        seq that is older than the oldest sample held, or ahead of the buffer, starts at the oldest sample."""
+        with self._lock:
+            oldest = max(0, self._seq - self.capacity)
+            if seq < oldest or seq > self._seq:
+                seq = oldest
+            # positions of samples seq to self._seq - 1 in the circular arrays
+            positions = np.arange(seq, self._seq) % self.capacity
+            # values that could not be sampled are NaN in the arrays and None in the lists, JSON has no NaN
+            columns = {name: [None if x != x else x for x in column[positions].tolist()]
+                       for name, column in self._columns.items()}
+            return seq, self._seq, columns
+
+
+class ResourceSampler(object):
+    """Thread that samples host metrics and the metrics of registered task processes every interval seconds.
+
+    Each task and the host keep their last capacity samples in a RingBuffer, memory stays bounded however long
+    tasks run.  A task is sampled from add until finish or until its process is gone, its history is kept until
+    remove, or until more than max_finished tasks finished after it."""
+    def __init__(self, interval=1.0, capacity=3600, max_finished=128):
+        self.interval = interval
+        self.capacity = capacity
+        self.max_finished = max_finished
+        self.logger = logging.getLogger("ResourceSampler")
+        self.host = RingBuffer(HOST_HISTORY_COLUMNS, capacity)
+        # key: {"pid", "process": psutil.Process or None once finished, "history": RingBuffer}
+        self._tasks = {}
+        # keys of finished tasks, oldest first
+        self._finished = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        psutil.cpu_percent()
+        self._thread = threading.Thread(target=self._run, name="ResourceSampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def add(self, key, pid):
+        """Start sampling a process, the history of an earlier process under key is replaced."""
+        process = psutil.Process(pid)
+        process.cpu_percent()
+        with self._lock:
+            self._finished.pop(key, None)
+            self._tasks[key] = {"pid": pid, "process": process, "history": RingBuffer(TASK_HISTORY_COLUMNS,
+                                                                                      self.capacity)}
+
+    def finish(self, key):
+        """Stop sampling under key, the history is kept."""
+        with self._lock:
+            self._finish(key)
+
+    def _finish(self, key):
+        entry = self._tasks.get(key)
+        if entry is None or key in self._finished:
+            return
+        entry["process"] = None
+        entry["history"].trim()
+        self._finished[key] = True
+        while len(self._finished) > self.max_finished:
+            oldest, _ = self._finished.popitem(last=False)
+            self._tasks.pop(oldest, None)
+
+    def remove(self, key):
+        with self._lock:
+            self._tasks.pop(key, None)
+            self._finished.pop(key, None)
+
+    def history(self, key, since=0):
+        with self._lock:
+            if key not in self._tasks:
+                raise KeyError("no resource history for {}".format(key))
+            entry = self._tasks[key]
+        first, next_seq, columns = entry["history"].since(since)
+        return {"pid": entry["pid"], "interval": self.interval, "first": first, "next": next_seq,
+                "columns": columns}
+
+    def host_history(self, since=0):
+        first, next_seq, columns = self.host.since(since)
+        return {"interval": self.interval, "first": first, "next": next_seq, "columns": columns}
+
+    def sample(self):
+        now = time.time()
+        try:
+            self.host.append(_host_sample(now))
+        except Exception as e:
+            self.logger.exception(e)
+
+        with self._lock:
+            tasks = [(k, v) for k, v in self._tasks.items() if v["process"] is not None]
+        for key, entry in tasks:
+            try:
+                entry["history"].append(_task_sample(entry["process"], now))
+            except psutil.Error:
+                # exited, keep what was recorded
+                with self._lock:
+                    if self._tasks.get(key) is entry:
+                        self._finish(key)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+
+def _task_sample(process, now):
+    with process.oneshot():
+        cpu_times = process.cpu_times()
+        memory = process.memory_info()
+        io = process.io_counters()
+        ctx = process.num_ctx_switches()
+        return {
+            "time": now,
+            "cpu_percent": process.cpu_percent(),
+            "cpu_user": cpu_times.user,
+            "cpu_system": cpu_times.system,
+            "memory_rss": memory.rss,
+            "memory_vms": memory.vms,
+            "num_threads": process.num_threads(),
+            "num_fds": process.num_fds(),
+            "read_bytes": io.read_bytes,
+            "write_bytes": io.write_bytes,
+            "voluntary_ctx_switches": ctx.voluntary,
+            "involuntary_ctx_switches": ctx.involuntary
+        }
+
+
+def _host_sample(now):
+    sample = {
+        "time": now,
+        "cpu_percent": psutil.cpu_percent(),
+        "memory_percent": psutil.virtual_memory().percent,
+        "swap_percent": psutil.swap_memory().percent
+    }
+    disk = psutil.disk_io_counters()
+    if disk is not None:
+        sample["disk_read_bytes"] = disk.read_bytes
+        sample["disk_write_bytes"] = disk.write_bytes
+    net = psutil.net_io_counters()
+    if net is not None:
+        sample["net_bytes_sent"] = net.bytes_sent
+        sample["net_bytes_recv"] = net.bytes_recv
+    return sample
@@ -0,0 +1,14 @@
+# 3rd party
+import requests
+import requests.adapters
+
+
+def make_session(pool_connections=10, pool_maxsize=10):
+    """Create a requests session that keeps up to pool_maxsize connections per host alive for reuse.
+
+    pool_connections is the number of hosts to keep a connection pool for."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
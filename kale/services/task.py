@@ -0,0 +1,328 @@
+# stdlib
+import collections
+import hashlib
+import logging
+import multiprocessing
+import multiprocessing.connection
+import multiprocessing.reduction
+import os
+import sys
+import traceback
+
+# local
+from . import objects
+from . import transport
+
+# Everything a task process needs, kept free of the web service, HTTP client, widget and plotting imports so task
+# processes start quickly.  psutil is only needed by the worker side of these classes and is imported there.
+
+
+def load_blob(blob, name):
+    """Rebuild the object pickled in a TaskStore BLOB, a transport message holding one payload called name."""
+    header, payloads = transport.unpack(blob)
+    return transport.loads(payloads[name])
+
+
+def load_payload(payload, name):
+    """Rebuild the object in payload, a TaskStore BLOB or the path of a handoff file holding one.
+
+    A handoff file is mapped and removed, large buffers of the object stay views of the mapping."""
+    if isinstance(payload, str):
+        header, payloads = transport.load(payload)
+        os.remove(payload)
+        return transport.loads(payloads[name])
+    return load_blob(payload, name)
+
+
+def output_path(pid, task_id, stream):
+    """File in the working directory that receives stream, "stdout" or "stderr", of a task.
+
+    A KaleTask writes <pid>.out and <pid>.err, a KaleTaskRunner writes <pid>.<task_id>.out and .err per task."""
+    suffix = {"stdout": "out", "stderr": "err"}[stream]
+    if task_id is None:
+        return "{}.{}".format(pid, suffix)
+    return "{}.{}.{}".format(pid, task_id, suffix)
+
+
+def kill_process_tree(pid, timeout=3):
+    if pid == os.getpid():
+        raise RuntimeWarning("Process {} attempted to kill itself!".format(pid))
+
+    import psutil
+
+    parent = psutil.Process(pid)
+    children = parent.children(recursive=True)
+    for p in children:
+        p.terminate()
+    gone, alive = psutil.wait_procs(children, timeout=timeout)
+    for p in alive:
+        p.kill()
+
+    return True
+
+
+class KaleTask(multiprocessing.Process):
+    def __init__(self, group=None, target=None, name=None, args=(), kwargs={}, results_pipe=None,
+                 handoff_dir=None, handoff_threshold=None, payloads=None, object_dir=None, start_method=None):
+        """payloads optionally holds "args" and "kwargs" as load_payload takes them, unpickled only in the task
+        process in place of args and kwargs.  References to stored objects are resolved from object_dir."""
+        assert results_pipe is not None, "Can not return results without a connection!"
+        assert target is not None, "Can not execute, missing target value!"
+        super(KaleTask, self).__init__(group, target, name, args=args, kwargs=kwargs)
+        self.results = results_pipe
+        self.handoff_dir = handoff_dir
+        self.handoff_threshold = handoff_threshold
+        self.payloads = payloads
+        self.object_dir = object_dir
+        self.start_method = start_method
+        self.logger = None
+
+    def run(self):
+        """Run the target once, send its result and exit.
+
+        A target that raises leaves its traceback in the .err file and exits with code 1."""
+        # make sure default signal handlers exist for suspend and resume
+        #sigstop = signal.signal(signal.SIGSTOP, signal.SIG_DFL)
+        #sigcont = signal.signal(signal.SIGCONT, signal.SIG_DFL)
+
+        if self.logger is None:
+            self.logger = logging.getLogger("KaleTask {}".format(self.pid))
+            self.logger.setLevel(logging.DEBUG)
+            #self.logger.addHandler(logging.handlers.RotatingFileHandler("/tmp/scratch/KaleTask_{}".format(self.pid)))
+        _stdout = sys.stdout
+        _stderr = sys.stderr
+        # line buffered, so the worker can serve output while the task runs
+        sys.stdout = open(output_path(self.pid, None, "stdout"), "a", buffering=1)
+        sys.stderr = open(output_path(self.pid, None, "stderr"), "a", buffering=1)
+
+        try:
+            if self.payloads is not None:
+                self._args = load_payload(self.payloads["args"], "args")
+                self._kwargs = load_payload(self.payloads["kwargs"], "kwargs")
+            self._args, self._kwargs = objects.load_refs((self._args, self._kwargs), self.object_dir)
+            self.logger.debug("KaleTask.run()\ntarget: {}\nargs: {}\nkwargs: {}\n".format(
+                self._target, self._args, self._kwargs))
+
+            out = self._target(*self._args, **self._kwargs)
+            self.logger.debug("KaleTask.run()\nresult : {}\n".format(out))
+        except Exception:
+            traceback.print_exc()
+            self.results.close()
+            sys.exit(1)
+        finally:
+            sys.stdout.close()
+            sys.stderr.close()
+            sys.stdout = _stdout
+            sys.stderr = _stderr
+
+        self.send_results(out)
+        self.results.close()
+
+    def _Popen(self, process_obj):
+        # start through the context of start_method instead of the default context
+        return multiprocessing.get_context(self.start_method).Process._Popen(process_obj)
+
+    def send_results(self, out):
+        send_results(self.results, out, self.handoff_dir, self.handoff_threshold)
+
+    def suspend(self):
+        import psutil
+        target = psutil.Process(self.pid)
+        target.suspend()
+
+    def resume(self):
+        import psutil
+        target = psutil.Process(self.pid)
+        target.resume()
+
+    def terminate(self):
+        self.results.close()
+
+        if self.is_alive():
+            import psutil
+            target = psutil.Process(self.pid)
+            # terminate any children of the target process
+            kill_process_tree(self.pid)
+
+            # terminate the target process
+            super().terminate()
+            if target.is_running() is None:
+                target.kill()
+
+
+def send_results(conn, out, handoff_dir=None, handoff_threshold=None):
+    frames = transport.dumps(out)
+    if handoff_dir is not None and handoff_threshold is not None and \
+            transport.nbytes(frames) >= handoff_threshold:
+        # only the handle crosses the pipe, the worker and local clients map the file
+        conn.send(transport.write_handoff({}, {"results": frames}, handoff_dir))
+    else:
+        transport.send(conn, frames)
+
+
+def run_task_runner(channel, max_targets=16):
+    """Main loop of a KaleTaskRunner process, runs the jobs received on channel one after another.
+
+    Each job is followed by the write end of its own results pipe.  The runner reports ("done", exitcode,
+    traceback) on channel before it closes the results pipe, so the worker knows the exit code by the time it
+    sees the pipe close."""
+    logger = logging.getLogger("KaleTaskRunner {}".format(os.getpid()))
+    # unpickled targets by digest of their TaskStore blob, a restarted task skips unpickling and importing
+    targets = collections.OrderedDict()
+
+    while True:
+        try:
+            job = channel.recv()
+            if job is None:
+                return
+            results = multiprocessing.connection.Connection(multiprocessing.reduction.recv_handle(channel),
+                                                            readable=False)
+        except EOFError:
+            return
+
+        task_id, digest, target_blob, call, args_payload, kwargs_payload, object_dir, handoff_dir, \
+            handoff_threshold = job
+        logger.debug("run task {}".format(task_id))
+
+        _stdout = sys.stdout
+        _stderr = sys.stderr
+        sys.stdout = open(output_path(os.getpid(), task_id, "stdout"), "a", buffering=1)
+        sys.stderr = open(output_path(os.getpid(), task_id, "stderr"), "a", buffering=1)
+        try:
+            if digest in targets:
+                targets.move_to_end(digest)
+            else:
+                targets[digest] = load_blob(target_blob, "target")
+                if len(targets) > max_targets:
+                    targets.popitem(last=False)
+            args = load_payload(args_payload, "args")
+            kwargs = load_payload(kwargs_payload, "kwargs")
+            args, kwargs = objects.load_refs((args, kwargs), object_dir)
+
+            out = getattr(targets[digest], call)(*args, **kwargs)
+            send_results(results, out, handoff_dir, handoff_threshold)
+            done = ("done", 0, None)
+        except Exception:
+            traceback.print_exc()
+            done = ("done", 1, traceback.format_exc())
+        finally:
+            sys.stdout.close()
+            sys.stderr.close()
+            sys.stdout = _stdout
+            sys.stderr = _stderr
+
+        try:
+            channel.send(done)
+        except (BrokenPipeError, EOFError):
+            return
+        finally:
+            results.close()
+
+
+class KaleTaskRunner(object):
+    """Long-lived process that runs tasks one after another.
+
+    Modules imported and caches filled by one task are still there for the next one."""
+    def __init__(self, start_method=None):
+        ctx = multiprocessing.get_context(start_method)
+        # a socket pair, the results pipe of every job is passed through it as a file descriptor
+        self._channel, runner_channel = ctx.Pipe()
+        self.process = ctx.Process(target=run_task_runner, args=(runner_channel,), name="KaleTaskRunner")
+        self.process.start()
+        runner_channel.close()
+        self.pid = self.process.pid
+        self.job = None
+        self.last_task_id = None
+
+    def submit(self, task_id, target_blob, call, args_payload, kwargs_payload, object_dir, handoff_dir,
+               handoff_threshold, results_conn):
+        """Run a task from its TaskStore blobs, its results are sent to results_conn.  Returns the job.
+
+        args_payload and kwargs_payload are taken as by load_payload."""
+        assert self.is_idle(), "KaleTaskRunner {} is busy".format(self.pid)
+        digest = hashlib.sha1(target_blob).hexdigest()
+        self._channel.send((task_id, digest, target_blob, call, args_payload, kwargs_payload, object_dir,
+                            handoff_dir, handoff_threshold))
+        multiprocessing.reduction.send_handle(self._channel, results_conn.fileno(), self.pid)
+        self.job = KaleTaskRunnerJob(self, task_id)
+        self.last_task_id = task_id
+        return self.job
+
+    def poll(self):
+        """Collect the exit code of the current job if the runner reported it."""
+        try:
+            while self.job is not None and self._channel.poll():
+                status, exitcode, error = self._channel.recv()
+                self.job.exitcode = exitcode
+                self.job.error = error
+                self.job = None
+        except (EOFError, OSError):
+            pass
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def is_idle(self):
+        self.poll()
+        return self.job is None and self.is_alive()
+
+    def kill(self, timeout=3):
+        """Kill the runner and everything the current job started."""
+        if self.is_alive():
+            # kill_process_tree only ends the children
+            kill_process_tree(self.pid)
+            self.process.terminate()
+            self.process.join(timeout)
+            if self.process.is_alive():
+                self.process.kill()
+        self.process.join()
+        self._channel.close()
+        if self.job is not None:
+            self.job.exitcode = self.process.exitcode
+            self.job = None
+
+    def stop(self, timeout=3):
+        """Let an idle runner exit, kill it if it does not."""
+        try:
+            # a forked runner holds a copy of this end of the channel, closing it alone is not seen as EOF
+            self._channel.send(None)
+        except OSError:
+            pass
+        self._channel.close()
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.kill()
+
+
+class KaleTaskRunnerJob(object):
+    """The run of one task on a KaleTaskRunner, stands in for the KaleTask process of the task."""
+    def __init__(self, runner, task_id):
+        self.runner = runner
+        self.task_id = task_id
+        self.pid = runner.pid
+        self.exitcode = None
+        self.error = None
+
+    def is_alive(self):
+        if self.exitcode is None:
+            self.runner.poll()
+        if self.exitcode is None and not self.runner.is_alive():
+            self.exitcode = self.runner.process.exitcode
+        return self.exitcode is None
+
+    def terminate(self):
+        # the runner is only killed while it runs this job, afterwards it belongs to other tasks
+        if self.is_alive():
+            self.runner.kill()
+
+    def join(self, timeout=None):
+        # the runner keeps running after the job, wait for it to report the job done or to die
+        if self.is_alive():
+            multiprocessing.connection.wait([self.runner._channel, self.runner.process.sentinel], timeout)
+            self.is_alive()
+
+
+class KaleFunctionWrapper(object):
+    def __init__(self, func=None):
+        assert func is not None
+        setattr(self, func.__name__, func)
@@ -0,0 +1,293 @@
+# stdlib
+import collections
+import json
+import lzma
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+import time
+import uuid
+import zlib
+
+FRAMES_CONTENT_TYPE = "application/x-kale-frames"
+
+HANDOFF_PREFIX = "kale_handoff_"
+
+# a message written to a file that a process on the same host can map instead of receiving over a socket
+Handle = collections.namedtuple("Handle", ["path", "size"])
+
+# contiguous buffers at least this large, e.g. NumPy array data, leave the pickle stream as frames of their own
+OUT_OF_BAND_THRESHOLD = 65536
+
+# every message starts with the byte length of its JSON header
+_HEADER_LENGTH = struct.Struct("!I")
+
+# name: (compress(data, level), decompress(data))
+COMPRESSORS = {
+    "zlib": (lambda data, level: zlib.compress(data, level), zlib.decompress),
+    "lzma": (lambda data, level: lzma.compress(data, preset=level), lzma.decompress)
+}
+
+
+def dumps(obj):
+    """Pickle obj into a list of binary frames.
+
+    The first frame is the pickle stream.  With pickle protocol 5 every large contiguous buffer follows as a
+    frame of its own, a view of the memory of obj rather than a copy."""
+    if pickle.HIGHEST_PROTOCOL < 5:
+        return [pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)]
+
+    buffers = []
+
+    def out_of_band(buffer):
+        try:
+            view = buffer.raw()
+        except BufferError:
+            # not contiguous, stays in the pickle stream
+            return True
+        if view.nbytes < OUT_OF_BAND_THRESHOLD:
+            return True
+        buffers.append(view)
+        return False
+
+    return [pickle.dumps(obj, protocol=5, buffer_callback=out_of_band)] + buffers
+
+
+def loads(frames):
+    """Rebuild an object from the frames produced by dumps.
+
+    Writable frames back the rebuilt buffers directly, read-only frames are copied once so the rebuilt
+    object is writable as it would be from an in-band pickle."""
+    if len(frames) == 1:
+        return pickle.loads(frames[0])
+
+    buffers = [bytearray(f) if memoryview(f).readonly else f for f in frames[1:]]
+    return pickle.loads(frames[0], buffers=buffers)
+
+
+def send(conn, frames):
+    """Send frames through a multiprocessing connection without joining them."""
+    conn.send(("frames", [memoryview(f).nbytes for f in frames]))
+    for f in frames:
+        conn.send_bytes(f)
+
+
+def recv_frames(conn, sizes):
+    """Receive the frames announced by send into writable buffers."""
+    frames = []
+    for size in sizes:
+        frame = bytearray(size)
+        if size > 0:
+            conn.recv_bytes_into(frame)
+        else:
+            conn.recv_bytes()
+        frames.append(frame)
+    return frames
+
+
+def _prefix(header, payloads):
+    header = dict(header)
+    header["payloads"] = {name: [memoryview(f).nbytes for f in frames] for name, frames in payloads.items()}
+    head = json.dumps(header).encode("utf-8")
+    return _HEADER_LENGTH.pack(len(head)) + head
+
+
+def pack(header, payloads):
+    """Build a message body from a JSON-serializable header and named lists of binary frames.
+
+    The layout is a 4 byte big-endian header length, the UTF-8 JSON header, then every frame back to back.
+    The frame lengths of each payload are recorded in the header under "payloads"."""
+    chunks = [_prefix(header, payloads)]
+    for frames in payloads.values():
+        chunks.extend(frames)
+    return b"".join(chunks)
+
+
+def dump(fileobj, header, payloads):
+    """Write the message pack would build to a binary file object, one frame at a time."""
+    fileobj.write(_prefix(header, payloads))
+    for frames in payloads.values():
+        for f in frames:
+            fileobj.write(f)
+
+
+def load(path):
+    """Memory map a message written by dump and unpack it without reading it into memory.
+
+    The mapping is copy-on-write, frames are writable without changing the file."""
+    with open(path, "rb") as f:
+        body = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    return unpack(body)
+
+
+def unpack(body):
+    """Split a message body built by pack into its header and named lists of frames.
+
+    Frames are memoryviews into body, no payload data is copied."""
+    view = memoryview(body)
+    if len(view) < _HEADER_LENGTH.size:
+        raise ValueError("Message is too short to contain a header!")
+
+    head_length, = _HEADER_LENGTH.unpack_from(view, 0)
+    offset = _HEADER_LENGTH.size + head_length
+    header = json.loads(bytes(view[_HEADER_LENGTH.size:offset]).decode("utf-8"))
+
+    payloads = {}
+    for name, lengths in header.pop("payloads", {}).items():
+        frames = []
+        for length in lengths:
+            frames.append(view[offset:offset + length])
+            offset += length
+        payloads[name] = frames
+
+    if offset != len(view):
+        raise ValueError("Message length {} does not match the frame lengths in its header ({})!".format(
+            len(view), offset))
+
+    return header, payloads
+
+
+def compress(header, payloads, method, level=6, threshold=4096):
+    """Compress every frame of at least threshold bytes with method, keeping the result only if it is smaller.
+
+    Which frames were compressed is recorded in the returned header."""
+    compress_frame = COMPRESSORS[method][0]
+    flags = {}
+    compressed = {}
+    for name, frames in payloads.items():
+        flags[name] = []
+        compressed[name] = []
+        for f in frames:
+            if memoryview(f).nbytes >= threshold:
+                data = compress_frame(f, level)
+                if len(data) < memoryview(f).nbytes:
+                    compressed[name].append(data)
+                    flags[name].append(True)
+                    continue
+            compressed[name].append(f)
+            flags[name].append(False)
+    return dict(header, compression={"method": method, "frames": flags}), compressed
+
+
+def decompress(header, payloads):
+    """Undo compress, messages without compression are returned unchanged."""
+    if "compression" not in header:
+        return header, payloads
+
+    header = dict(header)
+    compression = header.pop("compression")
+    decompress_frame = COMPRESSORS[compression["method"]][1]
+    return header, {
+        name: [decompress_frame(f) if flag else f for f, flag in zip(frames, compression["frames"][name])]
+        for name, frames in payloads.items()
+    }
+
+
+def encode(header, payloads, compression=None, level=6, threshold=4096):
+    """pack, compressing frames first if compression names one of COMPRESSORS.
+
+    Returns the body and a dict of metrics: raw and wire bytes, their ratio and the seconds spent."""
+    start = time.perf_counter()
+    raw_bytes = sum(nbytes(frames) for frames in payloads.values())
+    if compression is not None:
+        header, payloads = compress(header, payloads, compression, level, threshold)
+    body = pack(header, payloads)
+    return body, _metrics(compression, raw_bytes, len(body), start)
+
+
+def decode(body):
+    """unpack and decompress, returns the header, the payloads and a dict of metrics like encode."""
+    start = time.perf_counter()
+    header, payloads = unpack(body)
+    compression = header.get("compression", {}).get("method")
+    header, payloads = decompress(header, payloads)
+    raw_bytes = sum(nbytes(frames) for frames in payloads.values())
+    return header, payloads, _metrics(compression, raw_bytes, memoryview(body).nbytes, start)
+
+
+def _metrics(compression, raw_bytes, wire_bytes, start):
+    return {
+        "compression": compression,
+        "raw_bytes": raw_bytes,
+        "wire_bytes": wire_bytes,
+        "ratio": raw_bytes / wire_bytes if wire_bytes > 0 else 1.0,
+        "seconds": time.perf_counter() - start
+    }
+
+
+def write_file(path, header, payloads):
+    """Write a message as dump does to path and return its size in bytes.
+
+    The message goes to a temporary file in the same directory that is then renamed to path, so readers and
+    concurrent writers of path only ever see a complete file."""
+    fd, partial = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with open(fd, "wb") as f:
+            dump(f, header, payloads)
+            size = f.tell()
+        os.replace(partial, path)
+    except BaseException:
+        os.remove(partial)
+        raise
+    return size
+
+
+def handoff_root():
+    """Directory for same-host handoff files, shared memory if the host provides it."""
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    return tempfile.gettempdir()
+
+
+def write_handoff(header, payloads, directory=None):
+    """Write a message to a new handoff file and return its Handle."""
+    if directory is None:
+        directory = handoff_root()
+    fd, path = tempfile.mkstemp(prefix=HANDOFF_PREFIX, dir=directory)
+    with open(fd, "wb") as f:
+        dump(f, header, payloads)
+        size = f.tell()
+    return Handle(path, size)
+
+
+def write_handoffs(payloads, threshold, directory=None):
+    """Move every payload of at least threshold bytes to a handoff file of its own.
+
+    Returns the payloads left to send and {name: {"path": path, "token": token}} for the "handoff" entry of
+    the message header.  The token is also stored in the file, see read_handoff."""
+    sent = dict(payloads)
+    handoff = {}
+    for name in list(sent):
+        if nbytes(sent[name]) >= threshold:
+            token = uuid.uuid4().hex
+            handle = write_handoff({"token": token}, {name: sent.pop(name)}, directory)
+            handoff[name] = {"path": handle.path, "token": token}
+    return sent, handoff
+
+
+def read_handoff(entry, name):
+    """Map the payload name from a handoff file named in a message header by write_handoffs and remove the file.
+
+    Only the sender knows the token stored in the file, a file that does not hold the token of entry is left
+    alone and raises ValueError."""
+    path = entry["path"]
+    if not is_handoff_path(path) or not os.path.exists(path):
+        raise ValueError("{} is not a handoff file".format(path))
+    header, payloads = load(path)
+    if header.get("token") is None or header.get("token") != entry.get("token"):
+        raise ValueError("{} was not written by this client".format(path))
+    os.remove(path)
+    return payloads[name]
+
+
+def is_handoff_path(path):
+    """True if path names a handoff file directly inside handoff_root, used to vet paths sent by clients."""
+    path = os.path.realpath(path)
+    return os.path.dirname(path) == os.path.realpath(handoff_root()) and \
+        os.path.basename(path).startswith(HANDOFF_PREFIX)
+
+
+def nbytes(frames):
+    return sum(memoryview(f).nbytes for f in frames)
@@ -1,13 +1,22 @@
 # stdlib
-import errno
+import asyncio
+import codecs
+import collections
+import heapq
+import inspect
+import itertools
 import logging
 import logging.handlers
 import json
 import multiprocessing
+import multiprocessing.forkserver
 import os
 import pickle
+import re
+import shutil
 import socket
-import sys
+import tempfile
+import threading
 import time
 import traceback
 import uuid
@@ -17,77 +26,95 @@ import psutil
 import requests
 import sanic
 import sanic.response
-import sanic.exceptions
 
 # local
+from . import cache
 from . import db
-from . import manager
+from . import objects
+from . import resources
+from . import sessions
+from . import transport
+# task processes import only kale.services.task, these stay importable from here
+from .task import KaleTask, KaleTaskRunner, KaleTaskRunnerJob, KaleFunctionWrapper, kill_process_tree, load_blob, \
+    output_path
 
 mp = multiprocessing.get_context('spawn')
 
-_RLIMIT_CONSTANTS = {k: v for k, v in psutil.__dict__.items() if k.startswith("RLIMIT")}
+# modules imported once by the forkserver of a worker with task_start_method="forkserver"
+DEFAULT_TASK_PRELOAD = ["kale.services.task"]
+
+_BYTE_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
 
 def get_kale_id():
     return str(uuid.uuid4())
 
 
-def spawn_worker(kale_id, whost="127.0.0.1", mhost="127.0.0.1", mport=8099):
+def spawn_worker(kale_id, whost="127.0.0.1", mhost="127.0.0.1", mport=8099, ready=None, **options):
+    """Start a Kale worker process, if given the ready connection receives its address once it is listening.
+
+    options are passed on to KaleWorker, e.g. task_start_method and task_preload."""
     _logger = logging.getLogger(__name__)
     _logger.debug("spawn_worker")
-    app = KaleWorker(kale_id, mhost, mport)
-    p = mp.Process(target=app.run, args=[whost])
+    app = KaleWorker(kale_id, mhost, mport, **options)
+    p = mp.Process(target=app.run, args=[whost], kwargs={"ready": ready})
     p.start()
     return p
 
 
-def run_function(f=None, args=(), kwargs=None, whost="127.0.0.1", mhost="127.0.0.1", mport=8099):
-    mgr = manager.KaleManagerClient(host=mhost,port=mport)
-    kale_id = get_kale_id()
-    kale_proc = spawn_worker(kale_id, whost=whost, mhost=mhost, mport=mport)
+def start_worker(kale_id=None, whost="127.0.0.1", mhost="127.0.0.1", mport=8099, timeout=60, **options):
+    """Spawn a Kale worker and wait until it is listening, returns the process and a client.
 
-    kale_task = None
-    kale_worker = None
+    The worker reports its address through a pipe as soon as its server started, registration with the manager
+    happens in the background."""
+    if kale_id is None:
+        kale_id = get_kale_id()
 
-    try:
-        while 1:
-            try:
-                worker_info = mgr.get_worker(kale_id)
-                break
-            except requests.HTTPError:
-                time.sleep(0.1)
+    ready_recv, ready_send = mp.Pipe(duplex=False)
+    kale_proc = spawn_worker(kale_id, whost=whost, mhost=mhost, mport=mport, ready=ready_send, **options)
+    # only the worker holds the sending end now, the pipe reports EOF if it dies before it is ready
+    ready_send.close()
 
+    try:
+        if not ready_recv.poll(timeout):
+            raise TimeoutError("Kale worker {} did not start within {} seconds!".format(kale_id, timeout))
+        worker_info = ready_recv.recv()
         kale_worker = KaleWorkerClient(worker_info["host"], worker_info["port"])
+    except EOFError:
+        kale_proc.join()
+        raise RuntimeError("Kale worker {} exited with code {} before it was ready!".format(
+            kale_id, kale_proc.exitcode))
+    except BaseException:
+        if kale_proc.is_alive():
+            kale_proc.terminate()
+        kale_proc.join()
+        raise
+    finally:
+        ready_recv.close()
 
-        # make sure the service is listening
-        while 1:
-            try:
-                kale_worker.get_service_status()
-                break
-            except requests.ConnectionError:
-                time.sleep(0.1)
+    return kale_proc, kale_worker
 
-        kale_task = kale_worker.register_function_task(f, args, kwargs)
-        kale_worker.start_task(kale_task)
 
-        while kale_worker.get_task_status(kale_task) != "running":
-            time.sleep(1)
+def run_function(f=None, args=(), kwargs=None, whost="127.0.0.1", mhost="127.0.0.1", mport=8099, pool=None):
+    """Run f(*args, **kwargs) on a worker leased from pool, by default the shared pool for whost and the manager."""
+    # imported here, kale.services.pool imports this module
+    from . import pool as _pool
 
-        while 1:
-            try:
-                results = kale_worker.get_task_output(kale_task)
-                error = None
-                break
-            except requests.HTTPError:
-                time.sleep(1)
+    if pool is None:
+        pool = _pool.get_default_pool(whost, mhost, mport)
+
+    try:
+        with pool.worker() as kale_worker:
+            kale_task = kale_worker.register_function_task(f, args, kwargs)
+            kale_worker.start_task(kale_task)
+
+            # the worker answers as soon as the task finishes
+            kale_worker.wait_task(kale_task)
+            results = kale_worker.get_task_output(kale_task)
+        error = None
     except Exception as e:
         results = None
         error = e
-    finally:
-        if kale_task is not None and kale_worker is not None:
-            kale_worker.stop_task(kale_task)
-        if kale_worker is not None:
-            kale_worker.shutdown()
-        kale_proc.join()
 
     if error is None:
         return results
@@ -95,99 +122,148 @@ def run_function(f=None, args=(), kwargs=None, whost="127.0.0.1", mhost="127.0.0
         raise Exception(error)
 
 
-async def run_async_function(f=None, args=(), kwargs=None, whost="127.0.0.1", mhost="127.0.0.1", mport=8099):
-    mgr = manager.KaleManagerClient(host=mhost, port=mport)
-    kale_id = get_kale_id()
-    kale_proc = spawn_worker(kale_id, whost=whost, mhost=mhost, mport=mport)
+async def run_async_function(f=None, args=(), kwargs=None, whost="127.0.0.1", mhost="127.0.0.1", mport=8099,
+                             pool=None):
+    """Coroutine version of run_function that yields to the event loop while the task runs, see aio."""
+    from . import aio
+    return await aio.run_async_function(f, args, kwargs, whost=whost, mhost=mhost, mport=mport, pool=pool)
 
-    kale_task = None
-    kale_worker = None
 
-    try:
-        while 1:
-            try:
-                worker_info = mgr.get_worker(kale_id)
-                break
-            except requests.HTTPError:
-                time.sleep(0.1)
+def parse_byte_range(value, size):
+    """Parse a single HTTP Range header value into inclusive (start, end) offsets within size bytes."""
+    match = _BYTE_RANGE.match(value.strip())
+    if match is None or match.group(1) == match.group(2) == "":
+        raise ValueError("Unsupported range {}".format(value))
 
-        kale_worker = KaleWorkerClient(worker_info["host"], worker_info["port"])
+    if match.group(1) == "":
+        # suffix range, the last N bytes
+        start = max(size - int(match.group(2)), 0)
+        end = size - 1
+    else:
+        start = int(match.group(1))
+        end = size - 1 if match.group(2) == "" else min(int(match.group(2)), size - 1)
 
-        # make sure the service is listening
-        while 1:
-            try:
-                kale_worker.get_service_status()
-                break
-            except requests.ConnectionError:
-                time.sleep(0.1)
+    if start >= size or start > end:
+        raise ValueError("Range {} is not satisfiable for {} bytes".format(value, size))
 
-        kale_task = kale_worker.register_function_task(f, args, kwargs)
-        kale_worker.start_task(kale_task)
+    return start, end
 
-        while kale_worker.get_task_status(kale_task) != "running":
-            time.sleep(1)
 
-        while 1:
-            try:
-                results = kale_worker.get_task_output(kale_task)
-                error = None
-                break
-            except requests.HTTPError:
-                time.sleep(1)
-    except Exception as e:
-        results = None
-        error = e
-    finally:
-        if kale_task is not None and kale_worker is not None:
-            kale_worker.stop_task(kale_task)
-        if kale_worker is not None:
-            kale_worker.shutdown()
-        kale_proc.join()
+def read_body(response):
+    """Read the body of a streamed requests response into one writable buffer.
 
-    if error is None:
-        return results
-    else:
-        raise Exception(error)
+    Out-of-band frames unpacked from it back NumPy arrays directly instead of being copied again."""
+    length = response.headers.get("Content-Length")
+    if length is None or response.headers.get("Content-Encoding"):
+        return bytearray(response.content)
 
+    body = bytearray(int(length))
+    view = memoryview(body)
+    offset = 0
+    while offset < len(body):
+        count = response.raw.readinto(view[offset:])
+        if not count:
+            raise requests.ConnectionError("Connection closed after {} of {} bytes".format(offset, len(body)))
+        offset += count
+    return body
 
 
-def kill_process_tree(pid, timeout=3):
-    if pid == os.getpid():
-        raise RuntimeWarning("Process {} attempted to kill itself!".format(pid))
-
-    parent = psutil.Process(pid)
-    children = parent.children(recursive=True)
-    for p in children:
-        p.terminate()
-    gone, alive = psutil.wait_procs(children, timeout=timeout)
-    for p in alive:
-        p.kill()
-
-    return True
+def is_local_address(host):
+    """True if host resolves to a loopback address or to one of the addresses of this machine."""
+    try:
+        address = socket.gethostbyname(host)
+        if address.startswith("127."):
+            return True
+        return address in socket.gethostbyname_ex(socket.gethostname())[2]
+    except socket.error:
+        return False
 
 
 class KaleWorker(sanic.Sanic):
-    def __init__(self, kale_id=None, mhost="127.0.0.1", mport=8099):
+    def __init__(self, kale_id=None, mhost="127.0.0.1", mport=8099, handoff_threshold=1048576,
+                 object_store_bytes=1073741824, compression="zlib", compression_level=6,
+                 compression_threshold=4096, task_start_method=None, task_preload=None, task_runners=0, slots=None,
+                 result_cache=False, result_cache_bytes=268435456, result_cache_age=None, result_cache_spill=None,
+                 result_retention_bytes=1073741824, task_retention_bytes=268435456, spill_dir=None,
+                 memory_maps_interval=10, sample_interval=1.0, history_length=3600, host_metrics_ttl=1.0):
         super().__init__()
         assert kale_id is not None, "kale_id must be a valid identifier"
         self._kale_id = kale_id
         self._manager = (mhost,mport)
         self._manager_url = "http://{}:{}".format(mhost,mport)
+        self._handoff_threshold = handoff_threshold
+        self._object_store_bytes = object_store_bytes
+        self._object_store = None
+        # compression of payloads sent to clients that accept it, None to never compress
+        self._compression = compression
+        self._compression_level = compression_level
+        self._compression_threshold = compression_threshold
+        # multiprocessing start method of task processes, "forkserver" forks them from a server with task_preload
+        # already imported, None for forkserver where available and spawn otherwise, see default_start_method
+        self._task_start_method = task_start_method
+        self._task_preload = task_preload
+        # number of long-lived processes that run tasks one after another, 0 for a new process per task
+        self._task_runners = task_runners
+        # tasks running at once, more are queued, None for the number of physical cores
+        self._slots = slots
+        # answer a task that ran before with the same target and arguments from a cache of results, see ResultCache
+        self._result_cache_options = {"max_bytes": result_cache_bytes, "max_age": result_cache_age,
+                                      "spill": result_cache_spill} if result_cache else None
+        self._result_cache = None
+        # results and pickled tasks kept in memory, above these the least recently used move to files under
+        # spill_dir, None keeps everything in memory
+        self._result_retention_bytes = result_retention_bytes
+        self._task_retention_bytes = task_retention_bytes
+        self._spill_dir = spill_dir
+        self._memory_maps_interval = memory_maps_interval
+        # host and task metrics are sampled every sample_interval seconds, the last history_length samples are
+        # kept, None to not sample
+        self._sample_interval = sample_interval
+        self._history_length = history_length
+        self._sampler = None
+        # host metrics are collected once per host_metrics_ttl seconds for every task and request
+        self._host_metrics_ttl = host_metrics_ttl
+        self._host_metrics = None
+        self._transfers = collections.deque(maxlen=1000)
         self._task_manager = None
+        self._address = None
+        self._ready_conn = None
+        self._registration = None
         self.logger = None
         self.add_route(self.serve_task_status, "/task/<task_id>/status", methods=["GET"])
+        self.add_route(self.serve_wait, "/task/<task_id>/wait", methods=["GET"])
         self.add_route(self.serve_tasks, "/task", methods=["GET"])
+        self.add_route(self.serve_query_tasks, "/tasks/query", methods=["POST"])
         self.add_route(self.serve_register, "/task", methods=["POST"])
+        self.add_route(self.serve_register_batch, "/task/batch", methods=["POST"])
+        self.add_route(self.serve_start_batch, "/task/batch/start", methods=["POST"])
+        self.add_route(self.serve_remove, "/task/<task_id>", methods=["DELETE"])
         self.add_route(self.serve_start, "/task/<task_id>/start", methods=["POST"])
         self.add_route(self.serve_stop, "/task/<task_id>/stop", methods=["POST"])
         self.add_route(self.serve_suspend, "/task/<task_id>/suspend", methods=["POST"])
         self.add_route(self.serve_resume, "/task/<task_id>/resume", methods=["POST"])
         self.add_route(self.serve_resources, "/task/<task_id>/resources", methods=["GET"])
+        self.add_route(self.serve_process_resources, "/task/<task_id>/resources/process", methods=["GET"])
+        self.add_route(self.serve_host_resources, "/host/resources", methods=["GET"])
+        self.add_route(self.serve_resources_history, "/task/<task_id>/resources/history", methods=["GET"])
+        self.add_route(self.serve_host_resources_history, "/host/resources/history", methods=["GET"])
         self.add_route(self.serve_results, "/task/<task_id>/results", methods=["GET"])
+        self.add_route(self.serve_results_stream, "/task/<task_id>/results/stream", methods=["GET"])
+        self.add_route(self.serve_stdout, "/task/<task_id>/stdout", methods=["GET"])
+        self.add_route(self.serve_stderr, "/task/<task_id>/stderr", methods=["GET"])
+        self.add_route(self.serve_objects, "/object", methods=["GET"])
+        self.add_route(self.serve_put_object, "/object", methods=["POST"])
+        self.add_route(self.serve_get_object, "/object/<object_id>", methods=["GET"])
+        self.add_route(self.serve_remove_object, "/object/<object_id>", methods=["DELETE"])
+        self.add_route(self.serve_transfer_metrics, "/metrics/transport", methods=["GET"])
+        self.add_route(self.serve_cache_metrics, "/metrics/cache", methods=["GET"])
+        self.add_route(self.serve_retention_metrics, "/metrics/retention", methods=["GET"])
         self.add_route(self.serve_shutdown, "/shutdown", methods=["POST"])
         self.add_route(self.serve_service_status, "/", methods=["GET"])
+        self.listener("after_server_start")(self._watch_tasks)
+        self.listener("after_server_start")(self._announce)
 
-    def register_worker(self, kale_id, host, port):
+    def routable_host(self):
         # determine ip address that routes to manager service, in case of 0.0.0.0 or unresolved DNS names
         # also ensures that the manager service is reachable from the worker
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -198,14 +274,17 @@ class KaleWorker(sanic.Sanic):
         except socket.timeout as e:
             self.logger.exception(e)
             raise IOError("Worker {} timed out trying to connect via socket to manager service at {}!".format(
-                kale_id, self._manager_url))
+                self._kale_id, self._manager_url))
         except Exception as e:
             self.logger.exception(e)
             raise
         finally:
-            s.shutdown(socket.SHUT_RDWR)
             s.close()
 
+        return _host
+
+    def register_worker(self, kale_id, host, port):
+        _host = self.routable_host()
         self.logger.debug("register_worker {} {} {}".format(kale_id, _host, port))
         response = requests.post("{}/worker".format(self._manager_url),
                                  data=json.dumps({"id": kale_id, "host": _host, "protocol": "http", "port": port}))
@@ -227,40 +306,39 @@ class KaleWorker(sanic.Sanic):
     def run(self, host="127.0.0.1", port=None, debug=False, ssl=None,
             sock=None, workers=1, protocol=None,
             backlog=100, stop_event=None, register_sys_signals=True,
-            access_log=True):
+            access_log=True, ready=None):
         self.logger = logging.getLogger("KaleWorker {}".format(self._kale_id))
         #self.logger.setLevel(logging.DEBUG)
         #self.logger.addHandler(logging.handlers.RotatingFileHandler("/tmp/scratch/KaleWorker_{}".format(
         #    self._kale_id.replace("-","_")
         #    )))
 
-        _port = port
-
-        if _port is None:
-            # IANA unassigned port range is 49152 - 65535
-            _port = 49152
-
-        # make sure we have an available port
+        # a port of 0 lets the kernel pick a free ephemeral port in one bind
         s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-
-        port_selected = False
-
-        while not port_selected:
-            if _port > 65535:
-                raise OSError("Unable to find any open ports!")
-
-            try:
-                s.bind((host, _port))
-                port_selected = True
-            except socket.error as e:
-                if e.errno == errno.EADDRINUSE:
-                    _port = _port + 1
-                else:
-                    raise
+        s.bind((host, port if port is not None else 0))
+        _port = s.getsockname()[1]
 
         self.logger.debug("run {} {} {}".format(self._kale_id, host, _port))
-        self._task_manager = KaleTaskManager(self._kale_id)
-        self.register_worker(self._kale_id, host, _port)
+        self._address = (self.routable_host(), _port)
+        self._ready_conn = ready
+        self._object_store = objects.ObjectStore(self._object_store_bytes)
+        if self._result_cache_options is not None:
+            self._result_cache = cache.ResultCache(**self._result_cache_options)
+        # built here rather than in __init__, the worker is pickled to start it in a new process
+        self._host_metrics = resources.HostMetrics(self._host_metrics_ttl)
+        if self._sample_interval is not None:
+            self._sampler = resources.ResourceSampler(self._sample_interval, self._history_length)
+            self._sampler.start()
+        self._task_manager = KaleTaskManager(self._kale_id, handoff_threshold=self._handoff_threshold,
+                                             object_store=self._object_store,
+                                             start_method=self._task_start_method, preload=self._task_preload,
+                                             task_runners=self._task_runners, slots=self._slots,
+                                             result_cache=self._result_cache,
+                                             result_retention_bytes=self._result_retention_bytes,
+                                             task_retention_bytes=self._task_retention_bytes,
+                                             spill_dir=self._spill_dir,
+                                             memory_maps_interval=self._memory_maps_interval,
+                                             sampler=self._sampler, host_metrics=self._host_metrics)
         # restrict service to one process
         return super(KaleWorker, self).run(None, None, debug, ssl, s, 1, protocol, backlog,
                                             stop_event, register_sys_signals, access_log)
@@ -268,8 +346,33 @@ class KaleWorker(sanic.Sanic):
     def get_service_status(self):
         return psutil.Process().status()
 
+    def _watch_tasks(self, app, loop):
+        self._task_manager.set_event_loop(loop)
+
+    def _announce(self, app, loop):
+        """Report the address to the parent process as soon as the server listens, then register with the manager."""
+        host, port = self._address
+        if self._ready_conn is not None:
+            self._ready_conn.send({"id": self._kale_id, "protocol": "http", "host": host, "port": port})
+            self._ready_conn.close()
+            self._ready_conn = None
+
+        self._registration = threading.Thread(target=self._register, args=(host, port), daemon=True)
+        self._registration.start()
+
+    def _register(self, host, port):
+        try:
+            self.register_worker(self._kale_id, host, port)
+        except Exception as e:
+            self.logger.exception(e)
+
     def shutdown_service(self, delay=5):
         self._task_manager.shutdown()
+        self._object_store.clear()
+        if self._result_cache is not None:
+            self._result_cache.clear()
+        if self._sampler is not None:
+            self._sampler.stop()
 
         # reap any zombie processes
         _children = mp.active_children()
@@ -281,13 +384,37 @@ class KaleWorker(sanic.Sanic):
             if c.is_alive():
                 kill_process_tree(c.pid)
 
+        if self._registration is not None:
+            # never leave a registration behind that completes after unregistering
+            self._registration.join(3)
         self.unregister_worker()
         self.loop.call_later(delay, self.stop)
         return True
 
     def serve_service_status(self, request):
         status = self.get_service_status()
-        return sanic.response.json({"status": status})
+        # clients only compress what they send once they know the worker can decompress it
+        return sanic.response.json({"status": status, "compression": sorted(transport.COMPRESSORS)})
+
+    def serve_transfer_metrics(self, request):
+        transfers = list(self._transfers)
+        raw_bytes = sum(t["raw_bytes"] for t in transfers)
+        wire_bytes = sum(t["wire_bytes"] for t in transfers)
+        return sanic.response.json({
+            "transfers": transfers,
+            "totals": {
+                "count": len(transfers),
+                "raw_bytes": raw_bytes,
+                "wire_bytes": wire_bytes,
+                "ratio": raw_bytes / wire_bytes if wire_bytes > 0 else 1.0,
+                "seconds": sum(t["seconds"] for t in transfers)
+            }
+        })
+
+    def _record_transfer(self, request, direction, metrics):
+        metrics = dict(metrics, path=request.path, direction=direction, time=time.time())
+        self.logger.debug("transfer {}".format(metrics))
+        self._transfers.append(metrics)
 
     def serve_tasks(self, request):
         tasks = self._task_manager.get_tasks()
@@ -307,24 +434,146 @@ class KaleWorker(sanic.Sanic):
         except psutil.NoSuchProcess as e:
             return sanic.response.json({"status": psutil.STATUS_DEAD})
 
-    def serve_register(self, request):
+    def _task_info(self, task_id):
+        info = {}
+        try:
+            info["status"] = self._task_manager.get_task_status(task_id)
+        except psutil.NoSuchProcess:
+            info["status"] = psutil.STATUS_DEAD
+        info["results_available"] = self._task_manager.has_results(task_id)
+        info["finished"] = self._task_manager.is_finished(task_id)
+        return info
+
+    async def serve_query_tasks(self, request):
+        tasks = {}
+        for task_id in request.json["ids"]:
+            # task ids arrive as strings from every other route
+            task_id = str(task_id)
+            info = {}
+            try:
+                info = self._task_info(task_id)
+                if request.json.get("resources", False):
+                    # a list of field names or the comma separated string of the fields query parameter
+                    fields = request.json.get("fields")
+                    if isinstance(fields, list):
+                        fields = ",".join(fields)
+                    fields = resources.parse_fields(fields)
+                    info["resources"] = await self._task_manager.collect_task_resources(task_id, fields)
+            except Exception as e:
+                info["error"] = "{}".format(e.args)
+            tasks[task_id] = info
+        return sanic.response.json({"tasks": tasks})
+
+    async def serve_wait(self, request, task_id):
+        """Long poll, answers as soon as the task finishes or after the timeout query parameter in seconds."""
+        try:
+            timeout = min(float(request.args.get("timeout", 30)), 300)
+            await self._task_manager.wait_task(task_id, timeout)
+            return sanic.response.json(self._task_info(task_id))
+        except Exception as e:
+            return sanic.response.json({"error": "{}".format(e.args)}, status=404)
+
+    def _decode_frames(self, request):
+        """Decode a frames request body, called off the event loop since decompression can take a while."""
+        header, payloads, metrics = transport.decode(request.body)
+        self._record_transfer(request, "received", metrics)
+
+        # large payloads of clients on this host arrive as handoff files
+        for name, entry in header.get("handoff", {}).items():
+            payloads[name] = transport.read_handoff(entry, name)
+        return header, payloads
+
+    def _encode_frames(self, request, payloads):
+        """Build a frames response, compressed if the client accepts the compression of this worker.
+
+        Called off the event loop like _decode_frames."""
+        compression = None
+        accepted = [x.strip() for x in request.headers.get("X-Kale-Accept-Compression", "").split(",")]
+        if self._compression is not None and self._compression in accepted:
+            compression = self._compression
+
+        body, metrics = transport.encode({}, payloads, compression,
+                                         self._compression_level, self._compression_threshold)
+        self._record_transfer(request, "sent", metrics)
+        return sanic.response.raw(body, content_type=transport.FRAMES_CONTENT_TYPE)
+
+    def _decode_task(self, request):
+        header, payloads = self._decode_frames(request)
+        return (
+            transport.pack({}, {"target": payloads["target"]}),
+            header["call"],
+            transport.pack({}, {"args": payloads["args"]}),
+            transport.pack({}, {"kwargs": payloads["kwargs"]}),
+            header["task_name"])
+
+    async def serve_register(self, request):
         self.logger.debug("serve_register")
-        task_id = self._task_manager.register_task(
-            bytes(request.json["target"]),
-            request.json["call"],
-            bytes(request.json["args"]),
-            bytes(request.json["kwargs"]),
-            request.json["task_name"])
+        if request.headers.get("Content-Type", "").startswith(transport.FRAMES_CONTENT_TYPE):
+            try:
+                task = await self.loop.run_in_executor(None, self._decode_task, request)
+            except ValueError as e:
+                return sanic.response.json({"error": "{}".format(e.args)}, status=422)
+            task_id = self._task_manager.register_task(*task)
+        else:
+            # legacy clients send each pickle as a JSON list of integers
+            task_id = self._task_manager.register_task(
+                transport.pack({}, {"target": [bytes(request.json["target"])]}),
+                request.json["call"],
+                transport.pack({}, {"args": [bytes(request.json["args"])]}),
+                transport.pack({}, {"kwargs": [bytes(request.json["kwargs"])]}),
+                request.json["task_name"])
         return sanic.response.json({"id": task_id})
 
+    def _decode_tasks(self, request):
+        header, payloads = self._decode_frames(request)
+        # tasks may share payloads, e.g. one target for a whole parameter sweep, pack each payload once
+        blobs = {}
+        for name, frames in payloads.items():
+            blobs[name] = transport.pack({}, {name.split(".")[0]: frames})
+        tasks = [(blobs[t["target"]], t["call"], blobs[t["args"]], blobs[t["kwargs"]], t["task_name"])
+                 for t in header["tasks"]]
+        return tasks, header.get("start", False)
+
+    async def serve_register_batch(self, request):
+        self.logger.debug("serve_register_batch")
+        try:
+            tasks, start = await self.loop.run_in_executor(None, self._decode_tasks, request)
+        except ValueError as e:
+            return sanic.response.json({"error": "{}".format(e.args)}, status=422)
+
+        task_ids = self._task_manager.register_tasks(tasks)
+        data = {"ids": task_ids}
+        if start:
+            # the other routes know task ids as strings
+            data["started"] = self._task_manager.start_tasks([str(x) for x in task_ids])
+        return sanic.response.json(data)
+
+    def serve_start_batch(self, request):
+        self.logger.debug("serve_start_batch")
+        started = self._task_manager.start_tasks([str(x) for x in request.json["ids"]],
+                                                 request.json.get("priority", 0))
+        return sanic.response.json({"started": started})
+
+    def serve_remove(self, request, task_id):
+        try:
+            self._task_manager.remove_task(task_id)
+            return sanic.response.json({"status": "{} removed".format(task_id)})
+        except KeyError as e:
+            return sanic.response.json({"error": "{}".format(e.args)}, status=404)
+        except Exception as e:
+            return sanic.response.json({"error": "{}".format(e.args)}, status=500)
+
     def serve_start(self, request, task_id):
         self.logger.debug("serve_start")
         try:
-            pid = self._task_manager.start_task(task_id)
+            pid = self._task_manager.start_task(task_id, int(request.args.get("priority", 0)))
+            if pid == -1:
+                # queued, or answered from the result cache
+                return sanic.response.json({"pid": pid, "status": self._task_manager.get_task_status(task_id)})
             return sanic.response.json({"pid": pid})
         except Exception as e:
             return sanic.response.json({"error": "{} failed to start {}".format(
-                task_id, traceback.format_exception(etype=e.__class__, value=e, tb=e.__traceback__))})
+                task_id, traceback.format_exception(type(e), e, e.__traceback__))})
 
     def serve_stop(self, request, task_id):
         try:
@@ -347,29 +596,264 @@ class KaleWorker(sanic.Sanic):
         except Exception as e:
             return sanic.response.json({"status": "{} error: {}".format(task_id, e.args)})
 
-    def serve_resources(self, request, task_id):
-        resources = self._task_manager.get_task_resources(task_id)
-        return sanic.response.json(resources)
+    async def serve_resources(self, request, task_id):
+        """Host and task resources, only the fields named in the fields query parameter if it is given, e.g.
+        fields=host.cpu_percent,task.threads, see resources.parse_fields."""
+        try:
+            fields = resources.parse_fields(request.args.get("fields"))
+        except ValueError as e:
+            return sanic.response.json({"error": "{}".format(e.args)}, status=400)
+        # collection reads /proc and every mounted file system, the other routes keep being served meanwhile
+        data = await self._task_manager.collect_task_resources(task_id, fields)
+        return sanic.response.json(data)
+
+    async def serve_process_resources(self, request, task_id):
+        """The task section of /task/<id>/resources alone, the host section is served by /host/resources."""
+        try:
+            fields = resources.parse_fields(request.args.get("fields"), "task")
+        except ValueError as e:
+            return sanic.response.json({"error": "{}".format(e.args)}, status=400)
+        data = await self._task_manager.collect_task_resources(task_id, fields)
+        return sanic.response.json(data)
+
+    async def serve_host_resources(self, request):
+        try:
+            fields = resources.parse_fields(request.args.get("fields"), "host")
+        except ValueError as e:
+            return sanic.response.json({"error": "{}".format(e.args)}, status=400)
+        data = await self._task_manager.collect_host_resources(fields["host"])
+        data["metrics"] = self._host_metrics.stats()
+        return sanic.response.json(data)
+
+    def serve_resources_history(self, request, task_id):
+        """Samples of the task numbered since and later, column by column, see ResourceSampler."""
+        if self._sampler is None:
+            return sanic.response.json({"error": "resource sampling is disabled on this worker"}, status=404)
+        try:
+            return sanic.response.json(self._sampler.history(task_id, int(request.args.get("since", 0))))
+        except KeyError as e:
+            return sanic.response.json({"error": "{}".format(e.args)}, status=404)
+        except ValueError as e:
+            return sanic.response.json({"error": "{}".format(e.args)}, status=400)
+
+    def serve_host_resources_history(self, request):
+        if self._sampler is None:
+            return sanic.response.json({"error": "resource sampling is disabled on this worker"}, status=404)
+        try:
+            return sanic.response.json(self._sampler.host_history(int(request.args.get("since", 0))))
+        except ValueError as e:
+            return sanic.response.json({"error": "{}".format(e.args)}, status=400)
 
-    def serve_results(self, request, task_id):
+    async def serve_results(self, request, task_id):
         try:
+            if request.args.get("handoff"):
+                # clients on this host map the results file instead of downloading it
+                handle = self._task_manager.get_task_results_handle(task_id)
+                if handle is not None:
+                    return sanic.response.json({"handle": handle._asdict()})
+
             results = self._task_manager.get_task_results(task_id)
+            if transport.FRAMES_CONTENT_TYPE in request.headers.get("Accept", ""):
+                return await self.loop.run_in_executor(
+                    None, lambda: self._encode_frames(request, {"results": transport.dumps(results)}))
             return sanic.response.json({"results": list(pickle.dumps(results, protocol=pickle.HIGHEST_PROTOCOL))})
         except IOError as e:
             return sanic.response.json({"error": "{}".format(e.args)}, status=404)
         except Exception as e:
             return sanic.response.json({"error": "{}".format(e.args)}, status=500)
 
+    async def serve_results_stream(self, request, task_id, chunk_size=1048576):
+        try:
+            path = await self._task_manager.get_task_results_file(task_id)
+        except IOError as e:
+            return sanic.response.json({"error": "{}".format(e.args)}, status=404)
+        except Exception as e:
+            return sanic.response.json({"error": "{}".format(e.args)}, status=500)
+
+        size = os.path.getsize(path)
+        headers = {"Accept-Ranges": "bytes", "X-Kale-Results-Size": str(size)}
+        status = 200
+        start = 0
+        end = size - 1
+
+        if "Range" in request.headers:
+            try:
+                start, end = parse_byte_range(request.headers["Range"], size)
+            except ValueError as e:
+                return sanic.response.json({"error": "{}".format(e.args)}, status=416,
+                                           headers={"Content-Range": "bytes */{}".format(size)})
+            status = 206
+            headers["Content-Range"] = "bytes {}-{}/{}".format(start, end, size)
+
+        async def stream_file(response):
+            with open(path, "rb") as f:
+                f.seek(start)
+                remaining = end - start + 1
+                while remaining > 0:
+                    chunk = f.read(min(chunk_size, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    # write() became a coroutine in later versions of sanic
+                    written = response.write(chunk)
+                    if inspect.isawaitable(written):
+                        await written
+
+        return sanic.response.stream(stream_file, status=status, headers=headers,
+                                     content_type=transport.FRAMES_CONTENT_TYPE)
+
+    async def serve_stdout(self, request, task_id):
+        return await self._serve_output(request, task_id, "stdout")
+
+    async def serve_stderr(self, request, task_id):
+        return await self._serve_output(request, task_id, "stderr")
+
+    async def _serve_output(self, request, task_id, stream, interval=0.1):
+        """Output of the task from the offset query parameter on, at most max_bytes of it.
+
+        With follow set, the request is held open for up to timeout seconds until there is output past offset
+        or the task ends.  The offset to ask for next is in the X-Kale-Offset header, X-Kale-Finished is 1 once
+        the task ended and all of its output was served."""
+        try:
+            offset = int(request.args.get("offset", 0))
+            max_bytes = int(request.args.get("max_bytes", 1048576))
+            follow = request.args.get("follow", "0") not in ("", "0", "false")
+            timeout = min(float(request.args.get("timeout", 30)), 300)
+            deadline = self.loop.time() + timeout
+            while True:
+                data, finished = self._task_manager.read_task_output(task_id, stream, offset, max_bytes)
+                if data or finished or not follow or self.loop.time() >= deadline:
+                    break
+                wait = min(interval, max(0.0, deadline - self.loop.time()))
+                if self._task_manager.is_finished(task_id):
+                    # results arrived, the process closes its output as it exits
+                    await asyncio.sleep(wait)
+                else:
+                    await self._task_manager.wait_task(task_id, wait)
+        except KeyError as e:
+            return sanic.response.json({"error": "{}".format(e.args)}, status=404)
+        except ValueError as e:
+            return sanic.response.json({"error": "{}".format(e.args)}, status=400)
+        except Exception as e:
+            return sanic.response.json({"error": "{}".format(e.args)}, status=500)
+
+        return sanic.response.raw(data, content_type="application/octet-stream", headers={
+            "X-Kale-Offset": str(offset + len(data)),
+            "X-Kale-Finished": "1" if finished and offset + len(data) >= self._task_manager.output_size(
+                task_id, stream) else "0"
+        })
+
+    def serve_objects(self, request):
+        return sanic.response.json({
+            "objects": {k: {"nbytes": v} for k, v in self._object_store.list()},
+            "stats": self._object_store.stats()
+            })
+
+    def _put_object(self, request):
+        header, payloads = self._decode_frames(request)
+        return self._object_store.put(payloads["object"])
+
+    async def serve_put_object(self, request):
+        if request.headers.get("Content-Type", "").startswith(transport.FRAMES_CONTENT_TYPE):
+            try:
+                object_id = await self.loop.run_in_executor(None, self._put_object, request)
+            except ValueError as e:
+                return sanic.response.json({"error": "{}".format(e.args)}, status=422)
+        else:
+            object_id = self._object_store.put([bytes(request.json["object"])])
+        return sanic.response.json({"id": object_id})
+
+    async def serve_get_object(self, request, object_id):
+        try:
+            path = self._object_store.path(object_id)
+        except KeyError as e:
+            return sanic.response.json({"error": "{}".format(e.args)}, status=404)
+
+        if request.args.get("handoff"):
+            return sanic.response.json({"handle": transport.Handle(path, os.path.getsize(path))._asdict()})
+        elif transport.FRAMES_CONTENT_TYPE in request.headers.get("Accept", ""):
+            # the stored file already holds the frames, they only need to be compressed on the way out
+            header, payloads = transport.load(path)
+            return await self.loop.run_in_executor(None, self._encode_frames, request, payloads)
+        return sanic.response.json({"object": list(pickle.dumps(objects.load_object(path),
+                                                                protocol=pickle.HIGHEST_PROTOCOL))})
+
+    def serve_remove_object(self, request, object_id):
+        try:
+            self._object_store.remove(object_id)
+            return sanic.response.json({"status": "{} removed".format(object_id)})
+        except KeyError as e:
+            return sanic.response.json({"error": "{}".format(e.args)}, status=404)
+
+    def serve_cache_metrics(self, request):
+        if self._result_cache is None:
+            return sanic.response.json({"enabled": False})
+        return sanic.response.json(dict(self._result_cache.stats(), enabled=True))
+
+    def serve_retention_metrics(self, request):
+        return sanic.response.json(self._task_manager.retention_stats())
+
     def serve_shutdown(self, request):
         delay = 5
         self.shutdown_service()
         return sanic.response.json({"status": "Shutting down in {} seconds!".format(delay)})
 
 
+def default_start_method():
+    """Start method of task processes when none is given.
+
+    The worker runs executor, sampler and registration threads.  A task forked from it could inherit a lock one
+    of them held at that moment, e.g. of logging or the task store, and hang on it, so tasks are not forked from
+    the worker unless asked for with start_method="fork"."""
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return "forkserver"
+    return "spawn"
+
+
 class KaleTaskManager(object):
-    def __init__(self, kale_id=None, logger=None):
-        self.tasks = db.TaskStore()
+    def __init__(self, kale_id=None, logger=None, handoff_threshold=1048576, object_store=None, start_method=None,
+                 preload=None, task_runners=0, slots=None, result_cache=None, result_retention_bytes=None,
+                 task_retention_bytes=None, spill_dir=None, memory_maps_interval=10, sampler=None,
+                 host_metrics=None):
+        self.tasks = db.TaskStore(task_retention_bytes, spill_dir)
         self._tasks = {}
+        self._object_store = object_store
+        self._results_dir = None
+        # results at least this large are handed over in a shared memory file, None to always use the pipe
+        self._handoff_threshold = handoff_threshold
+        self._handoff_dir = None
+        # event loop that watches task results pipes, see set_event_loop
+        self._loop = None
+        if start_method is None:
+            start_method = default_start_method()
+        self._start_method = start_method
+        # tasks run on up to task_runners KaleTaskRunner processes, a KaleTask is started while all are busy
+        self._task_runners = task_runners
+        self._runners = []
+        # at most slots tasks run at once, the rest wait in a priority queue, first in first out per priority
+        if slots is None:
+            slots = psutil.cpu_count(logical=False) or psutil.cpu_count() or 1
+        self.slots = slots
+        self._queue = []
+        self._queued = {}
+        self._queue_counter = itertools.count()
+        # launched tasks that may still hold a slot, see running_tasks
+        self._running = set()
+        self._result_cache = result_cache
+        # results of finished tasks held in memory or shared memory, least recently used first, above
+        # result_retention_bytes the oldest are moved to files under spill_dir and loaded from there when asked for
+        self._retention_bytes = result_retention_bytes
+        self._spill = spill_dir
+        self._spill_dir = None
+        self._retained = collections.OrderedDict()
+        self._retained_nbytes = 0
+        self._spills = 0
+        # static resource fields are collected once per run, memory maps at most every memory_maps_interval seconds
+        self._memory_maps_interval = memory_maps_interval
+        # records the history of every task run, see ResourceSampler
+        self._sampler = sampler
+        # the host section of task resources, collected once for all tasks
+        self._host_metrics = host_metrics if host_metrics is not None else resources.HostMetrics()
 
         assert kale_id is not None, "kale_id is required"
 
@@ -378,18 +862,159 @@ class KaleTaskManager(object):
         else:
             self.logger = logger
 
+        if start_method == "forkserver":
+            self.start_forkserver(preload)
+
+    def start_forkserver(self, preload=None):
+        """Start the forkserver now rather than on the first task, importing preload in it once.
+
+        Every task forked from it starts with those modules imported instead of importing them again."""
+        if preload is None:
+            preload = DEFAULT_TASK_PRELOAD
+        self.logger.debug("start_forkserver preload {}".format(preload))
+        multiprocessing.get_context("forkserver").set_forkserver_preload(list(preload))
+        multiprocessing.forkserver.ensure_running()
+
+    def set_event_loop(self, loop):
+        """Watch the results pipes of tasks on loop, so waiters wake up as soon as a task finishes.
+
+        Must be called from the thread running loop."""
+        self._loop = loop
+        for task_id in self._tasks:
+            self._watch(task_id)
+
+    def _watch(self, task_id):
+        task = self._tasks[task_id]
+        if task.get("finished") is None:
+            task["finished"] = asyncio.Event()
+        if self._loop is None:
+            return
+
+        self._watch_exit(task_id)
+        if task["finished"].is_set():
+            return
+
+        if task["results_pipe"] is None:
+            # the exit of the task is all that is left to wait for
+            self._set_finished(task_id)
+        elif not task["watched"]:
+            # readable once results arrive, or at EOF if the task exits without any
+            self._loop.add_reader(task["results_pipe"].fileno(), self._on_task_finished, task_id)
+            task["watched"] = True
+
+    def _unwatch(self, task_id):
+        task = self._tasks[task_id]
+        if task["watched"]:
+            self._loop.remove_reader(task["results_pipe"].fileno())
+            task["watched"] = False
+
+    def _watch_exit(self, task_id):
+        task = self._tasks[task_id]
+        # task runner jobs have no process of their own, the runner reports their exit code with the results
+        sentinel = getattr(task["process"], "sentinel", None)
+        if sentinel is not None and not task["exit_watched"] and task["process"].exitcode is None:
+            self._loop.add_reader(sentinel, self._on_task_exit, task_id)
+            task["exit_watched"] = True
+
+    def _unwatch_exit(self, task_id):
+        task = self._tasks[task_id]
+        if task.get("exit_watched"):
+            self._loop.remove_reader(task["process"].sentinel)
+            task["exit_watched"] = False
+
+    def _on_task_finished(self, task_id):
+        self._unwatch(task_id)
+        # take the results right away, the task process can exit once they left the pipe
+        self._receive_results(task_id)
+        # at EOF without results the process may still be exiting, its sentinel reports the exit
+        self._set_finished(task_id)
+        if self._sampler is not None and isinstance(self._tasks[task_id]["process"], KaleTaskRunnerJob):
+            # the runner goes on with other tasks
+            self._sampler.finish(task_id)
+        self._dispatch()
+
+    def _on_task_exit(self, task_id):
+        """Reap the task process as soon as it exits and record its exit code."""
+        task = self._tasks[task_id]
+        self._unwatch_exit(task_id)
+        task["process"].join()
+        self.logger.debug("task {} exited with code {}".format(task_id, task["process"].exitcode))
+        if self._sampler is not None:
+            self._sampler.finish(task_id)
+
+        if not self._receive_results(task_id):
+            # nothing more will arrive
+            self._close_results_pipe(task_id)
+        task["finished"].set()
+        self._dispatch()
+
+    def _close_results_pipe(self, task_id):
+        task = self._tasks[task_id]
+        if task["results_pipe"] is not None:
+            self._unwatch(task_id)
+            task["results_pipe"].close()
+            task["results_pipe"] = None
+        self._set_finished(task_id)
+
+    def _set_finished(self, task_id):
+        """Wake up the waiters of the task if it is finished."""
+        finished = self._tasks[task_id].get("finished")
+        if finished is not None and self.is_finished(task_id):
+            finished.set()
+
+    def is_finished(self, task_id):
+        """True once there is nothing left to wait for: results arrived, or the task ended or never started.
+
+        A task that closed its results pipe without results is only finished once its exit code is known."""
+        if task_id in self._queued:
+            return False
+        if task_id not in self._tasks:
+            return True
+        return self.has_results(task_id) or not self._tasks[task_id]["process"].is_alive()
+
+    async def wait_task(self, task_id, timeout=None):
+        """Wait until is_finished(task_id) or the timeout in seconds passes, returns is_finished(task_id)."""
+        if task_id in self._queued:
+            start = time.monotonic()
+            try:
+                await asyncio.wait_for(self._queued[task_id]["started"].wait(), timeout)
+            except asyncio.TimeoutError:
+                return False
+            if timeout is not None:
+                timeout = max(0.0, timeout - (time.monotonic() - start))
+
+        if not self.is_finished(task_id):
+            self._watch(task_id)
+            try:
+                await asyncio.wait_for(self._tasks[task_id]["finished"].wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.is_finished(task_id)
+
     def get_tasks(self):
         self.logger.debug("get_tasks")
         return self.tasks.list()
 
     def get_task_status(self, task_id):
         self.logger.debug("get_task_status")
-        pid = self.tasks.find(task_id)[-1]
+        if task_id in self._queued:
+            return "queued"
+        if task_id in self._tasks and self._tasks[task_id].get("cached"):
+            return "completed"
+
+        pid = self._pid(task_id)
 
         if pid == -1:
             return "not running"
 
-        if self._tasks[task_id]["results"] is None:
+        process = self._tasks[task_id]["process"] if task_id in self._tasks else None
+        if process is not None and not process.is_alive():
+            # task processes exit as soon as they sent their results
+            if self.has_results(task_id):
+                return "completed"
+            return "exited with code {}".format(process.exitcode)
+
+        if not self.has_results(task_id):
             return psutil.Process(pid).status()
         else:
             status = psutil.Process(pid=pid).status()
@@ -398,55 +1023,255 @@ class KaleTaskManager(object):
             else:
                 return "results available, {}".format(status)
 
+    def _pid(self, task_id):
+        """pid of the last run of the task, -1 if it is not running.
+
+        Looked up without the BLOBs of the task, reading those would reload them if they were spilled."""
+        pid = self.tasks.find_pid(task_id)
+        if pid is None:
+            raise KeyError("task: {} does not exist".format(task_id))
+        return pid
+
     def register_task(self, target, call, args, kwargs, task_name):
         self.logger.debug("register_task")
         task_id = self.tasks.add(target, call, args, kwargs, task_name)
         return task_id
 
-    def start_task(self, task_id):
+    def register_tasks(self, tasks):
+        """Register (target, call, args, kwargs, task_name) tuples in one transaction, returns the task ids."""
+        self.logger.debug("register_tasks {}".format(len(tasks)))
+        return self.tasks.add_many(tasks)
+
+    def start_tasks(self, task_ids, priority=0):
+        """Start every task, returns a dict of task id to {"pid": pid} or {"error": reason}.
+
+        Tasks queued until a slot is free have a pid of -1 and a status of "queued"."""
+        started = {}
+        for task_id in task_ids:
+            try:
+                pid = self.start_task(task_id, priority)
+                started[task_id] = {"pid": pid, "status": self.get_task_status(task_id)} if pid == -1 else {"pid": pid}
+            except Exception as e:
+                self.logger.exception(e)
+                started[task_id] = {"error": "{} failed to start {}".format(
+                    task_id, traceback.format_exception(type(e), e, e.__traceback__))}
+        return started
+
+    def _acquire_runner(self, task_id):
+        """An idle task runner, preferably the one that ran task_id before, None if all are busy."""
+        self._runners = [r for r in self._runners if r.is_alive()]
+        idle = [r for r in self._runners if r.is_idle()]
+        for r in idle:
+            if r.last_task_id == task_id:
+                return r
+        if len(idle) > 0:
+            return idle[0]
+        if len(self._runners) < self._task_runners:
+            r = KaleTaskRunner(self._start_method)
+            self._runners.append(r)
+            return r
+        return None
+
+    def running_tasks(self):
+        """Number of started tasks that did not finish yet, each one holds a slot.
+
+        Only launched tasks that were not seen finished yet are checked, not every task the worker holds."""
+        self._running = set(t for t in self._running if t not in self._queued and not self.is_finished(t))
+        return len(self._running)
+
+    def start_task(self, task_id, priority=0):
+        """Start the task if a slot is free and return its pid, otherwise queue it and return -1.
+
+        Queued tasks start in order of decreasing priority, then in the order they were queued, as slots free up.
+        A task answered from the result cache completes right away without a process, its pid is -1 as well."""
         self.logger.debug("start_task")
+        self._pid(task_id)
+        if task_id in self._queued:
+            return -1
+
+        if self._result_cache is not None:
+            row = self.tasks.find(task_id)
+            key = cache.ResultCache.key(row[1], row[2], row[3], row[4])
+            frames = self._result_cache.get(key)
+            if frames is not None:
+                self._complete_from_cache(task_id, key, frames)
+                return -1
+
+        if len(self._queued) == 0 and self.running_tasks() < self.slots:
+            return self._launch(task_id)
+
+        seq = next(self._queue_counter)
+        heapq.heappush(self._queue, (-priority, seq, task_id))
+        self._queued[task_id] = {"seq": seq, "started": asyncio.Event()}
+        self.logger.debug("queued task {}, {} waiting".format(task_id, len(self._queued)))
+        # a slot may have freed up without anybody noticing, e.g. before the event loop watched the task
+        self._dispatch()
+        if task_id not in self._queued and task_id in self._tasks:
+            return self._tasks[task_id]["process"].pid
+        return -1
+
+    def _complete_from_cache(self, task_id, key, frames):
+        self.logger.debug("start_task {} answered from the result cache".format(task_id))
+        self.tasks.update_pid(task_id, -1)
+        self._remove_results_files(task_id)
+        if task_id in self._tasks:
+            self._close_results_pipe(task_id)
+            self._unwatch_exit(task_id)
+            self._remove_output_files(task_id)
+        self._tasks[task_id] = {
+            "process": cache.CachedRun(),
+            "results_pipe": None,
+            "results": transport.loads(frames),
+            "results_handle": None,
+            "results_ready": True,
+            "watched": False,
+            "exit_watched": False,
+            "cached": True,
+            "cache_key": key
+        }
+        self._retain(task_id, transport.nbytes(frames))
+        self._watch(task_id)
+
+    def _dequeue(self, task_id):
+        entry = self._queued.pop(task_id, None)
+        if entry is not None:
+            # the heap entry is skipped once it reaches the top, waiters are released
+            entry["started"].set()
+        return entry is not None
+
+    def _dispatch(self):
+        """Start queued tasks while slots are free."""
+        if len(self._queue) == 0:
+            return
+        running = self.running_tasks()
+        while self._queue and running < self.slots:
+            priority, seq, task_id = heapq.heappop(self._queue)
+            entry = self._queued.get(task_id)
+            if entry is None or entry["seq"] != seq:
+                continue
+            del self._queued[task_id]
+            try:
+                self._launch(task_id)
+                running += 1
+            except Exception as e:
+                self.logger.exception(e)
+            entry["started"].set()
+
+    def _launch(self, task_id):
+        # output of a previous run, removed before a task runner may append to the same files again
+        self._remove_output_files(task_id)
         # pull the task DB info, unpack data into what the task needs
         row = self.tasks.find(task_id)
-        target = pickle.loads(row[1])
         call = row[2]
-        assert callable(getattr(target, call))
-        args = pickle.loads(row[3])
-        kwargs = pickle.loads(row[4])
         name = row[5]
+        # the task maps stored objects itself instead of receiving a copy through the worker
+        object_dir = self._object_store.directory if self._object_store is not None else None
         # set up the connection to receive task results
         worker_conn, task_conn = mp.Pipe(duplex=False)
 
+        if self._handoff_threshold is not None and self._handoff_dir is None:
+            self._handoff_dir = tempfile.mkdtemp(prefix="kale_", dir=transport.handoff_root())
+        # args and kwargs are only unpickled by the task, large ones are mapped from a handoff file
+        args_payload = self._task_payload(row[3])
+        kwargs_payload = self._task_payload(row[4])
+
         # make sure default signal handlers exist for suspend and resume
         #sigstop = signal.signal(signal.SIGSTOP, signal.SIG_DFL)
         #sigcont = signal.signal(signal.SIGCONT, signal.SIG_DFL)
 
-        # create the task, start it, release the task connection end
-        p = KaleTask(target=getattr(target, call), name=name, args=args, kwargs=kwargs, results_pipe=task_conn)
-        p.start()
+        runner = self._acquire_runner(task_id) if self._task_runners > 0 else None
+        if runner is not None:
+            # the runner unpickles the target itself, and not again if it ran this task before
+            p = runner.submit(task_id, row[1], call, args_payload, kwargs_payload, object_dir, self._handoff_dir,
+                              self._handoff_threshold, task_conn)
+            output_task_id = task_id
+        else:
+            # create the task, start it, release the task connection end
+            target = load_blob(row[1], "target")
+            assert callable(getattr(target, call))
+            p = KaleTask(target=getattr(target, call), name=name, results_pipe=task_conn,
+                         handoff_dir=self._handoff_dir, handoff_threshold=self._handoff_threshold,
+                         payloads={"args": args_payload, "kwargs": kwargs_payload}, object_dir=object_dir,
+                         start_method=self._start_method)
+            p.start()
+            output_task_id = None
 
         task_conn.close()
-        # save state
+        # save state, results of a previous run are replaced
         self.tasks.update_pid(task_id, p.pid)
+        self._remove_results_files(task_id)
+        if task_id in self._tasks:
+            # stop watching the previous run, its callbacks would act on this one
+            self._close_results_pipe(task_id)
+            self._unwatch_exit(task_id)
         self._tasks[task_id] = {}
         self._tasks[task_id]["process"] = p
         self._tasks[task_id]["results_pipe"] = worker_conn
         self._tasks[task_id]["results"] = None
+        self._tasks[task_id]["results_handle"] = None
+        self._tasks[task_id]["results_ready"] = False
+        self._tasks[task_id]["watched"] = False
+        self._tasks[task_id]["exit_watched"] = False
+        self._running.add(task_id)
+        # task processes write to the working directory they share with the worker
+        self._tasks[task_id]["output"] = {stream: os.path.abspath(output_path(p.pid, output_task_id, stream))
+                                          for stream in ["stdout", "stderr"]}
+        if self._result_cache is not None:
+            self._tasks[task_id]["cache_key"] = cache.ResultCache.key(row[1], row[2], row[3], row[4])
+        try:
+            self._tasks[task_id]["resources"] = resources.TaskResources(p.pid, self._memory_maps_interval)
+            self._tasks[task_id]["resources"].snapshot()
+        except psutil.Error:
+            # exited already, or not readable yet, the snapshot is taken on the first request
+            pass
+        if self._sampler is not None:
+            try:
+                self._sampler.add(task_id, p.pid)
+            except psutil.Error:
+                self._sampler.remove(task_id)
+        self._watch(task_id)
         return p.pid
 
+    def _task_payload(self, blob):
+        """Pass a TaskStore BLOB to a task as it is, or as a handoff file the task maps if it is large."""
+        if self._handoff_dir is None or len(blob) < self._handoff_threshold:
+            return blob
+        fd, path = tempfile.mkstemp(prefix=transport.HANDOFF_PREFIX, dir=self._handoff_dir)
+        with open(fd, "wb") as f:
+            f.write(blob)
+        return path
+
     def stop_task(self, task_id):
         self.logger.debug("stop_task {}".format(task_id))
+        if self._dequeue(task_id):
+            return True
+
+        try:
+            return self._stop(task_id)
+        finally:
+            self._dispatch()
 
-        pid = self.tasks.find(task_id)[-1]
+    def _stop(self, task_id):
+        pid = self._pid(task_id)
         try:
-            self._tasks[task_id]["results_pipe"].close()
-            self._tasks[task_id]["results_pipe"] = None
+            self._close_results_pipe(task_id)
         except Exception:
             pass
 
+        process = self._tasks[task_id]["process"] if task_id in self._tasks else None
+        if isinstance(process, KaleTaskRunnerJob):
+            # the runner outlives the task, it is only killed if it is still running this task
+            process.terminate()
+            self.tasks.update_pid(task_id, -1)
+            # no sentinel reports the end of a runner job
+            self._set_finished(task_id)
+            return True
+
         self.logger.debug("task pid {}".format(pid))
         self.logger.debug("checking children for specific task pid")
 
-        child_procs = psutil.Process().children()
+        # tasks forked by a forkserver are children of the forkserver, not of the worker
+        child_procs = psutil.Process().children(recursive=True)
 
         for p in child_procs:
             self.logger.debug("child pid {}, target pid {}".format(p.pid, pid))
@@ -479,134 +1304,170 @@ class KaleTaskManager(object):
             self.logger.warning("task: {} was not running".format(task_id))
 
         self.tasks.update_pid(task_id, -1)
+        if task_id in self._tasks:
+            self._set_finished(task_id)
         return True
 
+    def _running_pid(self, task_id):
+        pid = self._pid(task_id)
+        # a task runner that finished this task may already be running another one
+        if pid == -1 or task_id not in self._tasks or not self._tasks[task_id]["process"].is_alive():
+            raise psutil.NoSuchProcess(pid, msg="task: {} was not running".format(task_id))
+        return pid
+
     def suspend_task(self, task_id):
-        pid = self._tasks[task_id].find(task_id)[-1]
-        if pid == -1:
-            raise psutil.NoSuchProcess("task: {} was not running".format(task_id))
-        else:
-            psutil.Process(pid).suspend()
-            return True
+        psutil.Process(self._running_pid(task_id)).suspend()
+        return True
 
     def resume_task(self, task_id):
-        pid = self._tasks[task_id].find(task_id)[-1]
-        if pid == -1:
-            raise psutil.NoSuchProcess("task: {} was not running".format(task_id))
-        else:
-            psutil.Process(pid).resume()
-            return True
-
-    def get_task_resources(self, task_id):
-        self.logger.debug("get_task_resources")
-        pid = self.tasks.find(task_id)[-1]
-
-        if pid == -1:
-            raise psutil.NoSuchProcess("task: {} was not running".format(task_id))
+        psutil.Process(self._running_pid(task_id)).resume()
+        return True
 
-        task = psutil.Process(pid)
+    def get_task_resources(self, task_id, fields=None):
+        """Resource usage of the task process and its host.
 
+        fields selects what is collected, {section: field names or None for all}, see resources.parse_fields.
+        Sections that are not in fields are left out, None collects everything."""
+        self.logger.debug("get_task_resources")
+        if fields is None:
+            fields = resources.parse_fields(None)
+        return self._collect_resources(self._task_resources(task_id), fields)
+
+    async def collect_task_resources(self, task_id, fields=None):
+        """get_task_resources without blocking the event loop, the collection runs in the default executor."""
+        self.logger.debug("collect_task_resources")
+        if fields is None:
+            fields = resources.parse_fields(None)
+        # the task store is only used from the event loop thread
+        task_resources = self._task_resources(task_id) if "task" in fields else None
+        return await asyncio.get_event_loop().run_in_executor(None, self._collect_resources, task_resources, fields)
+
+    async def collect_host_resources(self, fields=None):
+        """Host section of the task resources, shared by all tasks and collected at most once per TTL."""
+        self.logger.debug("collect_host_resources")
+        return await asyncio.get_event_loop().run_in_executor(None, self._collect_resources, None,
+                                                              {"host": fields})
+
+    def _collect_resources(self, task_resources, fields):
         try:
-            task_usage = {}
-            with task.oneshot():
-                task_usage["pid"] = task.pid
-                task_usage["ppid"] = task.ppid()
-                task_usage["name"] = task.name()
-                task_usage["executable"] = task.exe()
-                task_usage["cmdline"] = task.cmdline()
-                task_usage["environ"] = task.environ()
-                task_usage["create_time"] = task.create_time()
-                task_usage["status"] = task.status()
-                task_usage["cwd"] = task.cwd()
-                task_usage["username"] = task.username()
-                task_usage["uids"] = task.uids()
-                task_usage["gids"] = task.gids()
-                task_usage["terminal"] = task.terminal()
-                task_usage["nice"] = task.nice()
-                task_usage["ionice"] = task.ionice()._asdict()
-                task_usage["rlimits"] = {k: task.rlimit(v) for k, v in _RLIMIT_CONSTANTS.items()}
-                task_usage["io_counters"] = task.io_counters()._asdict()
-                task_usage["num_ctx_switches"] = task.num_ctx_switches()
-                task_usage["num_fds"] = task.num_fds()
-                task_usage["num_threads"] = task.num_threads()
-                task_usage["threads"] = [x._asdict() for x in task.threads()]
-                task_usage["cpu_percent"] = task.cpu_percent(interval=0.1)
-                task_usage["cpu_times"] = task.cpu_times()._asdict()
-                task_usage["cpu_affinity"] = task.cpu_affinity()
-                task_usage["cpu_num"] = task.cpu_num()
-                task_usage["memory_full_info"] = task.memory_full_info()._asdict()
-                task_usage["memory_percent"] = {k: task.memory_percent(k) for k in task_usage["memory_full_info"]}
-                task_usage["memory_maps"] = [x._asdict() for x in task.memory_maps()]
-                task_usage["open_files"] = [x._asdict() for x in task.open_files()]
-                task_usage["connections"] = [x._asdict() for x in task.connections()]
-
-            swap_mem = psutil.swap_memory()
-            virtual_mem = psutil.virtual_memory()
-            partitions = psutil.disk_partitions(all=True)
-            net_if_addrs = psutil.net_if_addrs()
-            hostname = socket.gethostname()
-
-            if swap_mem[1] < 1E-6:
-                pct_swap_rem = 100.0
-            else:
-                pct_swap_rem = swap_mem[1]/swap_mem[0] * 100.0
-            
-            if virtual_mem[1] < 1E-6:
-                pct_avail_rem = 100.0
-            else:
-                pct_avail_rem = virtual_mem[1]/virtual_mem[0] * 100.0
-
-            disk_usage = {}
-            for i in range(len(partitions)):
-                mount = partitions[i].mountpoint
-                try:
-                    disk_usage[mount] = psutil.disk_usage(mount)._asdict()
-                except PermissionError as e:
-                    continue
-
-            data = {
-                "host": {
-                    "hostname": hostname,
-                    "fqdn": socket.getfqdn(hostname),
-                    "cpu_percent": psutil.cpu_percent(percpu=True),
-                    "cpu_times": [x._asdict() for x in psutil.cpu_times(percpu=True)],
-                    "cpu_times_percent": [x._asdict() for x in psutil.cpu_times_percent(percpu=True)],
-                    "cpu_stats": psutil.cpu_stats()._asdict(),
-                    "cpu_freq": [x._asdict() for x in psutil.cpu_freq(percpu=True)],
-                    "cpu_count": {
-                        "physical": psutil.cpu_count(logical=False),
-                        "logical": psutil.cpu_count()
-                    },
-                    "percent_swap_memory_remaining": pct_swap_rem,
-                    "percent_available_memory_remaining": pct_avail_rem,
-                    "swap_memory": swap_mem._asdict(),
-                    "virtual_memory": virtual_mem._asdict(),
-                    "disk_partitions": [x._asdict() for x in partitions],
-                    "disk_usage": disk_usage,
-                    "disk_io_counters": {k: v._asdict() for k,v in psutil.disk_io_counters(perdisk=True).items()},
-                    "net_io_counters": {k: v._asdict() for k,v in psutil.net_io_counters(pernic=True).items()},
-                    "net_if_addrs": {k: [x._asdict() for x in net_if_addrs[k]] for k in net_if_addrs},
-                    "net_if_stats": {k: v._asdict() for k,v in psutil.net_if_stats().items()}
-                    },
-                "task": task_usage
-                }
+            data = {}
+            if "host" in fields:
+                data["host"] = self._host_metrics.get(fields["host"])
+            if task_resources is not None:
+                data["task"] = task_resources.collect(fields["task"])
         except Exception as e:
             self.logger.exception(e)
-            data = {'error': "{}".format(traceback.format_exception(etype=e.__class__, value=e, tb=e.__traceback__))}
+            data = {'error': "{}".format(traceback.format_exception(type(e), e, e.__traceback__))}
 
         return data
 
+    def _task_resources(self, task_id):
+        pid = self._pid(task_id)
+
+        if pid == -1:
+            raise psutil.NoSuchProcess("task: {} was not running".format(task_id))
+
+        task = self._tasks.get(task_id)
+        if task is None:
+            return resources.TaskResources(pid, self._memory_maps_interval)
+        if task.get("resources") is None or task["resources"].process.pid != pid:
+            task["resources"] = resources.TaskResources(pid, self._memory_maps_interval)
+        return task["resources"]
+
+    def _receive_results(self, task_id):
+        """Drain the results pipe of a task, returns True once results are available."""
+        task = self._tasks[task_id]
+        if not task["results_ready"] and \
+                task["results_pipe"] is not None and \
+                task["results_pipe"].poll():
+            # uvloop makes a pipe it watched non-blocking, the frames after the first message are read in full
+            os.set_blocking(task["results_pipe"].fileno(), True)
+            try:
+                received = task["results_pipe"].recv()
+            except EOFError:
+                # the task exited without sending results
+                self._close_results_pipe(task_id)
+                return False
+
+            if isinstance(received, transport.Handle):
+                # large results stay in the handoff file until somebody needs them as objects
+                task["results_handle"] = received
+                if task.get("cache_key") is not None:
+                    header, payloads = transport.load(received.path)
+                    self._result_cache.put(task["cache_key"], payloads["results"])
+                nbytes = received.size
+            else:
+                frames = transport.recv_frames(task["results_pipe"], received[1])
+                if task.get("cache_key") is not None:
+                    # shared with the results rebuilt below, the worker never changes either
+                    self._result_cache.put(task["cache_key"], frames)
+                task["results"] = transport.loads(frames)
+                nbytes = transport.nbytes(frames)
+            task["results_ready"] = True
+            self._retain(task_id, nbytes)
+        return task["results_ready"]
+
+    def has_results(self, task_id):
+        # results of an earlier run do not count while the task waits to run again
+        return task_id not in self._queued and task_id in self._tasks and self._receive_results(task_id)
+
+    def output_size(self, task_id, stream):
+        path = self._tasks.get(task_id, {}).get("output", {}).get(stream)
+        try:
+            return os.path.getsize(path) if path is not None else 0
+        except OSError:
+            return 0
+
+    def read_task_output(self, task_id, stream, offset=0, max_bytes=1048576):
+        """Read up to max_bytes of stream, "stdout" or "stderr", of the last run of the task from offset on.
+
+        Returns the bytes read and whether the task ended, after which its output does not grow any more."""
+        if stream not in ("stdout", "stderr"):
+            raise ValueError("stream must be stdout or stderr, not {}".format(stream))
+        self._pid(task_id)
+
+        # decided before reading, output written before the end is then read in full
+        finished = task_id not in self._queued and \
+            (task_id not in self._tasks or not self._tasks[task_id]["process"].is_alive())
+        path = self._tasks.get(task_id, {}).get("output", {}).get(stream)
+        if path is None:
+            return b"", finished
+        try:
+            with open(path, "rb") as f:
+                f.seek(offset)
+                return f.read(max_bytes), finished
+        except FileNotFoundError:
+            # the task has not written anything yet
+            return b"", finished
+
+    def _remove_output_files(self, task_id):
+        if task_id not in self._tasks or self._tasks[task_id]["process"].is_alive():
+            return
+        for path in self._tasks[task_id].get("output", {}).values():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._tasks[task_id]["output"] = {}
+
     def get_task_results(self, task_id):
-        if "results" in self._tasks[task_id] and self._tasks[task_id]["results"] is not None:
-            return self._tasks[task_id]["results"]
-        elif self._tasks[task_id]["process"].is_alive() and \
-                self._tasks[task_id]["results_pipe"] is not None and \
-                self._tasks[task_id]["results_pipe"].poll():
-            self._tasks[task_id]["results"] = self._tasks[task_id]["results_pipe"].recv()
-            return self._tasks[task_id]["results"]
+        if self._receive_results(task_id):
+            task = self._tasks[task_id]
+            if task["results"] is None and task["results_handle"] is not None:
+                header, payloads = transport.load(task["results_handle"].path)
+                if task.get("spilled"):
+                    # read back on every request, spilled results do not count against the retention budget
+                    return transport.loads(payloads["results"])
+                task["results"] = transport.loads(payloads["results"])
+            if task_id in self._retained:
+                self._retained.move_to_end(task_id)
+            return task["results"]
         else:
             if self._tasks[task_id]["process"].is_alive():
                 msg = "{} is alive, results are not yet available".format(task_id)
+            elif getattr(self._tasks[task_id]["process"], "error", None) is not None:
+                msg = "{} raised an exception and did not return a result\n{}".format(
+                    task_id, self._tasks[task_id]["process"].error)
             elif self._tasks[task_id]["process"].exitcode is not None:
                 msg = "{} exited with code {} and did not return a result".format(
                     task_id, self._tasks[task_id]["process"].exitcode)
@@ -614,101 +1475,219 @@ class KaleTaskManager(object):
                 msg = "{} has not been started yet, results are not yet available".format(task_id)
             raise IOError(msg)
 
+    def get_task_results_handle(self, task_id):
+        """Return the Handle of the task results file for a client on this host, None if the results are small
+        enough to have been sent through the pipe."""
+        if not self._receive_results(task_id):
+            # raises the reason the results are not available
+            self.get_task_results(task_id)
+        return self._tasks[task_id]["results_handle"]
+
+    async def get_task_results_file(self, task_id):
+        """Write the task results to a local file once and return its path, for streaming to clients.
+
+        The results are looked up on the event loop, like everything else that touches the results pipe and
+        the retention state, only pickling and writing them run in an executor."""
+        task = self._tasks[task_id]
+        path = task.get("results_file")
+        if path is None:
+            handle = self.get_task_results_handle(task_id)
+            if handle is not None:
+                # already written by the task
+                return handle.path
+
+            results = self.get_task_results(task_id)
+
+            if self._results_dir is None:
+                self._results_dir = tempfile.mkdtemp(prefix="kale_results_")
+
+            path = await asyncio.get_event_loop().run_in_executor(
+                None, self._write_results_file, self._results_dir, task_id, results)
+            if self._tasks.get(task_id) is not task:
+                # removed while the file was written
+                os.remove(path)
+                raise IOError("task: {} does not exist".format(task_id))
+            task["results_file"] = path
+        return path
+
+    @staticmethod
+    def _write_results_file(directory, task_id, results):
+        # concurrent downloads may race to write the file
+        path = os.path.join(directory, "{}.results".format(task_id))
+        transport.write_file(path, {}, {"results": transport.dumps(results)})
+        return path
+
+    def _remove_results_files(self, task_id):
+        if task_id not in self._tasks:
+            return
+
+        for key in ["results_file", "results_handle"]:
+            path = self._tasks[task_id].get(key)
+            if path is None:
+                continue
+            if isinstance(path, transport.Handle):
+                path = path.path
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self._tasks[task_id][key] = None
+        self._tasks[task_id]["spilled"] = False
+        if task_id in self._retained:
+            self._retained_nbytes -= self._retained.pop(task_id)
+
+    def _retain(self, task_id, nbytes):
+        """Account for results that arrived in memory or shared memory, spilling the oldest above the budget."""
+        self._retained[task_id] = nbytes
+        self._retained_nbytes += nbytes
+        if self._retention_bytes is None:
+            return
+        while self._retained_nbytes > self._retention_bytes:
+            oldest = next(iter(self._retained))
+            if oldest == task_id:
+                # results larger than the budget stay until the next results arrive
+                break
+            self._spill_results(oldest)
+
+    def _spill_results(self, task_id):
+        """Move the results of a task to the spill directory, written in an executor while an event loop runs.
+
+        The results stay where they are until the spill file is complete, they no longer count against the
+        retention budget from the start."""
+        task = self._tasks[task_id]
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.mkdtemp(prefix="kale_spill_", dir=self._spill)
+        # a file of its own, a task that runs again may spill new results while the old ones are written
+        fd, path = tempfile.mkstemp(prefix="{}.".format(task_id), suffix=".results", dir=self._spill_dir)
+        os.close(fd)
+        nbytes = self._retained.pop(task_id)
+        self._retained_nbytes -= nbytes
+
+        if self._loop is None:
+            self._write_spill(task["results"], task["results_handle"], path)
+            self._on_results_spilled(task_id, task, path, nbytes, None)
+            return
+
+        future = self._loop.run_in_executor(None, self._write_spill, task["results"], task["results_handle"], path)
+        task["spilling"] = future
+        future.add_done_callback(lambda f: self._on_results_spilled(task_id, task, path, nbytes, f))
+
+    @staticmethod
+    def _write_spill(results, handle, path):
+        if handle is not None:
+            # a handoff file in shared memory, copied rather than moved so it stays readable meanwhile
+            shutil.copyfile(handle.path, path)
+        else:
+            transport.write_file(path, {}, {"results": transport.dumps(results)})
+
+    def _on_results_spilled(self, task_id, task, path, nbytes, future):
+        if future is not None:
+            if self._tasks is None or self._tasks.get(task_id) is not task or task.get("spilling") is not future:
+                # removed or run again while the results were written
+                if os.path.exists(path):
+                    os.remove(path)
+                return
+            del task["spilling"]
+            if future.exception() is not None:
+                self.logger.error("could not spill results of task {}: {}".format(task_id, future.exception()))
+                if os.path.exists(path):
+                    os.remove(path)
+                # kept where they are, counted again
+                self._retained[task_id] = nbytes
+                self._retained_nbytes += nbytes
+                return
+
+        if task["results_handle"] is not None:
+            os.remove(task["results_handle"].path)
+        self.logger.debug("spilled results of task {} to {}".format(task_id, path))
+        task["results_handle"] = transport.Handle(path, os.path.getsize(path))
+        task["results"] = None
+        task["spilled"] = True
+        self._spills += 1
+
+    def retention_stats(self):
+        return {
+            "results": {
+                "count": len(self._retained),
+                "nbytes": self._retained_nbytes,
+                "max_bytes": self._retention_bytes,
+                "spilled": sum(1 for t in self._tasks.values() if t.get("spilled")),
+                "spills": self._spills
+            },
+            "tasks": self.tasks.stats()
+        }
+
+    def remove_task(self, task_id):
+        """Stop the task if it is running and free everything held for it."""
+        self.logger.debug("remove_task {}".format(task_id))
+        if self._dequeue(task_id):
+            pass
+        elif self._pid(task_id) != -1:
+            self.stop_task(task_id)
+
+        self._remove_results_files(task_id)
+        if task_id in self._tasks:
+            self._close_results_pipe(task_id)
+            self._unwatch_exit(task_id)
+            self._remove_output_files(task_id)
+        if self._sampler is not None:
+            self._sampler.remove(task_id)
+        self._tasks.pop(task_id, None)
+        self.tasks.remove(task_id)
+        return True
+
     def shutdown(self):
+        for t in list(self._queued):
+            self._dequeue(t)
+        self._queue = []
+
         for t in self._tasks:
-            if self._tasks[t]["results_pipe"] is not None:
-                self._tasks[t]["results_pipe"].close()
+            self._close_results_pipe(t)
             if self._tasks[t]["process"].is_alive():
                 self._tasks[t]["process"].terminate()
                 self._tasks[t]["process"].join()
 
-        self._tasks = None
-        self.tasks = None
+        for r in self._runners:
+            r.stop()
+        self._runners = []
 
+        for directory in [self._results_dir, self._handoff_dir, self._spill_dir]:
+            if directory is not None:
+                shutil.rmtree(directory, ignore_errors=True)
+        self._results_dir = None
+        self._handoff_dir = None
+        self._spill_dir = None
+        self.tasks.clear_spill()
 
-class KaleTask(multiprocessing.Process):
-    def __init__(self, group=None, target=None, name=None, args=(), kwargs={}, results_pipe=None):
-        assert results_pipe is not None, "Can not return results without a connection!"
-        assert target is not None, "Can not execute, missing target value!"
-        super(KaleTask, self).__init__(group, target, name, args=args, kwargs=kwargs)
-        self.results = results_pipe
-        self.exit = mp.Event()
-        self.completed = mp.Event()
-        self.logger = None
-
-    def run(self):
-        # make sure default signal handlers exist for suspend and resume
-        #sigstop = signal.signal(signal.SIGSTOP, signal.SIG_DFL)
-        #sigcont = signal.signal(signal.SIGCONT, signal.SIG_DFL)
-
-        if self.logger is None:
-            self.logger = logging.getLogger("KaleTask {}".format(self.pid))
-            self.logger.setLevel(logging.DEBUG)
-            #self.logger.addHandler(logging.handlers.RotatingFileHandler("/tmp/scratch/KaleTask_{}".format(self.pid)))
-        while not self.exit.is_set():
-            if self._target and not self.completed.is_set():
-                self.logger.debug("KaleTask.run()\ntarget: {}\nargs: {}\nkwargs: {}\n".format(
-                    self._target, self._args, self._kwargs))
-                _stdout = sys.stdout
-                _stderr = sys.stderr
-                sys.stdout = open(str(self.pid) + ".out", "a")
-                sys.stderr = open(str(self.pid) + ".err", "a")
-
-                if len(self._kwargs) > 0:
-                    out = self._target(*self._args, **self._kwargs)
-                else:
-                    out = self._target(*self._args)
-
-                self.logger.debug("KaleTask.run()\nresult : {}\n".format(out))
-                sys.stdout.close()
-                sys.stderr.close()
-                sys.stdout = _stdout
-                sys.stderr = _stderr
-
-                self.results.send(out)
-                self.completed.set()
-                self.results.close()
-            time.sleep(1)
-
-    def suspend(self):
-        target = psutil.Process(self.pid)
-        target.suspend()
-
-    def resume(self):
-        target = psutil.Process(self.pid)
-        target.resume()
-
-    def terminate(self):
-        self.results.close()
-        self.exit.set()
-
-        if self.is_alive():
-            target = psutil.Process(self.pid)
-            # terminate any children of the target process
-            kill_process_tree(self.pid)
-
-            # terminate the target process
-            super().terminate()
-            if target.is_running() is None:
-                target.kill()
-
-    def join(self, timeout=None):
-        self.results.close()
-        self.exit.set()
-        super().join(timeout)
-
-
-class KaleFunctionWrapper(object):
-    def __init__(self, func=None):
-        assert func is not None
-        setattr(self, func.__name__, func)
+        self._tasks = None
+        self.tasks = None
 
 
 class KaleWorkerClient(object):
-    def __init__(self, host, port, timeout=30):
+    def __init__(self, host, port, timeout=30, binary=True, handoff=None, handoff_threshold=1048576,
+                 compression="zlib", compression_level=6, compression_threshold=4096,
+                 pool_connections=1, pool_maxsize=10):
+        self.host = host
+        self.port = port
         self.url = "http://{}:{}".format(host, port)
         self.logger = logging.getLogger("KaleWorkerClient {}".format(self.url))
         self._timeout = timeout
+        # keep-alive connections reused by every call, pool_maxsize bounds concurrent calls from threads
+        self._session = sessions.make_session(pool_connections, pool_maxsize)
+        # send and receive pickled payloads as raw frames instead of JSON lists of integers,
+        # falls back to JSON if the worker does not understand frames
+        self._binary = binary
+        # exchange large payloads through shared memory files with a worker on this host
+        if handoff is None:
+            handoff = is_local_address(host)
+        self._handoff = handoff
+        self._handoff_threshold = handoff_threshold
+        # compression of payloads sent to the worker, used only if the worker supports it
+        self._compression = compression
+        self._compression_level = compression_level
+        self._compression_threshold = compression_threshold
+        self._worker_compression = []
+        self.transfer_metrics = collections.deque(maxlen=1000)
 
         # sanity check
         self.is_alive()
@@ -718,7 +1697,8 @@ class KaleWorkerClient(object):
 
         while retries > 0:
             try:
-                self.get_service_status()
+                response = self._session.get("{}/".format(self.url), timeout=self._timeout)
+                self._worker_compression = response.json().get("compression", [])
                 self.logger.debug("worker {} is alive".format(self.url))
                 break
             except requests.ConnectionError:
@@ -729,116 +1709,452 @@ class KaleWorkerClient(object):
             self.logger.debug("Unable to connect to worker {}".format(self.url))
             raise ConnectionError("Unable to connect to worker {}".format(self.url))
 
-    def register_function_task(self, f, args=(), kwargs=None, task_name=""):
-        wrapper = KaleFunctionWrapper(f)
-        target = list(pickle.dumps(wrapper, protocol=pickle.HIGHEST_PROTOCOL))
-        target_args = list(pickle.dumps(args, protocol=pickle.HIGHEST_PROTOCOL))
-        if kwargs is not None:
-            target_kwargs = list(pickle.dumps(kwargs, protocol=pickle.HIGHEST_PROTOCOL))
+    def _post_frames(self, route, header, payloads):
+        """POST payloads as frames, large payloads travel in handoff files when the worker is on this host."""
+        sent, handoff = payloads, {}
+        if self._handoff:
+            sent, handoff = transport.write_handoffs(payloads, self._handoff_threshold)
+        header = dict(header, handoff=handoff)
+
+        compression = None
+        if self._compression in self._worker_compression:
+            compression = self._compression
+        body, metrics = transport.encode(header, sent, compression,
+                                         self._compression_level, self._compression_threshold)
+        self.transfer_metrics.append(dict(metrics, path=route, direction="sent", time=time.time()))
+
+        try:
+            response = self._session.post("{}/{}".format(self.url, route),
+                                     timeout=self._timeout,
+                                     headers={"Content-Type": transport.FRAMES_CONTENT_TYPE},
+                                     data=body)
+        finally:
+            # the worker removes the files it consumed, anything left was not used
+            for entry in handoff.values():
+                if os.path.exists(entry["path"]):
+                    os.remove(entry["path"])
+
+        if response.status_code == 422 and len(handoff) > 0:
+            # the worker only looked local, e.g. it runs in a different container
+            self.logger.debug("worker {} can not read handoff files, disabling handoff".format(self.url))
+            self._handoff = False
+            header.pop("handoff")
+            return self._post_frames(route, header, payloads)
+
+        return response
+
+    def _get_frames(self, route, name):
+        """GET the payload called name from a route that answers with frames, a handoff file or legacy JSON."""
+        headers = {}
+        params = {}
+        if self._binary:
+            headers["Accept"] = transport.FRAMES_CONTENT_TYPE
+            headers["X-Kale-Accept-Compression"] = ", ".join(sorted(transport.COMPRESSORS))
+        if self._handoff:
+            params["handoff"] = 1
+        response = self._session.get("{}/{}".format(self.url, route),
+                                timeout=self._timeout,
+                                headers=headers,
+                                params=params,
+                                stream=True)
+        if response.ok:
+            if response.headers.get("Content-Type", "").startswith(transport.FRAMES_CONTENT_TYPE):
+                header, payloads, metrics = transport.decode(read_body(response))
+                self.transfer_metrics.append(dict(metrics, path=route, direction="received", time=time.time()))
+                return transport.loads(payloads[name])
+
+            raw_output = response.json()
+            if "handle" in raw_output:
+                handle = transport.Handle(**raw_output["handle"])
+                if not os.path.exists(handle.path) or os.path.getsize(handle.path) != handle.size:
+                    # the worker only looked local, e.g. it runs in a different container
+                    self.logger.debug("handoff file {} is not reachable, disabling handoff".format(handle.path))
+                    self._handoff = False
+                    return self._get_frames(route, name)
+                header, payloads = transport.load(handle.path)
+                return transport.loads(payloads[name])
+
+            try:
+                output = pickle.loads(bytes(raw_output[name]))
+            except KeyError:
+                raise Exception(response.json())
+            return output
         else:
-            target_kwargs = list(pickle.dumps({}, protocol=pickle.HIGHEST_PROTOCOL))
-        response = requests.post("{}/task".format(self.url),
+            raise response.raise_for_status()
+
+    def _register_task(self, target, call, args, kwargs, task_name):
+        if kwargs is None:
+            kwargs = {}
+
+        if self._binary:
+            response = self._post_frames("task", {"call": call, "task_name": task_name}, {
+                "target": transport.dumps(target),
+                "args": transport.dumps(args),
+                "kwargs": transport.dumps(kwargs)
+            })
+            if response.status_code != 400:
+                response.raise_for_status()
+                return response.json()["id"]
+
+            # older workers can only parse JSON bodies
+            self.logger.debug("worker {} rejected binary payload, falling back to JSON".format(self.url))
+            self._binary = False
+
+        response = self._session.post("{}/task".format(self.url),
                                  timeout=self._timeout,
                                  data=json.dumps({
-                                     "target": target,
-                                     "call": f.__name__,
-                                     "args": target_args,
-                                     "kwargs": target_kwargs,
+                                     "target": list(pickle.dumps(target, protocol=pickle.HIGHEST_PROTOCOL)),
+                                     "call": call,
+                                     "args": list(pickle.dumps(args, protocol=pickle.HIGHEST_PROTOCOL)),
+                                     "kwargs": list(pickle.dumps(kwargs, protocol=pickle.HIGHEST_PROTOCOL)),
                                      "task_name": task_name
                                      })
                                  )
         return response.json()["id"]
 
+    def register_function_task(self, f, args=(), kwargs=None, task_name=""):
+        wrapper = KaleFunctionWrapper(f)
+        return self._register_task(wrapper, f.__name__, args, kwargs, task_name)
+
     def register_method_task(self, obj, method, args=(), kwargs=None):
         self.logger.debug("register_method_task")
         assert callable(getattr(obj, method))
-        target = list(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
-        target_args = list(pickle.dumps(args, protocol=pickle.HIGHEST_PROTOCOL))
-        if kwargs is not None:
-            target_kwargs = list(pickle.dumps(kwargs, protocol=pickle.HIGHEST_PROTOCOL))
+        return self._register_task(obj, method, args, kwargs, "")
+
+    def register_tasks(self, tasks, start=False):
+        """Register many tasks in one request and return their ids in order.
+
+        Each task is a tuple of (f, args), (f, args, kwargs) or (f, args, kwargs, task_name), where f is a function
+        or a bound method.  A target shared by several tasks is sent once.  With start=True the worker also
+        starts every task, a RuntimeError lists any that failed to start."""
+        header = {"tasks": [], "start": start}
+        payloads = {}
+        targets = {}
+        for i, task in enumerate(tasks):
+            f, args = task[0], task[1]
+            kwargs = task[2] if len(task) > 2 and task[2] is not None else {}
+            task_name = task[3] if len(task) > 3 else ""
+
+            if id(f) not in targets:
+                targets[id(f)] = "target.{}".format(len(targets))
+                if inspect.ismethod(f):
+                    payloads[targets[id(f)]] = transport.dumps(f.__self__)
+                else:
+                    payloads[targets[id(f)]] = transport.dumps(KaleFunctionWrapper(f))
+            payloads["args.{}".format(i)] = transport.dumps(args)
+            payloads["kwargs.{}".format(i)] = transport.dumps(kwargs)
+
+            header["tasks"].append({
+                "target": targets[id(f)],
+                "call": f.__name__,
+                "args": "args.{}".format(i),
+                "kwargs": "kwargs.{}".format(i),
+                "task_name": task_name
+            })
+
+        response = self._post_frames("task/batch", header, payloads)
+        response.raise_for_status()
+        data = response.json()
+
+        if start:
+            failed = {k: v["error"] for k, v in data["started"].items() if "error" in v}
+            if len(failed) > 0:
+                raise RuntimeError("Tasks failed to start: {}".format(failed))
+        return data["ids"]
+
+    def start_tasks(self, task_ids, priority=0):
+        """Start many tasks in one request, returns a dict of task id to {"pid": pid} or {"error": reason}.
+
+        Tasks the worker queued until a slot is free are reported as {"pid": -1, "status": "queued"}."""
+        self.logger.debug("start_tasks")
+        response = self._session.post("{}/task/batch/start".format(self.url),
+                                      timeout=self._timeout,
+                                      json={"ids": list(task_ids), "priority": priority})
+        if response.ok:
+            return response.json()["started"]
         else:
-            target_kwargs = list(pickle.dumps({}, protocol=pickle.HIGHEST_PROTOCOL))
-        response = requests.post("{}/task".format(self.url),
-                                 timeout=self._timeout,
-                                 data=json.dumps({
-                                     "target": target,
-                                     "call": method,
-                                     "args": target_args,
-                                     "kwargs": target_kwargs,
-                                     "task_name": ""
-                                     })
-                                 )
-        return response.json()["id"]
+            raise requests.HTTPError(response.text)
 
     def get_task_output(self, task_id):
-        response = requests.get("{}/task/{}/results".format(self.url, task_id), timeout=self._timeout)
+        return self._get_frames("task/{}/results".format(task_id), "results")
+
+    def put_object(self, obj):
+        """Store obj on the worker once and return a KaleObjectRef to pass as a task argument in its place."""
+        response = self._post_frames("object", {}, {"object": transport.dumps(obj)})
+        response.raise_for_status()
+        return objects.KaleObjectRef(response.json()["id"])
+
+    def get_object(self, ref):
+        return self._get_frames("object/{}".format(ref.object_id), "object")
+
+    def remove_object(self, ref):
+        response = self._session.delete("{}/object/{}".format(self.url, ref.object_id), timeout=self._timeout)
         if response.ok:
-            raw_output = response.json()
-            try:
-                output = pickle.loads(bytes(raw_output["results"]))
-            except KeyError:
-                raise Exception(response.json())
-            return output
+            return response.json()
         else:
-            raise response.raise_for_status()
+            response.raise_for_status()
+
+    def list_objects(self):
+        response = self._session.get("{}/object".format(self.url), timeout=self._timeout)
+        if response.ok:
+            return response.json()
+        else:
+            response.raise_for_status()
+
+    def _get_results_stream(self, task_id, offset=0):
+        headers = {}
+        if offset > 0:
+            headers["Range"] = "bytes={}-".format(offset)
+        return self._session.get("{}/task/{}/results/stream".format(self.url, task_id),
+                            timeout=self._timeout,
+                            headers=headers,
+                            stream=True)
+
+    def iter_task_output(self, task_id, offset=0, chunk_size=1048576):
+        """Yield the serialized task results in chunks, starting at byte offset.
+
+        The chunks form a kale.services.transport message, see download_task_output to write them to a file."""
+        response = self._get_results_stream(task_id, offset)
+        try:
+            if not response.ok:
+                response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                yield chunk
+        finally:
+            response.close()
+
+    def download_task_output(self, task_id, path, retries=5, chunk_size=1048576):
+        """Stream the task results into the file at path without holding them in memory.
+
+        A partially downloaded file is resumed from its current size, also after dropped connections.
+        Returns the path, use kale.services.transport.load and loads to rebuild the results."""
+        offset = os.path.getsize(path) if os.path.exists(path) else 0
+        size = None
 
-    def start_task(self, task_id):
+        with open(path, "r+b" if offset > 0 else "wb") as f:
+            while size is None or offset < size:
+                response = None
+                try:
+                    response = self._get_results_stream(task_id, offset)
+                    if response.status_code == 416:
+                        # the local file is already complete, or is larger than these results
+                        size = int(response.headers["Content-Range"].split("/")[-1])
+                        if offset != size:
+                            offset = 0
+                        continue
+                    elif not response.ok:
+                        response.raise_for_status()
+
+                    size = int(response.headers["X-Kale-Results-Size"])
+                    f.seek(offset)
+                    f.truncate()
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        f.write(chunk)
+                        offset += len(chunk)
+                except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+                    retries -= 1
+                    if retries < 0:
+                        raise
+                    self.logger.debug("results download of {} interrupted at {} bytes, resuming: {}".format(
+                        task_id, offset, e))
+                    time.sleep(0.5)
+                finally:
+                    if response is not None:
+                        response.close()
+
+            f.truncate(size)
+
+        return path
+
+    def remove_task(self, task_id):
+        response = self._session.delete("{}/task/{}".format(self.url, task_id), timeout=self._timeout)
+        if response.ok:
+            return response.json()
+        else:
+            response.raise_for_status()
+
+    def start_task(self, task_id, priority=0):
+        """Start a task, queued tasks with a higher priority start first once the worker has a free slot."""
         self.logger.debug("start_task")
-        response = requests.post("{}/task/{}/start".format(self.url, task_id), timeout=self._timeout)
+        response = self._session.post("{}/task/{}/start".format(self.url, task_id), timeout=self._timeout,
+                                      params={"priority": priority})
         if response.ok:
             return response.json()
         else:
             raise requests.HTTPError(response.text)
 
     def suspend_task(self, task_id):
-        response = requests.post("{}/task/{}/suspend".format(self.url, task_id), timeout=self._timeout)
+        response = self._session.post("{}/task/{}/suspend".format(self.url, task_id), timeout=self._timeout)
         if response.ok:
             return response.json()
         else:
             raise requests.HTTPError(response.text)
 
     def resume_task(self, task_id):
-        response = requests.post("{}/task/{}/resume".format(self.url, task_id), timeout=self._timeout)
+        response = self._session.post("{}/task/{}/resume".format(self.url, task_id), timeout=self._timeout)
         if response.ok:
             return response.json()
         else:
             raise requests.HTTPError(response.text)
 
     def stop_task(self, task_id):
-        response = requests.post("{}/task/{}/stop".format(self.url, task_id), timeout=self._timeout)
+        response = self._session.post("{}/task/{}/stop".format(self.url, task_id), timeout=self._timeout)
         if response.ok:
             return response.json()
         else:
             response.raise_for_status()
 
     def get_tasks(self):
-        response = requests.get("{}/task".format(self.url), timeout=self._timeout)
+        response = self._session.get("{}/task".format(self.url), timeout=self._timeout)
         if response.ok:
             return response.json()["tasks"]
         else:
             response.raise_for_status()
 
     def get_task_status(self, task_id):
-        response = requests.get("{}/task/{}/status".format(self.url, task_id), timeout=self._timeout)
+        response = self._session.get("{}/task/{}/status".format(self.url, task_id), timeout=self._timeout)
         if response.ok:
             return response.json()["status"]
         else:
             response.raise_for_status()
 
-    def get_task_resources(self, task_id):
-        response = requests.get("{}/task/{}/resources".format(self.url, task_id), timeout=self._timeout)
+    def wait_task(self, task_id, timeout=None, poll_timeout=30):
+        """Block until the worker reports the task finished, or timeout seconds pass if timeout is not None.
+
+        The worker holds each request open for up to poll_timeout seconds and answers the moment the task
+        finishes.  Returns the final status, results_available and finished values."""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            wait = poll_timeout if deadline is None else max(0.0, min(poll_timeout, deadline - time.time()))
+            response = self._session.get("{}/task/{}/wait".format(self.url, task_id),
+                                         timeout=self._timeout + wait,
+                                         params={"timeout": wait})
+            if not response.ok:
+                raise requests.HTTPError(response.text)
+
+            info = response.json()
+            if info["finished"] or (deadline is not None and time.time() >= deadline):
+                return info
+
+    def read_task_output(self, task_id, stream="stdout", offset=0, follow=False, timeout=30, max_bytes=1048576):
+        """Read stdout or stderr of a task from a byte offset on.
+
+        With follow, the worker holds the request open for up to timeout seconds until new output arrives.
+        Returns the bytes read, the offset to read from next and whether the task ended with all output read."""
+        response = self._session.get("{}/task/{}/{}".format(self.url, task_id, stream),
+                                     timeout=self._timeout + (timeout if follow else 0),
+                                     params={"offset": offset, "follow": int(follow), "timeout": timeout,
+                                             "max_bytes": max_bytes})
+        if not response.ok:
+            raise requests.HTTPError(response.text)
+        return response.content, int(response.headers["X-Kale-Offset"]), response.headers["X-Kale-Finished"] == "1"
+
+    def tail_task_output(self, task_id, stream="stdout", offset=0, poll_timeout=30):
+        """Yield the output of a task as text while it runs, until the task ended and all output was read."""
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        while True:
+            data, offset, finished = self.read_task_output(task_id, stream, offset, follow=True,
+                                                           timeout=poll_timeout)
+            text = decoder.decode(data, final=finished)
+            if text:
+                yield text
+            if finished:
+                return
+
+    def query_tasks(self, task_ids, resources=False, fields=None):
+        """Status and results availability of many tasks in one round trip, optionally with their resources.
+
+        fields limits the resources as in get_task_resources.  Returns a dict keyed by task id as a string."""
+        response = self._session.post("{}/tasks/query".format(self.url),
+                                      timeout=self._timeout,
+                                      json={"ids": list(task_ids), "resources": resources, "fields": fields})
+        if response.ok:
+            return response.json()["tasks"]
+        else:
+            response.raise_for_status()
+
+    def get_task_resources(self, task_id, fields=None):
+        """Resource usage of a task and its host, fields such as ["host.cpu_percent", "task.threads"] limit what
+        the worker collects and returns."""
+        params = {"fields": ",".join(fields)} if fields is not None else None
+        response = self._session.get("{}/task/{}/resources".format(self.url, task_id), timeout=self._timeout,
+                                     params=params)
+        if response.ok:
+            return response.json()
+        else:
+            response.raise_for_status()
+
+    def get_task_process_resources(self, task_id, fields=None):
+        """Resource usage of the task process alone, without the host section of get_task_resources."""
+        params = {"fields": ",".join(fields)} if fields is not None else None
+        response = self._session.get("{}/task/{}/resources/process".format(self.url, task_id),
+                                     timeout=self._timeout, params=params)
+        if response.ok:
+            return response.json()
+        else:
+            response.raise_for_status()
+
+    def get_host_resources(self, fields=None):
+        """Resource usage of the host of the worker, the host section of get_task_resources."""
+        params = {"fields": ",".join(fields)} if fields is not None else None
+        response = self._session.get("{}/host/resources".format(self.url), timeout=self._timeout, params=params)
+        if response.ok:
+            return response.json()
+        else:
+            response.raise_for_status()
+
+    def get_task_resources_history(self, task_id, since=0):
+        """Resource samples of a task numbered since and later, pass the returned next as since to get only new
+        ones.  Samples are returned column by column."""
+        response = self._session.get("{}/task/{}/resources/history".format(self.url, task_id),
+                                     timeout=self._timeout, params={"since": since})
+        if response.ok:
+            return response.json()
+        else:
+            response.raise_for_status()
+
+    def get_host_resources_history(self, since=0):
+        response = self._session.get("{}/host/resources/history".format(self.url), timeout=self._timeout,
+                                     params={"since": since})
         if response.ok:
             return response.json()
         else:
             response.raise_for_status()
 
     def get_service_status(self):
-        response = requests.get("{}/".format(self.url), timeout=self._timeout)
+        response = self._session.get("{}/".format(self.url), timeout=self._timeout)
         return response.json()["status"]
 
+    def get_retention_metrics(self):
+        """Bytes of results and pickled tasks the worker holds in memory and how many it spilled to disk."""
+        response = self._session.get("{}/metrics/retention".format(self.url), timeout=self._timeout)
+        if response.ok:
+            return response.json()
+        else:
+            response.raise_for_status()
+
+    def get_cache_metrics(self):
+        """Hit, miss and eviction counters and sizes of the result cache of the worker."""
+        response = self._session.get("{}/metrics/cache".format(self.url), timeout=self._timeout)
+        if response.ok:
+            return response.json()
+        else:
+            response.raise_for_status()
+
+    def get_transfer_metrics(self):
+        """Size, compression ratio and time of recent payload transfers as seen by the worker."""
+        response = self._session.get("{}/metrics/transport".format(self.url), timeout=self._timeout)
+        if response.ok:
+            return response.json()
+        else:
+            response.raise_for_status()
+
     def shutdown(self):
-        response = requests.post("{}/shutdown".format(self.url), timeout=self._timeout)
+        response = self._session.post("{}/shutdown".format(self.url), timeout=self._timeout)
         if response.ok:
             return response.json()
         else:
             response.raise_for_status()
+
+    def close(self):
+        self._session.close()
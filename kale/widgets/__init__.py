@@ -1 +1,6 @@
-from .resources import KaleWorkerResourcesBoard
\ No newline at end of file
+def __getattr__(name):
+    # plotly and ipywidgets load on first use of the board, not on import of kale.widgets
+    if name == "KaleWorkerResourcesBoard":
+        from .resources import KaleWorkerResourcesBoard
+        return KaleWorkerResourcesBoard
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
@@ -10,6 +10,15 @@ import plotly.graph_objs
 
 
 class KaleWorkerResourcesBoard(ipw.VBox):
+    # resources fields shown on each tab, only these are requested for the selected tab
+    TAB_FIELDS = [
+        ["host.fqdn", "host.cpu_percent", "task.cpu_num", "task.cpu_percent", "task.cpu_times", "task.threads"],
+        ["host.fqdn", "host.percent_available_memory_remaining", "host.percent_swap_memory_remaining",
+         "task.memory_full_info"],
+        ["host.fqdn", "host.disk_io_counters", "task.open_files"],
+        ["host.fqdn", "host.net_io_counters", "task.connections"]
+    ]
+
     def __init__(self, height=-1, width=-1):
         super().__init__()
 
@@ -127,6 +136,16 @@ class KaleWorkerResourcesBoard(ipw.VBox):
 
         self.children = [self._task_plots]
 
+    def fields(self, all_tabs=False):
+        """Resources fields shown on the selected tab, or on every tab."""
+        if all_tabs:
+            return sorted(set(f for tab in self.TAB_FIELDS for f in tab))
+        return self.TAB_FIELDS[self._task_tabs.selected_index or 0]
+
+    def refresh(self, client, task_id):
+        """Fetch the fields of the selected tab for task_id from a KaleWorkerClient and show them."""
+        self.update(client.get_task_resources(task_id, fields=self.fields()))
+
     def update(self, data=None):
         try:
             if data is None:
@@ -135,13 +154,17 @@ class KaleWorkerResourcesBoard(ipw.VBox):
             if 'error' in data:
                 print(data['error'])
 
+            # data may hold only the fields of one tab, see fields()
             if 'host' in data:
-                self._host_label.value = 'Host: {}'.format(data['host']['fqdn'])
+                if 'fqdn' in data['host']:
+                    self._host_label.value = 'Host: {}'.format(data['host']['fqdn'])
 
+            if 'cpu_percent' in data.get('host', {}):
                 with self._task_cpu.batch_update():
                     self._task_cpu.data[0].x = np.arange(len(data['host']['cpu_percent']))
                     self._task_cpu.data[0].y = np.array(data['host']['cpu_percent'])
 
+            if 'percent_available_memory_remaining' in data.get('host', {}):
                 with self._task_mem.batch_update():
                     self._task_mem.data[0].x = np.array(['Resident Set Size (RSS)', 'Swap'])
                     self._task_mem.data[0].y = np.array([
@@ -149,6 +172,7 @@ class KaleWorkerResourcesBoard(ipw.VBox):
                         100.0 - data['host']['percent_swap_memory_remaining']
                     ])
 
+            if 'disk_io_counters' in data.get('host', {}):
                 with self._task_disk_activity.batch_update():
                     y = [k for k in data['host']['disk_io_counters']]
                     x = [k for k in data['host']['disk_io_counters'][y[0]]]
@@ -158,6 +182,7 @@ class KaleWorkerResourcesBoard(ipw.VBox):
                     self._task_disk_activity.data[0].y = y
                     self._task_disk_activity.data[0].z = z
 
+            if 'net_io_counters' in data.get('host', {}):
                 with self._task_network_activity.batch_update():
                     y = [k for k in data['host']['net_io_counters']]
                     x = [k for k in data['host']['net_io_counters'][y[0]]]
@@ -179,9 +204,8 @@ class KaleWorkerResourcesBoard(ipw.VBox):
                 # network nic stats
                 #data['host']['net_if_stats']
 
-            if 'task' in data:
-                #print(data['task'])
-
+            task = data.get('task', {})
+            if 'connections' in task:
                 network = {
                     "connections": []
                 }
@@ -237,6 +261,7 @@ class KaleWorkerResourcesBoard(ipw.VBox):
                         data['task']['connections'][i]['status']
                     ])
 
+            if 'cpu_times' in task:
                 times = None
                 if isinstance(data['task']['cpu_times'], list):
                     times = {}
@@ -250,6 +275,11 @@ class KaleWorkerResourcesBoard(ipw.VBox):
                     raise Exception("Unexpected format for cpu_times! " +
                         "Expected dict or list of dicts, instead found {}".format(data['task']['cpu_times']))
 
+                with self._task_cpu.batch_update():
+                    self._task_cpu.data[2].x = np.array([k for k in times.keys()])
+                    self._task_cpu.data[2].y = np.array([v for v in times.values()])
+
+            if 'cpu_percent' in task:
                 with self._task_cpu.batch_update():
                     if isinstance(data['task']['cpu_num'], list):
                         self._task_cpu.data[1].x = np.array([data['task']['cpu_num']])
@@ -259,19 +289,20 @@ class KaleWorkerResourcesBoard(ipw.VBox):
                     #print("CPU usage {}".format(data['task']['cpu_percent']))
                     self._task_cpu.data[1].y = np.array(data['task']['cpu_percent'])
 
-                    self._task_cpu.data[2].x = np.array([k for k in times.keys()])
-                    self._task_cpu.data[2].y = np.array([v for v in times.values()])
-
+            if 'threads' in task:
+                with self._task_cpu.batch_update():
                     self._task_cpu.data[3].x = [x['id'] for x in data['task']['threads']]
                     self._task_cpu.data[3].y = [x['user_time'] for x in data['task']['threads']]
                     self._task_cpu.data[4].x = [x['id'] for x in data['task']['threads']]
                     #print([x['system_time'] for x in data['task']['threads']])
                     self._task_cpu.data[4].y = [x['system_time'] for x in data['task']['threads']]
 
+            if 'memory_full_info' in task:
                 with self._task_mem.batch_update():
                     self._task_mem.data[1].x = np.array([k for k in data['task']['memory_full_info']])
                     self._task_mem.data[1].y = np.array([v for v in data['task']['memory_full_info'].values()])
 
+            if 'open_files' in task:
                 with self._task_disk_open_files.batch_update():
                     # need to transpose the nested list to align the values with columns
                     self._task_disk_open_files.data[0].cells = {
@@ -288,6 +319,7 @@ class KaleWorkerResourcesBoard(ipw.VBox):
                                           for i in range(len(data['task']['open_files']))])
                     self._task_disk_open_files.data[0].columnwidth = [path_col_width, 50, 50, 40, 40]
 
+            if 'connections' in task:
                 with self._task_network_connections.batch_update():
                     # need to transpose the nested list to align the values with columns
                     self._task_network_connections.data[0].cells = {
@@ -3,14 +3,13 @@ import random
 import abc
 
 # 3rd party
-import bqplot
-import ipywidgets
-import networkx
+# networkx, bqplot and ipywidgets are imported where they are used, processes that only unpickle tasks never load them
 
 
 class Workflow(object):
     """A Workflow is a directed graph containing at least one WorkflowNode and zero or more edges."""
     def __init__(self):
+        import networkx
         self._graph = networkx.DiGraph()
 
     def add_node(self, node):
@@ -33,6 +32,10 @@ class Workflow(object):
         return self._graph.edges()
 
     def display(self):
+        import bqplot
+        import ipywidgets
+        import networkx
+
         pos = networkx.nx_pydot.graphviz_layout(self._graph, prog='dot')
         x, y = zip(*(pos[node] for node in self._graph.nodes()))
 
@@ -199,6 +202,10 @@ class FireworksWorkflow(Workflow):
                         self._graph.add_edge(fw.fw_id, link)
 
     def display(self):
+        import bqplot
+        import ipywidgets
+        import networkx
+
         pos = networkx.nx_pydot.graphviz_layout(self._graph, prog='dot')
         x, y = zip(*(pos[node] for node in self._graph.nodes()))
 
@@ -0,0 +1,186 @@
+"""KaleTaskManager on the event loop of a worker."""
+
+# stdlib
+import asyncio
+import pickle
+import socket
+import time
+
+# 3rd party
+import pytest
+
+# local
+from kale.services import resources
+from kale.services import transport
+from kale.services import worker
+
+# how long one collection of task resources blocks, as cpu_percent(interval=0.1) used to
+COLLECT_SECONDS = 0.1
+
+# results larger than a pipe buffer, the task writes them while the worker reads
+RESULT_BYTES = 4 * 1048576
+
+
+def _blob(name, value):
+    return transport.pack({}, {name: transport.dumps(value)})
+
+
+def _p99(latencies):
+    return sorted(latencies)[int(len(latencies) * 0.99)]
+
+
+async def _status_latencies(manager, task_id, seconds):
+    """Latencies of status lookups, each one waits for its turn on the event loop like a request would."""
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        await asyncio.sleep(0)
+        manager.get_task_status(task_id)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+async def _poll_resources(manager, task_id, stop, counts):
+    while not stop.is_set():
+        data = await manager.collect_task_resources(task_id)
+        assert "error" not in data, data["error"]
+        counts.append(1)
+
+
+async def _measure(seconds=2.0):
+    manager = worker.KaleTaskManager("test", sampler=None)
+    manager.set_event_loop(asyncio.get_event_loop())
+    task_id = manager.register_task(_blob("target", worker.KaleFunctionWrapper(time.sleep)), "sleep",
+                                    _blob("args", (60,)), _blob("kwargs", {}), "")
+    manager.start_task(task_id)
+    try:
+        idle = await _status_latencies(manager, task_id, seconds)
+
+        stop = asyncio.Event()
+        counts = []
+        pollers = [asyncio.ensure_future(_poll_resources(manager, task_id, stop, counts)) for _ in range(4)]
+        try:
+            polled = await _status_latencies(manager, task_id, seconds)
+        finally:
+            stop.set()
+            await asyncio.gather(*pollers)
+        return idle, polled, len(counts)
+    finally:
+        manager.stop_task(task_id)
+        manager.remove_task(task_id)
+        manager.shutdown()
+
+
+def test_status_latency_under_resource_polling(monkeypatch, tmp_path):
+    """Status requests keep their latency while the resources of a task are polled continuously."""
+    # task output files go to the working directory
+    monkeypatch.chdir(tmp_path)
+    collect = resources.TaskResources.collect
+
+    def slow_collect(self, fields=None):
+        time.sleep(COLLECT_SECONDS)
+        return collect(self, fields)
+
+    monkeypatch.setattr(resources.TaskResources, "collect", slow_collect)
+
+    loop = asyncio.new_event_loop()
+    try:
+        idle, polled, polls = loop.run_until_complete(_measure())
+    finally:
+        loop.close()
+
+    assert polls > 0
+    # collecting on the event loop would hold status lookups for a whole collection
+    assert _p99(polled) < _p99(idle) + COLLECT_SECONDS / 2, \
+        "p99 status latency {:.1f} ms while polling resources, {:.1f} ms idle".format(
+            _p99(polled) * 1000, _p99(idle) * 1000)
+
+
+async def _wait_failing_tasks(count):
+    manager = worker.KaleTaskManager("test", sampler=None)
+    manager.set_event_loop(asyncio.get_event_loop())
+    reported = []
+    try:
+        for _ in range(count):
+            task_id = manager.register_task(_blob("target", worker.KaleFunctionWrapper(int)), "int",
+                                            _blob("args", ("not a number",)), _blob("kwargs", {}), "")
+            manager.start_task(task_id)
+            finished = await manager.wait_task(task_id, 30)
+            reported.append((finished, manager.get_task_status(task_id)))
+        return reported
+    finally:
+        manager.shutdown()
+
+
+def test_failing_task_finished_once_exited(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+
+    loop = asyncio.new_event_loop()
+    try:
+        reported = loop.run_until_complete(_wait_failing_tasks(10))
+    finally:
+        loop.close()
+
+    # the results pipe closes before the exit code is known, a waiter must not wake up in between
+    assert all(finished and status != "running" for finished, status in reported), reported
+
+
+async def _run_large_result():
+    # results go through the pipe, not a handoff file
+    manager = worker.KaleTaskManager("test", handoff_threshold=None, sampler=None)
+    manager.set_event_loop(asyncio.get_event_loop())
+    task_id = manager.register_task(_blob("target", worker.KaleFunctionWrapper(bytearray)), "bytearray",
+                                    _blob("args", (RESULT_BYTES,)), _blob("kwargs", {}), "")
+    manager.start_task(task_id)
+    try:
+        finished = await manager.wait_task(task_id, 30)
+        return finished, manager.get_task_status(task_id), manager.get_task_results(task_id)
+    finally:
+        manager.remove_task(task_id)
+        manager.shutdown()
+
+
+def test_large_results_under_uvloop(monkeypatch, tmp_path):
+    uvloop = pytest.importorskip("uvloop")
+    monkeypatch.chdir(tmp_path)
+
+    loop = uvloop.new_event_loop()
+    try:
+        finished, status, results = loop.run_until_complete(_run_large_result())
+    finally:
+        loop.close()
+
+    # uvloop leaves a watched pipe non-blocking, the results are still read in full
+    assert finished
+    assert status == "completed"
+    assert results == bytearray(RESULT_BYTES)
+
+
+def test_worker_pickles():
+    # spawn_worker pickles the worker to start it in a new process, before run() it must not hold locks or threads
+    app = worker.KaleWorker("test")
+    assert pickle.loads(pickle.dumps(app))._kale_id == "test"
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_spawned_worker_runs_tasks(monkeypatch, tmp_path):
+    # needs the web service itself
+    pytest.importorskip("sanic.app")
+    monkeypatch.chdir(tmp_path)
+
+    # no manager listens on mport, the worker only logs that it could not register
+    process, client = worker.start_worker(mport=_free_port(), handoff_threshold=None)
+    try:
+        task_id = client.register_function_task(max, ((3, 7),))
+        client.start_task(task_id)
+        client.wait_task(task_id, timeout=60)
+        assert client.get_task_output(task_id) == 7
+    finally:
+        process.terminate()
+        process.join()